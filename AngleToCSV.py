@@ -6,24 +6,102 @@ and write them to a csv file of hourly data"""
 __author__ = "Andrew Seitz"
 __status__ = "v1.0"
 
-import pymssql
+import os
+import sqlQueries
 from datetime import datetime, timedelta
-from sunCalc import SunCalc as SC
-import pandas as pd
+from sunCalc import SunCalc as SC, year_times
+import minuteFetch
+import fileWriters
+import fileReaders
+import intervalStats
+import metrics as stage_metrics
+from minuteStore import MinuteStore
+from dataSources import CSVSource
+from lazyImport import lazyImport
 import numpy as np
-import csv
+#loaded on first use, see weatherToCSV
+pymssql = lazyImport('pymssql', 'serverConnect')
+sqlite3 = lazyImport('sqlite3', 'localConnect')
+pd = lazyImport('pandas')
+multiprocessing = lazyImport('multiprocessing')
+
+#column names of the angle files (they have no header rows, the binary format stores the names)
+ANGLE_NAMES = ['TimeStamp', 'Angle']
+#sunCalc_dict keys describing the tracker and the SunCalc.tracker_calc argument they set
+TRACKER_KEYS = [('GCR','GCR'), ('AxisTilt','axis_tilt'), ('AxisAzimuth','axis_azimuth'), ('MaxAngle','max_angle'), ('Backtrack','backtrack')]
 
 
 class AngleToCSV(object):
 
-    def __init__(self, sunCalc_dict, save_location):
+    def __init__(self, sunCalc_dict, save_location, store = None, cache = None, metrics = None, interval = 60, \
+                 file_format = 'csv', precision = None, min_coverage = 0., sample_minutes = None):
+        #store is an optional minuteStore.MinuteStore (or its directory) keeping pulled minute data locally
+        #cache is an optional sunCalc.GeometryCache (or its directory) for the sun positions behind the gap fill
+        #tracker geometry for the gap fill is read from sunCalc_dict (see TRACKER_KEYS), SunCalc defaults otherwise
+        #metrics is an optional metrics.Metrics (or a hook function) recording time, rows and bytes per stage
+        #interval is the output time step in minutes (60, 30, 15, 5 or 1)
+        #file_format is 'csv', 'gzip' (compressed csv) or 'npz' (binary columns), see fileWriters.ColumnWriter
+        #precision writes angles with that many decimals instead of their full repr
+        #min_coverage (0 to 1) is the share of its samples an interval needs, intervals with fewer get the model angle
+        #like the ones without data, sample_minutes is the sample step behind it (taken from the data when not given)
+        fileWriters.fileName('', file_format)
+        self.file_format = file_format
+        self.precision = precision
+        if 60 % interval:
+            raise ValueError("interval has to divide an hour, got %s minutes" % interval)
+        self.interval = interval
+        self.min_coverage = min_coverage
+        self.sample_minutes = sample_minutes
+        self.sampleCount = None
+        self.intervalStats = None
         self.sunCalc_dict = sunCalc_dict
-        self.sunCalc_location = SC(location = sunCalc_dict)
+        self.metrics = stage_metrics.resolve(metrics)
+        self.sunCalc_location = SC(location = sunCalc_dict, cache = cache, metrics = self.metrics)
         self.save_location = save_location
+        if isinstance(store, str):
+            store = MinuteStore(store)
+        self.store = store
+        self.dialect = 'mssql'
+        #local file source (see fileConnect), None when pulling from a database connection
+        self.source = None
+        
     def serverConnect(self, user, password, server):
         #general function to connect to a server    
         self.connection = pymssql.connect(server, user, password)
         self.cursor = self.connection.cursor()
+        self.dialect = 'mssql'
+        self.source = None
+
+    def localConnect(self, db_file):
+        #connect to a local sqlite copy of the database instead (tables named like the last part of database,
+        #TimeStamp columns declared as TIMESTAMP and holding UTC 'YYYY-MM-DD HH:MM:SS' text)
+        #not tied to this thread, the fetch thread of pipelineYear reads the cursor while the caller waits
+        self.connection = sqlite3.connect(db_file, detect_types = sqlite3.PARSE_DECLTYPES, check_same_thread = False)
+        self.cursor = self.connection.cursor()
+        self.dialect = 'sqlite'
+        self.source = None
+
+    def fileConnect(self, path):
+        #read csv exports of the tables instead of a database (see dataSources.CSVSource), needs no driver
+        self.useConnection(CSVSource(path), 'file')
+
+    def useConnection(self, connection, dialect = 'mssql'):
+        #work on a connection opened elsewhere (e.g. the per worker connections of batchRunner), left open afterwards
+        #dialect 'file' takes a dataSources source instead of a connection
+        self.connection = connection
+        self.dialect = dialect
+        if dialect == 'file':
+            self.source = connection
+            self.cursor = None
+        else:
+            self.source = None
+            self.cursor = connection.cursor()
+
+    def useGeometry(self, geometry, site = None):
+        #use the sun position of a siteGeometry.SiteGeometry of many sites (row site, or the one named like
+        #sunCalc_dict) for the years it covers, the model angles then come from the matrix rows of the site
+        #instead of a sun position of its own, returns those years
+        return geometry.attach(self.sunCalc_location, site, self.interval)
 
     def serverDisconnect(self):
         self.connection.close()
@@ -34,25 +112,75 @@ class AngleToCSV(object):
         converted_date = converted_date + timedelta(hours = -sunCalc_object.TimeZone)
         return datetime.strftime(converted_date,'%m/%d/%y %H:%M')
 
-    def dateToIndex(self,date):
-        #algorithm to score a date on a 0 to 8759 hour scale
-        index = 0
-        if isinstance(date,datetime) == True:
-            #date.hour is equal to a score of 0 to 23
-            year = datetime(date.year,1,1,0,0)
-            difference = date - year
-            index = index + difference.days*24
-            index = index + difference.seconds/3600
-            return int(index)
-        else:
-            print "please pass a datetime object"
-
-    def pullMinuteData(self,date_start,date_end,database,DB_location,row):
+    def pullMinuteData(self,date_start,date_end,database,DB_location,row,chunk_size = None,aggregate = False):
         #function that pulls angle data from a database on the loaded server
         #you specify a location (a column in the database), a row (location in field)
         #and a date range to pull from
         #data will then be converted to hourly data and set a class attribute in lists
-        
+        #with a chunk_size the cursor is streamed with fetchmany into typed numpy arrays instead of lists
+        #with a local store only the time ranges not stored yet are pulled from the server (also into numpy arrays)
+        #with aggregate the server averages the rows per local output interval, self.sampleCount then holds the
+        #number of rows behind every average (per column), the local store is only used for raw minute pulls
+        #a file source (fileConnect) is always read in chunks, there is no server to aggregate and nothing to store
+
+        self.sampleCount = None
+        if self.source is not None:
+            columns = minuteFetch.collectChunks(self.pullMinuteChunks(date_start,date_end,database,DB_location,row,chunk_size or 50000), \
+                                                [minuteFetch.VALUE_DTYPE])
+            self.timestamp, self.angles = columns
+            return
+
+        if aggregate:
+            self.executeMinuteQuery(date_start,date_end,database,DB_location,row,execute = False)
+            self.queryMinuteData(self.date_start_UTC,self.date_end_UTC,aggregate = True)
+            dtypes = [minuteFetch.VALUE_DTYPE, np.int64]
+            #interval stamps come back in local time already
+            columns = minuteFetch.collectChunks(self.metrics.chunks('fetch', minuteFetch.fetchChunks(self.cursor, chunk_size or 50000, 0, dtypes)), dtypes)
+            self.timestamp, self.angles = columns[:2]
+            self.sampleCount = dict(zip(['angles'], columns[2:]))
+            return
+
+        if self.store is not None:
+            self.executeMinuteQuery(date_start,date_end,database,DB_location,row,execute = False)
+            with self.metrics.stage('store') as stage:
+                columns = self.store.pull((database, DB_location, row), self.date_start_UTC, self.date_end_UTC, self.queryMinuteData, \
+                                          [minuteFetch.VALUE_DTYPE], chunk_size or 50000)
+                stage.count(rows = len(columns[0]), bytes = sum(column.nbytes for column in columns))
+            columns[0] = columns[0] + np.timedelta64(int(round(self.sunCalc_location.TimeZone*60)), 'm') #convert back to local time
+            self.timestamp, self.angles = columns
+            return
+
+        if chunk_size:
+            columns = minuteFetch.collectChunks(self.pullMinuteChunks(date_start,date_end,database,DB_location,row,chunk_size), \
+                                                [minuteFetch.VALUE_DTYPE])
+            self.timestamp, self.angles = columns
+            return
+
+        self.executeMinuteQuery(date_start,date_end,database,DB_location,row)
+        #temp storage
+        self.timestamp = []
+        self.angles = []
+        #store from cursor
+        with self.metrics.stage('fetch') as stage:
+            for row in self.cursor:
+                self.timestamp.append(row[0] + timedelta(hours = self.sunCalc_location.TimeZone)) #convert back to local time
+                self.angles.append(row[1])
+            stage.count(rows = len(self.timestamp))
+
+    def pullMinuteChunks(self,date_start,date_end,database,DB_location,row,chunk_size = 50000):
+        #generator version of pullMinuteData, yields [timestamp, angles] numpy arrays of at most
+        #chunk_size rows (timestamps already in local time) so memory stays bounded for any date range
+        self.executeMinuteQuery(date_start,date_end,database,DB_location,row,execute = self.source is None)
+        dtypes = [minuteFetch.VALUE_DTYPE]
+        if self.source is not None:
+            chunks = self.source.chunks(database, sqlQueries.ANGLE_COLUMNS, DB_location, self.date_start_UTC, self.date_end_UTC, \
+                                        dtypes, chunk_size, self.sunCalc_location.TimeZone, row = row)
+        else:
+            chunks = minuteFetch.fetchChunks(self.cursor, chunk_size, self.sunCalc_location.TimeZone, dtypes)
+        for chunk in self.metrics.chunks('fetch', chunks):
+            yield chunk
+
+    def executeMinuteQuery(self,date_start,date_end,database,DB_location,row,execute = True):
         #write the attributes
         self.date_start = date_start
         self.date_end = date_end
@@ -60,63 +188,50 @@ class AngleToCSV(object):
         self.DB_location = DB_location
         self.row = row
         
-        date_start_UTC = self.convertToUTC(date_start,self.sunCalc_location)
-        date_end_UTC = self.convertToUTC(date_end,self.sunCalc_location)
-        sqlQuery = """select TimeStamp, Angle from %s where Location ='%s' and TimeStamp >= '%s' and TimeStamp <= '%s' \
-                    and Name = '%s' order by timestamp asc""" % (database, DB_location, date_start_UTC,date_end_UTC,self.row)
-        self.cursor.execute(sqlQuery)
-        #temp storage
-        self.timestamp = []
-        self.angles = []
-        #store from cursor
-        for row in self.cursor:
-            self.timestamp.append(row[0] + timedelta(hours = self.sunCalc_location.TimeZone)) #convert back to local time
-            self.angles.append(row[1])
+        self.date_start_UTC = self.convertToUTC(date_start,self.sunCalc_location)
+        self.date_end_UTC = self.convertToUTC(date_end,self.sunCalc_location)
+        if execute:
+            self.queryMinuteData(self.date_start_UTC,self.date_end_UTC)
+
+    def queryMinuteData(self,date_start_UTC,date_end_UTC,aggregate = False):
+        #runs the minute query for the stored database/location between two UTC time strings
+        #aggregate asks for averages and counts per local output interval instead (see sqlQueries.minuteQuery)
+        sqlQuery = sqlQueries.minuteQuery(self.dialect, self.database, sqlQueries.ANGLE_COLUMNS, self.DB_location, \
+                                          date_start_UTC, date_end_UTC, row = self.row, aggregate = aggregate, time_shift = self.sunCalc_location.TimeZone, \
+                                          interval = self.interval)
+        with self.metrics.stage('query'):
+            self.cursor.execute(sqlQuery)
+        return self.cursor
             
+    def hourlyAngles(self):
+        #DataFrame of the mean angle of the pulled minute data per output interval (hourly by default),
+        #one row per interval from the first to the last sample, intervals under min_coverage are nan
+        #self.intervalStats keeps the sample count of every interval (see intervalStats.aggregate)
+        with self.metrics.stage('aggregate', rows = len(self.timestamp)):
+            counts = None
+            if self.sampleCount is not None:
+                if self.min_coverage and self.sample_minutes is None:
+                    raise ValueError("min_coverage on aggregated pulls needs the sample_minutes of the raw data")
+                counts = self.sampleCount['angles']
+            self.intervalStats = intervalStats.aggregate(self.timestamp, [self.angles], self.interval, self.min_coverage, \
+                                                         self.sample_minutes, counts, extremes = False)
+            hour_matrix = pd.DataFrame(self.intervalStats['mean'], index = pd.DatetimeIndex(self.intervalStats['time'].astype('datetime64[ns]')), \
+                                       columns = ['angles'])
+        return hour_matrix
+
     def constructBetweenDates(self):
         #construct an angle file between the two dates given by hour (so if 1 day given you get 24 data points)
-        #missing data is supplemented by angles provided by SAM NREL backtracking algorithm
+        #or by output interval when one below an hour is set
+        #missing data is supplemented by angles from the backtracking model in SunCalc.tracker_calc
         
-        #algorthim for converting 5 minute date to hourly averages
-        #need numpy arrays in column format (need to transpose the list)
-        #making sure not to modify self.timestamp
-        timestamp = np.array(self.timestamp)
-        timestamp = np.transpose(timestamp)
-        #create a 2d array 6 columns by x rows
-        min_matrix = np.array(self.angles)
-        min_matrix = np.transpose(min_matrix)
-        #create data fram and set my index to my time numpy array
-        min_matrix = pd.DataFrame(min_matrix,index = timestamp, columns= ['angles'])
-        #average the 5 minute data by taking the mean over an hour (very flexible)
-        hour_matrix = min_matrix.resample('H', how='mean')
-
-        #pull data from pandas DataFrame Object
-        datetime_list = hour_matrix.index.to_pydatetime()
-        angles_list = [item for item in hour_matrix['angles'].get_values()]
-
-        #365 days of data
-        SAM_angles = []
-        with open('1axisRotValues.csv', 'r') as f:
-            csv_read = csv.reader(f,delimiter = ',')
-            for row in csv_read:
-                SAM_angles.append(row[1])
+        hour_matrix = self.hourlyAngles()
 
         #segment of code accounts for the possibility of missing data
-        #added precalculated SAM data in place of NaN type given by pandas
-        filled_angles = []
-        i = 0
-        for angle in angles_list:
-            if pd.isnull(angle):
-                #angles_list has variable number of days so we need to determine from where in SAM_angle to pull from
-                filled_angles.append(SAM_angles[self.dateToIndex(datetime_list[i])])
-                i = i + 1
-            else:
-                filled_angles.append(float(angles_list[i]))
-                i = i + 1
- 
-        self.data = []
-        for i in range(len(datetime_list)):
-            self.data.append([datetime_list[i],filled_angles[i]])
+        #hours pandas left as NaN get the angle of the backtracking model instead
+        angles = hour_matrix['angles'].values
+        filled_angles = np.where(np.isnan(angles), self.trackerAngles(hour_matrix.index.values), angles)
+
+        self.dataColumns = [hour_matrix.index.values, filled_angles]
         
         save_date_start = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
         save_date_start = datetime.strftime(save_date_start,'%m%d%y%H')
@@ -124,90 +239,270 @@ class AngleToCSV(object):
         save_date_end = datetime.strftime(save_date_end,'%m%d%y%H')
 
         file_name = r"Angles from %s at %s(%s)_(%s - %s).csv" % (self.row, self.sunCalc_dict['Name'],self.DB_location,save_date_start,save_date_end)
+        file_name = fileWriters.fileName(file_name, self.file_format)
         print file_name
 
-        with open(file_name,'w') as f:
-            csv_write = csv.writer(f,lineterminator = '\n',delimiter = ',')
-            for row in self.data:
-                csv_write.writerow(row)
+        with self.metrics.stage('write', rows = len(filled_angles), files = 1):
+            writeAngleFile((file_name, [], ANGLE_NAMES, self.dataColumns, self.file_format, self.precision))
+
+    @property
+    def data(self):
+        #the angle file as a list of (datetime, angle) rows, built from self.dataColumns on demand
+        times, angles = self.dataColumns
+        return list(zip(pd.DatetimeIndex(times).to_pydatetime(), angles.tolist()))
 
-    def constructYear(self):
-        #smartly constructs a year length file of angles for NREL SAM simulations
+    def constructYear(self, workers = None, update = False):
+        #smartly constructs year length files of angles for NREL SAM simulations
         #this file contains values from the database from the data range given
-        #rest of values supplemented from previous SAM calculation
-        
-        #check to see if the data given exceeds a 1 year range (i.e. from 2013-2014)
-        #this is maintain compliance with SAM
+        #rest of values supplemented from the backtracking model in SunCalc.tracker_calc
+        #a date range over several calendar years (i.e. from 2013-2014) gives one file per year
+        #all in one pass over the range, workers > 1 writes the files in parallel, returns the names of the files written
+        #update only patches the intervals of the pulled data into the files there are (see updateYear)
         upperBound = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
         lowerBound = datetime.strptime(self.date_end, '%m/%d/%y %I:%M')
 
-        if upperBound.year == lowerBound.year:
-            #algorthim for converting 5 minute date to hourly averages
-            #need numpy arrays in column format (need to transpose the list)
-            #making sure not to modify self.timestamp
-            timestamp = np.array(self.timestamp)
-            timestamp = np.transpose(timestamp)
-            #create a 2d array 6 columns by x rows
-            min_matrix = np.array(self.angles)
-            min_matrix = np.transpose(min_matrix)
-            #create data fram and set my index to my time numpy array
-            min_matrix = pd.DataFrame(min_matrix,index = timestamp, columns= ['angles'])
-            #average the 5 minute data by taking the mean over an hour (very flexible)
-            hour_matrix = min_matrix.resample('H', how='mean')
-
-            #fill in empty data for the year from which you are collecting
-            #doesn't matter which you choose and lower and upper are equal in this case
-            year_value = upperBound.year
-            stringLower = '%s-01-01 00:00:00' % (year_value)
-            stringUpper = '%s-12-31 23:00:00' % (year_value)
-            idx = pd.date_range(stringLower,stringUpper, freq = 'H')
-            idx = pd.DatetimeIndex(idx)
-            year_matrix = hour_matrix.reindex(index=idx)
-            
-            #pull data from pandas DataFrame Object
-            datetime_list = year_matrix.index.to_pydatetime()
-            angles_list = [item for item in year_matrix['angles'].get_values()]
+        if upperBound.year <= lowerBound.year:
+            if update:
+                files = self.updateYear()
+                if files is not None:
+                    return files
 
-            #365 days of data
-            SAM_angles = []
-            with open('1axisRotValues.csv', 'r') as f:
-                csv_read = csv.reader(f,delimiter = ',')
-                for row in csv_read:
-                    SAM_angles.append(row[1])
+            hour_matrix = self.hourlyAngles()
 
-            #segment of code accounts for the possibility of missing data
-            #added precalculated SAM data in place of NaN type given by pandas
-            filled_angles = []
-            i = 0
-            for angle in angles_list:
-                if pd.isnull(angle):
-                    filled_angles.append(SAM_angles[i])
-                    i = i + 1
-                else:
-                    filled_angles.append(float(angles_list[i]))
-                    i = i + 1
-     
-            self.data = []
-            for i in range(len(datetime_list)):
-                self.data.append([datetime_list[i],filled_angles[i]])
-            
-            save_date_start = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
-            save_date_start = datetime.strftime(save_date_start,'%m%d%y%H')
-            save_date_end = datetime.strptime(self.date_end, '%m/%d/%y %I:%M')
-            save_date_end = datetime.strftime(save_date_end,'%m%d%y%H')
+            #fill in empty data for every year from which you are collecting
+            #one contiguous index of output intervals from Jan 1 of the first year to Dec 31 of the last
+            years = range(upperBound.year, lowerBound.year + 1)
+            idx = yearIndex(years, self.interval)
+            year_matrix = hour_matrix.reindex(index=idx)
 
-            file_name = r"Angles from %s at %s(%s)_(%s).csv" % (self.row, self.sunCalc_dict['Name'],self.DB_location,year_value)
-            print file_name
+            #segment of code accounts for the possibility of missing data
+            #hours pandas left as NaN get the angle of the backtracking model instead
+            angles = year_matrix['angles'].values
+            filled_angles = np.where(np.isnan(angles), self.trackerAngles(year_matrix.index.values), angles)
+
+            self.dataColumns = [year_matrix.index.values, filled_angles]
+
+            #cut the hours into their calendar years
+            tasks = []
+            for year_value, in_year in yearSlices(years, self.interval):
+                file_name = fileWriters.fileName(self.yearFileName(self.row, year_value), self.file_format)
+                print file_name
+                tasks.append((file_name, [], ANGLE_NAMES, [column[in_year] for column in self.dataColumns], self.file_format, self.precision))
+            with self.metrics.stage('write', rows = len(filled_angles), files = len(tasks)):
+                files = writeAngleFiles(tasks, workers)
+            return files
 
-            with open(file_name,'w') as f:
-                csv_write = csv.writer(f,lineterminator = '\n',delimiter = ',')
-                for row in self.data:
-                    csv_write.writerow(row)
+        else:
+            raise ValueError("please enter a date range that does not end before it starts: %s - %s" % (self.date_start, self.date_end))
+
+    def updateYear(self):
+        #update mode of constructYear, like WeatherToCSV.updateYear: the intervals from date_start to the last
+        #pulled sample are written over the same rows of the existing yearly angle files
+        #returns the names of the files, None when a file is not there yet
+        hour_matrix = self.hourlyAngles()
+        times = hour_matrix.index.values.astype('datetime64[m]')
+        return self.patchAngleFiles([self.row], times, hour_matrix['angles'].values[np.newaxis,:])
+
+    def patchAngleFiles(self, rows, times, angles):
+        #writes the (rows x times) interval means, nan where there was no data, over the same rows of the yearly
+        #files of the rows, nan intervals get the backtracking model like in a whole build
+        #self.updatedRows gets the number of rows that changed per file
+        in_years = fileWriters.updateIntervals(times, self.date_start, self.interval)
+        files = [[fileWriters.fileName(self.yearFileName(row, year_value), self.file_format) for year_value, in_year in in_years] \
+                 for row in rows]
+        missing = [file_name for row_files in files for file_name in row_files if not os.path.exists(file_name)]
+        if missing:
+            print "%s not built yet, building whole years" % ', '.join(missing)
+            return None
+
+        model = self.trackerAngles(times) if len(times) else times.astype(np.float64)
+        self.updatedRows = {}
+        for row_files, row_angles in zip(files, angles):
+            filled_angles = np.where(np.isnan(row_angles), model, row_angles)
+            for file_name, (year_value, in_year) in zip(row_files, in_years):
+                first_row = (times[in_year][0] - np.datetime64('%s-01-01' % year_value, 'm')).astype(np.int64)//self.interval
+                with self.metrics.stage('write', rows = in_year.sum(), files = 1):
+                    self.updatedRows[file_name] = fileWriters.patchColumns(file_name, [], ANGLE_NAMES, first_row, \
+                                                                           [times[in_year], filled_angles[in_year]], \
+                                                                           self.file_format, self.precision)
+                print "%s: %s rows changed" % (file_name, self.updatedRows[file_name])
+        return [file_name for row_files in files for file_name in row_files]
+
+    def updateStart(self, DB_location, row, year_value):
+        #date_start for pullMinuteData/pullRows before an update: the start of the last interval of the year file of
+        #row at DB_location that is not the backtracking model (so holds data), Jan 1 when there is none yet
+        #the date strings have no AM/PM, an afternoon start comes out 12 hours early and pulls those hours again
+        file_name = fileWriters.fileName(self.yearFileName(row, year_value, DB_location), self.file_format)
+        times = year_times(year_value, year_value, self.interval)
+        start = times[0]
+        if os.path.exists(file_name):
+            angles = fileReaders.readTable(file_name, 0, ANGLE_NAMES, ['Angle'], [np.float64])[0]
+            model = self.trackerAngles(times)
+            if self.precision is not None and self.file_format != 'npz':
+                #the model as it was written to the file
+                model = np.array(fileWriters.formatColumn(model, self.precision), dtype = np.float64)
+            with_data = np.flatnonzero(angles != model)
+            if len(with_data):
+                start = times[with_data[-1]]
+        return datetime.strftime(start.astype(datetime), '%m/%d/%y %I:%M')
+
+    def trackerAngles(self, times):
+        #backtracking model angles for local times on the output interval grid, memoized by SunCalc per site and year
+        tracker = dict((argument, self.sunCalc_dict[key]) for key, argument in TRACKER_KEYS if key in self.sunCalc_dict)
+        return self.sunCalc_location.tracker_angles(times, self.interval, **tracker)
+
+    def yearFileName(self, row, year_value, DB_location = None):
+        #yearly angle file name, files below an hour are marked with their interval
+        DB_location = DB_location or self.DB_location
+        if self.interval < 60:
+            return r"Angles from %s at %s(%s)_(%s)_%smin.csv" % (row, self.sunCalc_dict['Name'],DB_location,year_value,self.interval)
+        return r"Angles from %s at %s(%s)_(%s).csv" % (row, self.sunCalc_dict['Name'],DB_location,year_value)
+
+    def pullRows(self,date_start,date_end,database,DB_location,rows,chunk_size = 50000,rows_per_query = 100):
+        #batch version of pullMinuteData for many rows (Names) of one location
+        #asks for rows_per_query rows per query instead of one query per row, every sample ends up in the flat
+        #arrays self.timestamp and self.angles with self.rowIndex giving the position of its row in self.rows
+        chunks = self.pullRowChunks(date_start,date_end,database,DB_location,rows,chunk_size,rows_per_query)
+        self.timestamp, self.angles, self.rowIndex = minuteFetch.collectChunks(chunks, [minuteFetch.VALUE_DTYPE, np.int64])
+
+    def pullRowChunks(self,date_start,date_end,database,DB_location,rows,chunk_size = 50000,rows_per_query = 100):
+        #generator version of pullRows, yields [timestamp, angles, row index] numpy arrays of at most chunk_size
+        #samples (timestamps in local time, row index the position of the row in self.rows) for any date range
+        self.date_start = date_start
+        self.date_end = date_end
+        self.database = database
+        self.DB_location = DB_location
+        self.rows = list(rows)
+        self.date_start_UTC = self.convertToUTC(date_start,self.sunCalc_location)
+        self.date_end_UTC = self.convertToUTC(date_end,self.sunCalc_location)
+        #rows are matched on the names as the server compares them, see rowKey
+        position = dict((rowKey(name), i) for i, name in enumerate(self.rows))
+        if len(position) < len(self.rows):
+            raise ValueError("some rows differ only in case or spaces, the database cannot tell them apart: %s" % ', '.join(repr(name) for name in self.rows))
+
+        dtypes = [minuteFetch.VALUE_DTYPE, object]
+        #a file source is read once for all rows, there is no query size to keep down
+        step = max(len(self.rows), 1) if self.source is not None else rows_per_query
+        for i in range(0, len(self.rows), step):
+            group = self.rows[i:i + step]
+            if self.source is not None:
+                chunks = self.source.chunks(database, sqlQueries.ANGLE_COLUMNS, DB_location, self.date_start_UTC, self.date_end_UTC, \
+                                            dtypes, chunk_size, self.sunCalc_location.TimeZone, names = group)
+            else:
+                sqlQuery = sqlQueries.minuteQuery(self.dialect, database, sqlQueries.ANGLE_COLUMNS, DB_location, \
+                                                  self.date_start_UTC, self.date_end_UTC, names = group)
+                with self.metrics.stage('query'):
+                    self.cursor.execute(sqlQuery)
+                chunks = minuteFetch.fetchChunks(self.cursor, chunk_size, self.sunCalc_location.TimeZone, dtypes)
+            for timestamp, angles, names in self.metrics.chunks('fetch', chunks):
+                #group by Name on the arrays: map every distinct name once, then every sample through the inverse index
+                unique_names, inverse = np.unique(names, return_inverse = True)
+                row_index = np.array([position.get(rowKey(name), -1) for name in unique_names], dtype = np.int64)[inverse]
+                if row_index.min() < 0:
+                    print "dropping samples of rows not asked for: %s" % ', '.join(repr(name) for name in unique_names if rowKey(name) not in position)
+                    asked = row_index >= 0
+                    timestamp, angles, row_index = timestamp[asked], angles[asked], row_index[asked]
+                yield [timestamp, angles, row_index]
+
+    def constructRowsYear(self, workers = None, update = False):
+        #constructYear for every row loaded by pullRows, one angle file per row and calendar year
+        #interval averages of all rows come out of a single bincount over (row, interval of the range), the gap fill
+        #is one masked select on the rows x hours table, workers > 1 writes the files in parallel
+        #update patches the intervals of the pulled data into the files there are (see updateRowsYear)
+        #returns the names of the files written
+        upperBound = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
+        lowerBound = datetime.strptime(self.date_end, '%m/%d/%y %I:%M')
 
+        if upperBound.year <= lowerBound.year:
+            if update:
+                files = self.updateRowsYear()
+                if files is not None:
+                    return files
+
+            years = range(upperBound.year, lowerBound.year + 1)
+            idx = yearIndex(years, self.interval)
+            hours = len(idx)
+            rows = len(self.rows)
+
+            with self.metrics.stage('aggregate', rows = len(self.timestamp)):
+                hour_index = (self.timestamp.astype('datetime64[m]') - np.datetime64('%s-01-01' % years[0], 'm')).astype(np.int64)//self.interval
+                valid = (hour_index >= 0) & (hour_index < hours) & ~np.isnan(self.angles)
+                flat_index = self.rowIndex[valid]*hours + hour_index[valid]
+                sums = np.bincount(flat_index, weights = self.angles[valid], minlength = rows*hours).reshape(rows, hours)
+                counts = np.bincount(flat_index, minlength = rows*hours).reshape(rows, hours)
+
+            #missing intervals (and ones under min_coverage) get the backtracking model angle, the same for every row
+            with np.errstate(divide='ignore', invalid='ignore'):
+                filled_angles = np.where(counts >= self.minimumSamples(), sums/counts, self.trackerAngles(idx.values)[np.newaxis,:])
+
+            tasks = []
+            for i in range(rows):
+                for year_value, in_year in yearSlices(years, self.interval):
+                    file_name = fileWriters.fileName(self.yearFileName(self.rows[i], year_value), self.file_format)
+                    print file_name
+                    tasks.append((file_name, [], ANGLE_NAMES, [idx.values[in_year], filled_angles[i, in_year]], self.file_format, self.precision))
+            with self.metrics.stage('write', rows = filled_angles.size, files = len(tasks)):
+                files = writeAngleFiles(tasks, workers)
+            return files
         else:
-            print "please enter a date range with the same calendar year"
-            print "This is to insure compliance with NREL SAM weather files"
-        
+            raise ValueError("please enter a date range that does not end before it starts: %s - %s" % (self.date_start, self.date_end))
+
+    def minimumSamples(self):
+        #samples of the pulled rows an interval needs to count (see intervalStats.minimumSamples), at least one
+        return max(intervalStats.minimumSamples(self.timestamp, self.interval, self.min_coverage, self.sample_minutes), 1)
+
+    def updateRowsYear(self):
+        #update mode of constructRowsYear: the bincount only spans the intervals from date_start to the last
+        #pulled sample of any row, which are written over the same rows of the existing files of every row
+        #returns the names of the files, None when a file is not there yet
+        origin = np.datetime64(datetime.strptime(self.date_start, '%m/%d/%y %I:%M'), 'm')
+        origin = np.datetime64(origin.astype(np.int64)//self.interval*self.interval, 'm')
+        rows = len(self.rows)
+        with self.metrics.stage('aggregate', rows = len(self.timestamp)):
+            hour_index = (self.timestamp.astype('datetime64[m]') - origin).astype(np.int64)//self.interval
+            valid = (hour_index >= 0) & ~np.isnan(self.angles)
+            hours = hour_index[valid].max() + 1 if valid.any() else 0
+            flat_index = self.rowIndex[valid]*hours + hour_index[valid]
+            sums = np.bincount(flat_index, weights = self.angles[valid], minlength = rows*hours).reshape(rows, hours)
+            counts = np.bincount(flat_index, minlength = rows*hours).reshape(rows, hours)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            angles = np.where(counts >= self.minimumSamples(), sums/counts, np.nan)
+        times = origin + np.arange(hours)*np.timedelta64(self.interval, 'm')
+        return self.patchAngleFiles(self.rows, times, angles)
+
+
+def rowKey(name):
+    #a row Name as SQL Server's default collation compares it in Name in (...): case blind, outer spaces ignored,
+    #so 'row 1' and 'Row 1 ' coming back for a requested 'Row 1' land on that row
+    return ('%s' % name).strip().lower()
+
+def yearIndex(years, interval = 60):
+    #index every interval minutes from Jan 1 00:00 of the first year to the end of Dec 31 of the last
+    return pd.DatetimeIndex(year_times(years[0], years[-1], interval).astype('datetime64[ns]'))
+
+def yearSlices(years, interval = 60):
+    #(year, slice of a yearIndex) for every calendar year, 8760 hours or 8784 in leap years
+    start = 0
+    for year_value in years:
+        end = start + len(year_times(year_value, year_value, interval))
+        yield year_value, slice(start, end)
+        start = end
+
+def writeAngleFile(task):
+    #writes one (file_name, header rows, column names, [times, angles], file_format, precision) angle file,
+    #module level so a multiprocessing pool can run it
+    return fileWriters.writeColumns(*task)
+
+def writeAngleFiles(tasks, workers = None):
+    #writes every task, in a pool of workers processes when workers > 1, returns the names of the files written
+    if workers and workers > 1:
+        pool = multiprocessing.Pool(workers)
+        files = pool.map(writeAngleFile, tasks)
+        pool.close()
+        pool.join()
+        return files
+    return [writeAngleFile(task) for task in tasks]
+
 def example():
     #example code of how you would generate a yearly angle file from a few days of field data
     #inputs
@@ -0,0 +1,275 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Runs the weather and angle files of a JSON manifest (sites, locations,
+tracker rows, date ranges) in a pool of worker processes, each keeping its
+database connection open across jobs. Finished jobs go to a checkpoint file
+so an interrupted run picks up where it stopped
+
+usage: python batchRunner.py manifest.json --workers 4"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import argparse
+import traceback
+import multiprocessing
+from lazyImport import lazyImport
+from dataSources import CSVSource
+from weatherToCSV import WeatherToCSV
+from AngleToCSV import AngleToCSV
+from trackerAnalytics import TrackerAnalytics
+pymssql = lazyImport('pymssql', 'server connections')
+sqlite3 = lazyImport('sqlite3', 'db_file connections')
+
+#manifest layout, paths are relative to the manifest:
+#   {"output": "files",
+#    "connection": {"server": "monitoring.example.com", "user": "reader", "password_env": "SOLARDB_PASSWORD"},
+#                  (or {"db_file": "solardb.sqlite"} for a local sqlite copy, {"files": "exports"} for csv exports of
+#                   the tables (see dataSources.CSVSource), "password" works too)
+#    "defaults": {"interval": 60, "chunk_size": 50000, "cache": "geometry"},
+#    "sites": {"Tucson": {"Name": "Tucson", "latitude": "32.1025", ... the sunCalc_dict}},
+#    "jobs": [{"kind": "weather", "site": "Tucson", "location": "SolarZone", "database": "solardb.dbo.Weather",
+#              "start": "01/01/15 07:00", "end": "06/15/15 08:00"},
+#             {"kind": "angle", "site": "Tucson", "location": "SolarZone", "database": "solardb.dbo.SunBase4t",
+#              "rows": ["TEP 53", "TEP 54"], "start": "03/10/15 07:00", "end": "06/23/15 07:00"}]}
+#every job takes the defaults it does not set itself, "row" instead of "rows" runs a single row through constructYear
+#"kind": "analytics" with "rows" writes the trackerAnalytics tables of the rows instead of angle files
+
+#job keys passed on to the converters
+WEATHER_OPTIONS = ['cache', 'engine', 'store', 'interval', 'file_format', 'precision', 'gap_fill', 'max_gap', 'min_coverage', \
+                   'sample_minutes', 'sun_step']
+ANGLE_OPTIONS = ['store', 'cache', 'interval', 'file_format', 'precision', 'min_coverage', 'sample_minutes']
+ANALYTICS_OPTIONS = ['cache', 'tolerance', 'stuck_range', 'moving_range', 'min_stuck_hours']
+#job keys holding paths
+PATHS = ['cache', 'store']
+CHECKPOINT = 'checkpoint.jsonl'
+
+
+def loadManifest(file_name):
+    #(output directory, connection settings, list of jobs) of a manifest, every job with its defaults,
+    #its sunCalc_dict under 'site', absolute paths and an 'id' (the job's own or a hash of its settings)
+    with open(file_name, 'r') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(file_name))
+    output = os.path.join(base, manifest.get('output', '.'))
+    connection = dict(manifest['connection'])
+    for key in ['db_file', 'files']:
+        if key in connection:
+            connection[key] = str(os.path.join(base, connection[key]))
+    jobs = []
+    for entry in manifest['jobs']:
+        job = dict(manifest.get('defaults', {}))
+        job.update(entry)
+        if not isinstance(job['site'], dict):
+            job['site'] = manifest['sites'][job['site']]
+        for key in PATHS:
+            if job.get(key):
+                #str, the converters take a directory name for these (json gives unicode on python 2)
+                job[key] = str(os.path.join(base, job[key]))
+        if 'id' not in job:
+            job['id'] = hashlib.md5(json.dumps(job, sort_keys = True).encode('utf-8')).hexdigest()[:12]
+        jobs.append(job)
+    ids = [job['id'] for job in jobs]
+    if len(set(ids)) < len(ids):
+        raise ValueError("the manifest has the same job twice: %s" % ', '.join(sorted(set(i for i in ids if ids.count(i) > 1))))
+    return output, connection, jobs
+
+
+class ConnectionPool(object):
+    #one open connection per connection settings, handed out again for every job of this process
+
+    def __init__(self):
+        self.connections = {}
+
+    def get(self, settings):
+        #(connection, dialect) for the settings, opened the first time
+        key = json.dumps(settings, sort_keys = True)
+        if key not in self.connections:
+            if 'files' in settings:
+                self.connections[key] = (CSVSource(settings['files']), 'file')
+            elif 'db_file' in settings:
+                self.connections[key] = (sqlite3.connect(settings['db_file'], detect_types = sqlite3.PARSE_DECLTYPES, \
+                                                          check_same_thread = False), 'sqlite')
+            else:
+                password = settings.get('password') or os.environ[settings['password_env']]
+                self.connections[key] = (pymssql.connect(settings['server'], settings['user'], password), 'mssql')
+        return self.connections[key]
+
+    def discard(self, settings):
+        #drops a connection that may be broken, the next get opens a new one
+        connection = self.connections.pop(json.dumps(settings, sort_keys = True), None)
+        if connection is not None:
+            try:
+                connection[0].close()
+            except Exception:
+                pass
+
+    def close(self):
+        for key in list(self.connections):
+            self.connections.pop(key)[0].close()
+
+#the connections of this process (every pool worker has its own)
+_POOL = ConnectionPool()
+
+
+class Checkpoint(object):
+    #append only JSON lines file with one record per finished job: {"job": id, "files": [...], "seconds": ...}
+    #every record is flushed to disk before the next job is counted, a line cut off by a crash is ignored
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.records = {}
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[record['job']] = record
+
+    def finished(self, job_id):
+        #the job ran before, wrote files and all of them are still there
+        record = self.records.get(job_id)
+        return record is not None and bool(record['files']) and all(os.path.exists(name) for name in record['files'])
+
+    def record(self, job_id, files, seconds):
+        record = {'job': job_id, 'files': files, 'seconds': round(seconds, 3)}
+        with open(self.file_name, 'a') as f:
+            f.write(json.dumps(record, sort_keys = True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[job_id] = record
+
+
+def weatherJob(job, connection, dialect):
+    converter = WeatherToCSV(job['site'], '.', **dict((key, job[key]) for key in WEATHER_OPTIONS if key in job))
+    converter.useConnection(connection, dialect)
+    converter.pullMinuteData(job['start'], job['end'], job['database'], job['location'], job.get('chunk_size'))
+    return converter.constructYear()
+
+def angleJob(job, connection, dialect):
+    angler = AngleToCSV(job['site'], '.', **dict((key, job[key]) for key in ANGLE_OPTIONS if key in job))
+    angler.useConnection(connection, dialect)
+    if 'rows' in job:
+        angler.pullRows(job['start'], job['end'], job['database'], job['location'], job['rows'], job.get('chunk_size') or 50000)
+        return angler.constructRowsYear()
+    angler.pullMinuteData(job['start'], job['end'], job['database'], job['location'], job['row'], job.get('chunk_size'))
+    return angler.constructYear()
+
+def analyticsJob(job, connection, dialect):
+    angler = AngleToCSV(job['site'], '.')
+    angler.useConnection(connection, dialect)
+    analytics = TrackerAnalytics(job['site'], job['rows'], job['start'], job['end'], \
+                                 **dict((key, job[key]) for key in ANALYTICS_OPTIONS if key in job))
+    analytics.addChunks(angler.pullRowChunks(job['start'], job['end'], job['database'], job['location'], job['rows'], \
+                                             job.get('chunk_size') or 50000))
+    file_name = 'Tracking at %s(%s)_(%s)' % (job['site']['Name'], job['location'], job['id'])
+    return analytics.write(file_name, job.get('file_format', 'csv'), job.get('precision'))
+
+#job 'kind' -> function(job, connection, dialect) returning the files it wrote
+JOB_KINDS = {'weather': weatherJob, 'angle': angleJob, 'analytics': analyticsJob}
+
+
+def startWorker(directory):
+    #pool initializer, files are written to the working directory and ctrl-c is left to the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.chdir(directory)
+
+def runJob(arguments):
+    #runs one job in this process on its pooled connection, returns (job id, files, seconds, error text or None)
+    job, settings = arguments
+    start = time.time()
+    try:
+        connection, dialect = _POOL.get(settings)
+        files = JOB_KINDS[job['kind']](job, connection, dialect)
+    except Exception:
+        _POOL.discard(settings)
+        return job['id'], [], time.time() - start, traceback.format_exc()
+    #a job that wrote nothing did not do its work, it must not be checkpointed as finished
+    if not files:
+        return job['id'], [], time.time() - start, "job %s wrote no files\n" % job['id']
+    return job['id'], files, time.time() - start, None
+
+def runBatch(output, settings, jobs, workers = 1, checkpoint_file = None, restart = False):
+    #runs every job not finished in the checkpoint yet, workers > 1 runs them in a pool of processes
+    #returns {'done': [...], 'skipped': [...], 'failed': {job id: error text}}
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    checkpoint_file = checkpoint_file or os.path.join(output, CHECKPOINT)
+    if restart and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    checkpoint = Checkpoint(checkpoint_file)
+    skipped = [job['id'] for job in jobs if checkpoint.finished(job['id'])]
+    todo = [(job, settings) for job in jobs if job['id'] not in skipped]
+    result = {'done': [], 'skipped': skipped, 'failed': {}}
+    if skipped:
+        print "%s of %s jobs already finished, resuming" % (len(skipped), len(jobs))
+
+    def finish(job_id, files, seconds, error):
+        if error is None:
+            checkpoint.record(job_id, [os.path.join(output, name) for name in files], seconds)
+            result['done'].append(job_id)
+        else:
+            result['failed'][job_id] = error
+            sys.stderr.write("job %s failed:\n%s" % (job_id, error))
+        print "[%s/%s] job %s %s in %.1f s" % (len(result['done']) + len(result['failed']), len(todo), job_id, \
+                                               'failed' if error else 'done', seconds)
+
+    if workers and workers > 1:
+        pool = multiprocessing.Pool(workers, startWorker, (output,))
+        try:
+            #imap with a timeout so ctrl-c reaches the parent on python 2
+            results = pool.imap_unordered(runJob, todo)
+            for i in range(len(todo)):
+                finish(*results.next(timeout = 1e9))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            print "interrupted, run again to resume"
+            raise
+        finally:
+            pool.join()
+    else:
+        cwd = os.getcwd()
+        os.chdir(output)
+        try:
+            for task in todo:
+                finish(*runJob(task))
+        except KeyboardInterrupt:
+            print "interrupted, run again to resume"
+            raise
+        finally:
+            os.chdir(cwd)
+            _POOL.close()
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'runs the weather and angle jobs of a manifest, resuming from its checkpoint')
+    parser.add_argument('manifest', help = 'JSON manifest of sites, connection and jobs')
+    parser.add_argument('--workers', type = int, default = 1, help = 'worker processes, each with its own connection')
+    parser.add_argument('--checkpoint', help = 'checkpoint file (%s in the output directory by default)' % CHECKPOINT)
+    parser.add_argument('--restart', action = 'store_true', help = 'forget the checkpoint and run every job again')
+    parser.add_argument('--list', action = 'store_true', help = 'only print the jobs and whether they are finished')
+    args = parser.parse_args(argv)
+
+    output, settings, jobs = loadManifest(args.manifest)
+    if args.list:
+        checkpoint = Checkpoint(args.checkpoint or os.path.join(output, CHECKPOINT))
+        for job in jobs:
+            print '%s %-8s %-7s %s %s - %s' % (job['id'], 'finished' if checkpoint.finished(job['id']) else 'todo', \
+                                              job['kind'], job['location'], job['start'], job['end'])
+        return 0
+    result = runBatch(output, settings, jobs, args.workers, args.checkpoint, args.restart)
+    print "%s done, %s skipped, %s failed" % (len(result['done']), len(result['skipped']), len(result['failed']))
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
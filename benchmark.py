@@ -0,0 +1,266 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Offline benchmarks for WeatherToCSV and AngleToCSV. Seeds a local SQLite
+stand-in for solardb with synthetic 5 minute weather and tracker angle data,
+times every stage on its own and keeps the results as JSON baselines"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import json
+import time
+import resource
+import sqlite3
+import argparse
+import tempfile
+import platform
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sunCalc import SunCalc as SC, year_times
+from siteGeometry import SiteGeometry
+from weatherToCSV import WeatherToCSV
+from AngleToCSV import AngleToCSV
+import intervalStats
+
+WEATHER_DATABASE = 'solardb.dbo.Weather'
+ANGLE_DATABASE = 'solardb.dbo.SunBase4t'
+
+#site every synthetic location is placed at
+SITE = {'Name':'Tucson','latitude':'32.1025','longitude':'-110.8142','TimeZone':-7, 'DST':False, \
+        'Elevation':8, 'Albedo':.2, 'Source':'synthetic','State':'Arizona', \
+        'Country':'USA', 'LocationID':'123456'}
+
+
+def siteName(i):
+    return 'Site%s' % i
+
+def rowName(i):
+    return 'Row %s' % i
+
+def seedDatabase(db_file, days = 30, sites = 1, rows = 10, year = 2015, step = 5, seed = 0):
+    #writes Weather and SunBase4t tables shaped like the solardb ones (see WeatherToCSV.localConnect) holding
+    #days of step minute data from Jan 1 of year (local time) for every site, and rows tracker rows per site
+    #irradiance follows the sun with random clouds, the angles follow the backtracking model plus noise
+    rng = np.random.RandomState(seed)
+    sun = SC(location = SITE)
+    local = np.arange('%s-01-01' % year, np.datetime64('%s-01-01' % year, 'D') + days, np.timedelta64(step, 'm'), dtype = 'datetime64[m]')
+    utc = local - np.timedelta64(int(round(SITE['TimeZone']*60)), 'm')
+    stamps = np.char.replace(np.datetime_as_string(utc.astype('datetime64[s]')), 'T', ' ').tolist()
+    sun_pos = sun.array_calc(local, engine = 'numpy')
+    clear = 1000*np.clip(np.sin(np.radians(sun_pos['elevation'])), 0, None)
+    angles = sun.tracker_calc(sun_pos)
+
+    connection = sqlite3.connect(db_file)
+    connection.execute('drop table if exists Weather')
+    connection.execute('drop table if exists SunBase4t')
+    connection.execute('create table Weather (TimeStamp TIMESTAMP, Location TEXT, GlobalSolar_Avg REAL, DiffuseSolar_Avg REAL, '
+                       'AirTemp_C_Avg REAL, RH_Avg REAL, WindSpd_ms_WVc1 REAL, WindSpd_ms_WVc2 REAL)')
+    connection.execute('create table SunBase4t (TimeStamp TIMESTAMP, Location TEXT, Name TEXT, Angle REAL)')
+    for i in range(sites):
+        GHI = clear*rng.uniform(0.3, 1., len(local))
+        weather = [stamps, [siteName(i)]*len(local), GHI.tolist(), (GHI*rng.uniform(0.1, 0.5, len(local))).tolist(),
+                   rng.uniform(5, 40, len(local)).tolist(), rng.uniform(5, 80, len(local)).tolist(),
+                   rng.uniform(0, 10, len(local)).tolist(), rng.uniform(0, 360, len(local)).tolist()]
+        connection.executemany('insert into Weather values (?,?,?,?,?,?,?,?)', zip(*weather))
+        for j in range(rows):
+            angle = angles + rng.normal(0, 1, len(local))
+            connection.executemany('insert into SunBase4t values (?,?,?,?)', \
+                                   zip(stamps, [siteName(i)]*len(local), [rowName(j)]*len(local), angle.tolist()))
+    connection.execute('create index WeatherTime on Weather (Location, TimeStamp)')
+    connection.execute('create index AngleTime on SunBase4t (Location, Name, TimeStamp)')
+    connection.commit()
+    connection.close()
+    return len(local)
+
+
+class Benchmark(object):
+    #times stages with timeStage and collects seconds, rows/s and peak RSS (so far) for each one
+    #a stage run more than once (one per site) adds up its seconds and rows
+
+    def __init__(self):
+        self.stages = {}
+
+    def timeStage(self, name, function, rows = None):
+        #runs function, rows is the number of rows it handled (or a function of its result)
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+        if callable(rows):
+            rows = rows(result)
+        stage = self.stages.setdefault(name, {'seconds': 0., 'rows': 0, 'runs': 0})
+        stage['seconds'] += seconds
+        stage['rows'] += rows or 0
+        stage['runs'] += 1
+        stage['rows_per_s'] = stage['rows']/stage['seconds'] if stage['seconds'] > 0 else None
+        stage['peak_rss_mb'] = peakRSS()
+        return result
+
+
+def peakRSS():
+    #peak resident memory of this process in MB (ru_maxrss is kB on linux, bytes on mac)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak/2.**20
+    return peak/2.**10
+
+def run(days = 30, sites = 1, rows = 10, year = 2015, chunk_size = 50000, directory = None):
+    #seeds a database in directory (a temporary one by default) and times every stage for every site,
+    #returns the results dictionary written by save
+    directory = directory or tempfile.mkdtemp()
+    db_file = os.path.join(directory, 'solardb.sqlite')
+    bench = Benchmark()
+    bench.timeStage('seed', lambda: seedDatabase(db_file, days, sites, rows, year), lambda samples: samples*sites*(rows + 1))
+
+    #local time range of the seeded data, %I in convertToUTC keeps the hour between 1 and 12
+    date_start = '01/01/%s 01:00' % str(year)[2:]
+    date_end = (datetime(year, 1, 1) + timedelta(days = days - 1)).strftime('%m/%d/%y 12:00')
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        for i in range(sites):
+            weather = WeatherToCSV(SITE, directory)
+            weather.localConnect(db_file)
+            bench.timeStage('weather pull', lambda: weather.pullMinuteData(date_start, date_end, WEATHER_DATABASE, siteName(i), chunk_size), \
+                            lambda result: len(weather.timestamp))
+            samples = len(weather.timestamp)
+            hour_matrix = bench.timeStage('weather aggregate', weather.hourlyAverages, lambda result: len(weather.timestamp))
+            bench.timeStage('weather server hourly', lambda: weather.pullMinuteData(date_start, date_end, WEATHER_DATABASE, siteName(i), \
+                            chunk_size, aggregate = True), lambda result: len(weather.timestamp))
+            sun_pos = bench.timeStage('sun geometry', lambda: weather.sunCalc_location.year_calc(year, 60, engine = 'numpy'), \
+                                      lambda result: len(result['time']))
+            bench.timeStage('sun geometry ephem', lambda: weather.sunCalc_location.year_calc(year, 60, engine = 'ephem'), \
+                            lambda result: len(result['time']))
+            bench.timeStage('sun geometry x60', lambda: weather.sunCalc_location.year_calc(year, 60, samples = 60), \
+                            lambda result: 60*len(result['time']))
+            year_matrix = hour_matrix.reindex(index = pd.DatetimeIndex(year_times(year, year).astype('datetime64[ns]')), fill_value = 0)
+            bench.timeStage('weather build', lambda: weather.buildWeather(year_matrix, sun_pos), lambda result: len(result[0]))
+            bench.timeStage('weather write', lambda: weather.writeWeather('weather.csv'), lambda result: len(weather.weatherColumns[0]))
+            #pulls again and writes the year with fetch, build and write overlapping in threads
+            bench.timeStage('weather pipeline', lambda: weather.pipelineYear(date_start, date_end, WEATHER_DATABASE, siteName(i), chunk_size), \
+                            lambda result: samples)
+            weather.serverDisconnect()
+
+            angle = AngleToCSV(SITE, directory)
+            angle.localConnect(db_file)
+            bench.timeStage('angle pull', lambda: angle.pullMinuteData(date_start, date_end, ANGLE_DATABASE, siteName(i), rowName(0), chunk_size), \
+                            lambda result: len(angle.timestamp))
+            bench.timeStage('angle aggregate', angle.hourlyAngles, lambda result: len(angle.timestamp))
+            bench.timeStage('tracker geometry', lambda: angle.trackerAngles(year_times(year, year)), len)
+            bench.timeStage('angle rows pull', lambda: angle.pullRows(date_start, date_end, ANGLE_DATABASE, siteName(i), \
+                            [rowName(j) for j in range(rows)], chunk_size), lambda result: len(angle.timestamp))
+            bench.timeStage('angle rows write', angle.constructRowsYear, lambda result: rows*len(sun_pos['time']))
+            angle.serverDisconnect()
+
+        #a year of a portfolio of 16 sites across the state in one matrix
+        portfolio = [dict(SITE, Name = 'Site %s' % j, longitude = str(-114.8 + 0.4*j)) for j in range(16)]
+        bench.timeStage('site geometry x16', lambda: SiteGeometry(portfolio, year_times(year, year)), \
+                        lambda result: result.tables['time'].size)
+    finally:
+        os.chdir(cwd)
+
+    return {'config': {'days': days, 'sites': sites, 'rows': rows, 'year': year, 'chunk_size': chunk_size},
+            'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform()},
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'stages': bench.stages}
+
+def aggregateRun(samples = 2700000, width = 6, intervals = [60, 15], nan_share = 0.05, repeats = 3, seed = 0):
+    #times intervalStats.aggregate against pandas resample on width minute columns of samples random values with
+    #nan_share of them missing, every stage repeats times: mean, count, min and max from the numpy columns, the same
+    #from a DataFrame built beforehand and with the build (the converters resampled a frame built from their columns
+    #before aggregate), and the means and counts alone that the converters keep now (extremes False)
+    rng = np.random.RandomState(seed)
+    times = np.datetime64('2010-01-01T00:00', 'us') + np.arange(samples)*np.timedelta64(1, 'm')
+    columns = [100*rng.normal(size = samples) for i in range(width)]
+    for column in columns:
+        column[rng.rand(samples) < nan_share] = np.nan
+
+    def frame():
+        return pd.DataFrame(np.array(columns).T, index = pd.DatetimeIndex(times.astype('datetime64[ns]')))
+
+    def resampled(data, interval, extremes = True):
+        #means and counts, with extremes min and max too
+        resampler = data.resample('%sT' % interval)
+        if not extremes:
+            return [resampler.mean(), resampler.count()]
+        return [resampler.mean(), resampler.count(), resampler.min(), resampler.max()]
+
+    bench = Benchmark()
+    data = frame()
+    for interval in intervals:
+        for i in range(repeats):
+            bench.timeStage('aggregate %s' % interval, lambda: intervalStats.aggregate(times, columns, interval), samples)
+            bench.timeStage('aggregate means %s' % interval, lambda: intervalStats.aggregate(times, columns, interval, \
+                            extremes = False), samples)
+            bench.timeStage('resample %s' % interval, lambda: resampled(data, interval), samples)
+            bench.timeStage('frame resample %s' % interval, lambda: resampled(frame(), interval), samples)
+            bench.timeStage('resample means %s' % interval, lambda: resampled(data, interval, False), samples)
+            bench.timeStage('frame means %s' % interval, lambda: resampled(frame(), interval, False), samples)
+
+    return {'config': {'samples': samples, 'width': width, 'intervals': intervals, 'nan_share': nan_share, 'repeats': repeats},
+            'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, \
+                        'platform': platform.platform()},
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'stages': bench.stages}
+
+def save(results, file_name):
+    with open(file_name, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+
+def report(results):
+    print '%-22s %6s %10s %14s %12s' % ('stage', 'runs', 'seconds', 'rows/s', 'peak RSS MB')
+    for name in sorted(results['stages']):
+        stage = results['stages'][name]
+        print '%-22s %6d %10.3f %14.0f %12.1f' % (name, stage['runs'], stage['seconds'], stage['rows_per_s'] or 0, stage['peak_rss_mb'])
+
+def compare(results, baseline_file, tolerance = 0.2):
+    #prints every stage against a saved baseline, returns the names of stages more than tolerance slower
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    if baseline['config'] != results['config']:
+        print 'baseline was run with %s, this run with %s' % (baseline['config'], results['config'])
+    slower = []
+    for name in sorted(results['stages']):
+        if name not in baseline['stages'] or not baseline['stages'][name]['rows_per_s']:
+            continue
+        ratio = (results['stages'][name]['rows_per_s'] or 0)/baseline['stages'][name]['rows_per_s']
+        print '%-22s %6.2fx baseline speed' % (name, ratio)
+        if ratio < 1 - tolerance:
+            slower.append(name)
+    return slower
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'offline WeatherToCSV and AngleToCSV benchmarks on synthetic data')
+    parser.add_argument('--days', type = int, default = 30, help = 'days of 5 minute data per site')
+    parser.add_argument('--sites', type = int, default = 1, help = 'weather locations')
+    parser.add_argument('--rows', type = int, default = 10, help = 'tracker rows per site')
+    parser.add_argument('--year', type = int, default = 2015)
+    parser.add_argument('--chunk-size', type = int, default = 50000, help = 'fetchmany size of the pulls')
+    parser.add_argument('--directory', help = 'where the database and files go (temporary by default)')
+    parser.add_argument('--output', help = 'save the results to this JSON file')
+    parser.add_argument('--baseline', help = 'compare against this saved JSON file')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed slowdown against the baseline')
+    parser.add_argument('--aggregate-samples', type = int, default = 0, \
+                        help = 'time intervalStats.aggregate against pandas resample on this many minutes instead')
+    args = parser.parse_args(argv)
+
+    if args.aggregate_samples:
+        results = aggregateRun(args.aggregate_samples)
+    else:
+        results = run(args.days, args.sites, args.rows, args.year, args.chunk_size, args.directory)
+    report(results)
+    if args.output:
+        save(results, args.output)
+    if args.baseline:
+        slower = compare(results, args.baseline, args.tolerance)
+        if slower:
+            print 'slower than baseline: %s' % ', '.join(slower)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Local file stand-ins for the solar database, so weather and angle files
+can be built from csv exports of the tables without a database driver"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+from datetime import datetime
+import numpy as np
+import fileReaders
+import minuteFetch
+import sqlQueries
+
+
+class CSVSource(object):
+    #csv exports of the solar database tables, used by WeatherToCSV/AngleToCSV.fileConnect instead of a connection
+    #path is a directory of '<table>.csv' (or '<table>.csv.gz') files named like the last part of the database
+    #(Weather.csv for solardb.dbo.Weather, as in the sqlite copy), or a single file used for every table
+    #every file starts with a header line naming its columns like the database does (TimeStamp, Location, Name,
+    #GlobalSolar_Avg, Angle, ...) and holds UTC 'YYYY-MM-DD HH:MM:SS' timestamps in time order
+    #a file without a Location column holds a single location, empty values are read as nan
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise IOError("no such export file or directory: %s" % path)
+        self.path = path
+
+    def fileName(self, database):
+        if not os.path.isdir(self.path):
+            return self.path
+        table = sqlQueries.tableName('sqlite', database)
+        for extension in ['.csv', '.csv.gz']:
+            file_name = os.path.join(self.path, table + extension)
+            if os.path.exists(file_name):
+                return file_name
+        raise IOError("no export of table %s in %s" % (table, self.path))
+
+    def chunks(self, database, columns, DB_location, date_start_UTC, date_end_UTC, dtypes, chunk_size = 50000, \
+               time_shift = 0, row = None, names = None):
+        #generator of [timestamp, values...] numpy chunks like minuteFetch.fetchChunks on the sqlQueries.minuteQuery
+        #of the same arguments: rows of DB_location (and row, or any of names) between the UTC bounds ('%m/%d/%y %H:%M'),
+        #timestamps shifted by time_shift hours, names adds the Name column after the value columns
+        #the file is parsed in blocks by fileReaders, starting from a bisection to date_start_UTC on plain files
+        file_name = self.fileName(database)
+        start = np.datetime64(datetime.strptime(date_start_UTC, sqlQueries.SQL_TIME_FORMAT), 'us')
+        end = np.datetime64(datetime.strptime(date_end_UTC, sqlQueries.SQL_TIME_FORMAT), 'us')
+        shift = np.timedelta64(int(round(time_shift*3600e6)), 'us')
+        header = fileReaders.csvHeader(file_name)
+        if (row is not None or names is not None) and 'Name' not in header:
+            raise ValueError("%s has no column Name" % file_name)
+        #values, then the Location and Name columns to filter on as text
+        filters = [name for name in ['Location', 'Name'] if name in header and (name == 'Location' or row is not None or names is not None)]
+        read = ['TimeStamp'] + list(columns) + filters
+        if row is not None:
+            names_wanted = [row]
+        else:
+            names_wanted = names
+
+        last = None
+        for chunk in fileReaders.csvChunks(file_name, read, [minuteFetch.TIME_DTYPE] + list(dtypes[:len(columns)]) + ['S']*len(filters), \
+                                           time_from = start):
+            times = chunk[0]
+            if (last is not None and times[0] < last) or np.any(times[1:] < times[:-1]):
+                raise ValueError("%s is not in time order" % file_name)
+            last = times[-1]
+            keep = (times >= start) & (times <= end)
+            text = dict(zip(filters, chunk[len(chunk) - len(filters):]))
+            if 'Location' in text:
+                keep &= text['Location'] == DB_location
+            if names_wanted is not None:
+                keep &= np.in1d(text['Name'], list(names_wanted))
+            if keep.any():
+                kept = [times[keep] + shift] + [column[keep] for column in chunk[1:len(columns) + 1]]
+                if names is not None:
+                    kept.append(text['Name'][keep].astype(object))
+                for i in range(0, len(kept[0]), chunk_size):
+                    yield [column[i:i + chunk_size] for column in kept]
+            if times[-1] > end:
+                break
+
+    def close(self):
+        #nothing is held open between pulls
+        pass
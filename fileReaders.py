@@ -0,0 +1,326 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Reads large timestamped csv files straight into numpy columns: the file is
+memory-mapped (gzip files decompressed block by block), split into fields and
+parsed a block of lines at a time, with no per line python objects (blocks
+with commas inside quoted fields go through csv.reader)"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import csv
+import gzip
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from minuteFetch import TIME_DTYPE, ColumnBuffer
+import fileWriters
+
+#bytes of the file parsed at once, whole lines only
+BLOCK_BYTES = 8*1024**2
+#a time search stops once it is down to this many bytes
+SEEK_BYTES = 64*1024
+#text read as nan in number columns (besides empty fields)
+MISSING = ['NULL', 'None', 'NaN', 'nan']
+NEWLINE, CARRIAGE, DELIMITER, QUOTE = ord('\n'), ord('\r'), ord(','), ord('"')
+#10**0 to 10**15, exact as float64
+POWERS = np.array([float(10**power) for power in range(16)])
+
+
+def lineBlocks(file_name, block_bytes = BLOCK_BYTES, offset = 0):
+    #generator of uint8 arrays of whole lines of the file from byte offset on, about block_bytes each
+    #plain files are memory-mapped so only the blocks read are paged in, gzip files are decompressed
+    if file_name.endswith('.gz'):
+        with gzip.open(file_name, 'rb') as f:
+            rest = np.zeros(0, dtype = np.uint8)
+            while True:
+                data = f.read(block_bytes)
+                if not data:
+                    break
+                block = np.concatenate([rest, np.frombuffer(data, dtype = np.uint8)])
+                newlines = np.flatnonzero(block == NEWLINE)
+                if not len(newlines):
+                    rest = block
+                    continue
+                yield block[:newlines[-1] + 1]
+                rest = block[newlines[-1] + 1:]
+            if len(rest):
+                yield rest
+        return
+    data = mapFile(file_name)
+    start = offset
+    while start < len(data):
+        end = nextLine(data, min(start + block_bytes, len(data)))
+        #a plain array view of the map, indexing a memmap makes more memmap objects
+        yield np.asarray(data[start:end])
+        start = end
+
+def mapFile(file_name):
+    #read only uint8 memory map of a plain file (an empty array for an empty file, which cannot be mapped)
+    if not os.path.getsize(file_name):
+        return np.zeros(0, dtype = np.uint8)
+    return np.memmap(file_name, dtype = np.uint8, mode = 'r')
+
+def nextLine(data, position):
+    #start of the first line beginning at or after position (the end of data when there is none)
+    start = max(position - 1, 0)
+    while start < len(data):
+        newlines = np.flatnonzero(data[start:start + SEEK_BYTES] == NEWLINE)
+        if len(newlines):
+            return start + newlines[0] + 1
+        start += SEEK_BYTES
+    return len(data)
+
+def fieldBounds(block, fields):
+    #(lines, fields) arrays of the first byte and the byte past the last one of every field of the lines
+    #in block, blank lines are skipped, '\r\n' line ends and "quoted" fields (without commas) are handled
+    #a line with another number of fields raises ValueError, see splitFields for quoted commas
+    block = np.asarray(block)
+    newlines = np.flatnonzero(block == NEWLINE)
+    ends = np.append(newlines, len(block)) if not len(block) or block[-1] != NEWLINE else newlines
+    starts = np.append(0, ends[:-1] + 1)[:len(ends)]
+    if len(block):
+        ends = ends - ((ends > starts) & (block[np.maximum(ends - 1, 0)] == CARRIAGE))
+    filled = ends > starts
+    starts, ends = starts[filled], ends[filled]
+    commas = np.flatnonzero(block == DELIMITER)
+    #the commas fall into rows of fields - 1 per line exactly when every row starts and ends inside its line
+    if len(commas) == len(starts)*(fields - 1):
+        commas = commas.reshape(len(starts), fields - 1)
+        good = fields == 1 or (np.all(commas[:,0] > starts) and np.all(commas[:,-1] < ends))
+    else:
+        good = False
+    if not good:
+        commas = np.flatnonzero(block == DELIMITER)
+        counts = np.searchsorted(commas, ends) - np.searchsorted(commas, starts)
+        bad = np.flatnonzero(counts != fields - 1)[0]
+        raise ValueError("line %r has %s fields, expected %s" % (block[starts[bad]:ends[bad]].tobytes(), counts[bad] + 1, fields))
+    first = np.hstack([starts[:,np.newaxis], commas + 1])
+    last = np.hstack([commas, ends[:,np.newaxis]])
+    if not np.any(block == QUOTE):
+        return first, last
+    #drop the quotes around quoted fields
+    quoted = (last - first >= 2) & (block[np.minimum(first, len(block) - 1)] == QUOTE) & (block[np.maximum(last - 1, 0)] == QUOTE)
+    return first + quoted, last - quoted
+
+def readerBounds(block, fields):
+    #fieldBounds of a block split by csv.reader, for commas (or line ends) inside "quoted" fields: the unquoted
+    #fields are laid end to end in a new block, returned along with the bounds pointing into it
+    rows = [row for row in csv.reader(np.asarray(block).tobytes().splitlines(True)) if row]
+    for row in rows:
+        if len(row) != fields:
+            raise ValueError("line of fields %r has %s fields, expected %s" % (row, len(row), fields))
+    texts = [field for row in rows for field in row]
+    last = np.cumsum([len(text) for text in texts], dtype = np.int64)
+    first = last - [len(text) for text in texts]
+    block = np.frombuffer(b''.join(texts), dtype = np.uint8)
+    return block, first.reshape(len(rows), fields), last.reshape(len(rows), fields)
+
+def splitFields(block, fields):
+    #(block, first, last) of fieldBounds, blocks it rejects that have quotes in them, or with doubled "" quotes,
+    #are split again by csv.reader (readerBounds) so "Row, 2" is one field, the bounds then point into the block returned
+    try:
+        first, last = fieldBounds(block, fields)
+    except ValueError:
+        if not np.any(np.asarray(block) == QUOTE):
+            raise
+        return readerBounds(block, fields)
+    quotes = np.asarray(block) == QUOTE
+    if not np.any(quotes[1:] & quotes[:-1]):
+        return block, first, last
+    return readerBounds(block, fields)
+
+def countFields(line):
+    #fields of a line of the file, commas inside quoted fields not counted
+    return max(len(next(csv.reader([line.tobytes()]), [])), 1)
+
+def gather(block, first, last, width = None):
+    #(fields, width) uint8 array of the bytes of every field, padded with zeros
+    #rows are copied out of a sliding window view of the block, one whole row per field
+    if width is None:
+        width = max(int((last - first).max()), 1) if len(first) else 1
+    block = np.asarray(block)
+    if not len(first):
+        return np.zeros((0, width), dtype = np.uint8)
+    if int(first.max()) + width > len(block):
+        block = np.concatenate([block, np.zeros(width, dtype = np.uint8)])
+    windows = as_strided(block, shape = (len(block) - width + 1, width), strides = (1, 1))
+    chars = windows[first]
+    chars *= np.arange(width) < (last - first)[:,np.newaxis]
+    return chars
+
+def parseText(block, first, last):
+    #str array of the fields (trailing zero bytes are what numpy strips from 'S' strings anyway)
+    chars = gather(block, first, last)
+    return np.ascontiguousarray(chars).view('S%s' % chars.shape[1]).ravel()
+
+def parseNumbers(block, first, last, dtype = np.float64):
+    #the fields as numbers, empty fields and MISSING text as nan
+    #plain decimals of up to 15 digits ('-12.5') are worked out from their digits: the integer of the digits and
+    #the power of ten it is divided by are both exact float64s, so the one rounding of the division gives the
+    #same float as float(text). Anything else (exponents, longer numbers, text) goes through float()
+    chars = gather(block, first, last)
+    fields, width = chars.shape
+    #one contiguous row per place in the fields, bytes - '0' (the bytes below '0' wrap around past 9)
+    numbers = np.ascontiguousarray(chars.T) - np.uint8(ord('0'))
+    value = np.zeros(fields, dtype = np.int64)
+    digits = np.zeros(fields, dtype = np.int16)
+    decimals = np.zeros(fields, dtype = np.int16)
+    dots = np.zeros(fields, dtype = np.int16)
+    for place in range(width):
+        digit = numbers[place] <= 9
+        value = np.where(digit, value*10 + numbers[place], value)
+        digits += digit
+        decimals += digit & (dots > 0)
+        dots += numbers[place] == np.uint8(ord('.') - ord('0'))
+    signed = (chars[:,0] == ord('-')) | (chars[:,0] == ord('+'))
+    #every byte of the field a digit or the dot, but a sign in front
+    plain = (digits + dots + signed == last - first) & (digits > 0) & (digits <= 15) & (dots <= 1)
+    result = np.where(chars[:,0] == ord('-'), -1., 1.)*value/POWERS[np.where(plain, decimals, 0)]
+    rest = np.flatnonzero(~plain)
+    if len(rest):
+        text = np.ascontiguousarray(chars[rest]).view('S%s' % width).ravel()
+        text = np.where(np.in1d(text, [''] + MISSING), 'nan', text)
+        try:
+            result[rest] = text.astype(np.float64)
+        except ValueError:
+            bad = [value for value in text if not isNumber(value)]
+            raise ValueError("not a number: %r" % (bad[0] if bad else text[0]))
+    return result.astype(dtype)
+
+def isNumber(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def parseTimes(block, first, last):
+    #datetime64[us] of fixed format 'YYYY-MM-DD HH:MM', 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DD HH:MM:SS.ffffff'
+    #fields ('T' works as the date and time separator too), worked out from the digits at their fixed places
+    width = last - first
+    chars = gather(block, first, last, max(20, min(int(width.max()) if len(width) else 0, 26)))
+    digits = chars.astype(np.int32) - ord('0')
+    number = lambda start, end: digits[:,start:end].dot(10**np.arange(end - start - 1, -1, -1, dtype = np.int32))
+    with_seconds = width >= 19
+    digit_places = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+    good = ((width == 16) | (width == 19) | ((width >= 21) & (width <= 26))) & \
+           (chars[:,4] == ord('-')) & (chars[:,7] == ord('-')) & ((chars[:,10] == ord(' ')) | (chars[:,10] == ord('T'))) & \
+           (chars[:,13] == ord(':')) & (~with_seconds | (chars[:,16] == ord(':'))) & ((width < 21) | (chars[:,19] == ord('.')))
+    #the seconds of 'HH:MM' fields are the zero padding, read as -48 and set to 0 below
+    good &= np.all((digits[:,digit_places] <= 9) & ((digits[:,digit_places] >= 0) | \
+                                                   (~with_seconds[:,np.newaxis] & (np.array(digit_places) >= 17))), axis = 1)
+    fraction = np.zeros(len(first), dtype = np.int64)
+    for place in range(20, chars.shape[1]):
+        inside = width > place
+        good &= ~inside | ((digits[:,place] >= 0) & (digits[:,place] <= 9))
+        fraction += np.where(inside, digits[:,place], 0)*10**(25 - place)
+    year, month, day = number(0, 4), number(5, 7), number(8, 10)
+    hour, minute, second = number(11, 13), number(14, 16), np.where(with_seconds, number(17, 19), 0)
+    good &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60) & (second < 60)
+    months = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + np.where(good, month - 1, 0)
+    days = months.astype('datetime64[D]') + (day - 1)
+    good &= days < (months + 1).astype('datetime64[D]')
+    if not good.all():
+        bad = np.flatnonzero(~good)[0]
+        raise ValueError("not a 'YYYY-MM-DD HH:MM:SS' timestamp: %r" % block[first[bad]:last[bad]].tobytes())
+    seconds = (hour*3600 + minute*60 + second).astype(np.int64)
+    return days.astype(TIME_DTYPE) + (seconds*10**6 + fraction).astype('timedelta64[us]')
+
+def parseColumn(block, first, last, dtype):
+    #TIME_DTYPE columns as timestamps, 'S' as str, object as python str, anything else as numbers
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'M':
+        return parseTimes(block, first, last).astype(dtype)
+    if dtype.kind == 'S':
+        return parseText(block, first, last)
+    if dtype.kind == 'O':
+        return parseText(block, first, last).astype(object)
+    return parseNumbers(block, first, last, dtype)
+
+def skipLines(data, lines, position = 0):
+    #start of the line lines lines after the one at position
+    for i in range(lines):
+        position = nextLine(data, position + 1)
+    return position
+
+def csvHeader(file_name, skip_lines = 0):
+    #names in the first line of the file (after skip_lines lines)
+    for block in lineBlocks(file_name, SEEK_BYTES):
+        block = block[skipLines(block, skip_lines):]
+        line = block[:nextLine(block, 1)]
+        line, first, last = splitFields(line, countFields(line))
+        return [str(name) for name in parseText(line, first[0], last[0])]
+    return []
+
+def seekTime(data, offset, fields, time_field, target):
+    #byte offset of a line of the time ordered memory-mapped data, at or after offset, past every line of the
+    #time column time_field before target that can be skipped: a bisection over the file reading a line per step
+    def lineTime(position):
+        line = data[position:nextLine(data, position + 1)]
+        line, first, last = splitFields(line, fields)
+        return parseTimes(line, first[:,time_field], last[:,time_field])[0]
+    low, high = offset, len(data)
+    while high - low > SEEK_BYTES:
+        middle = nextLine(data, (low + high)//2)
+        if middle >= high:
+            break
+        if lineTime(middle) < target:
+            low = middle
+        else:
+            high = middle
+    return low
+
+def csvChunks(file_name, columns, dtypes, header = True, block_bytes = BLOCK_BYTES, time_from = None, skip_lines = 0):
+    #generator of lists of arrays, one per column of columns (names in the header line, or positions
+    #when header is False), cast to the matching dtypes (see parseColumn), one list per block of lines
+    #time_from (a datetime64) skips the lines of the first TIME_DTYPE column before it, found by bisection on
+    #memory-mapped time ordered files (some earlier lines may still come), ignored for gzip files
+    #skip_lines lines come before the header line (or the first row), e.g. the first two SAM header rows
+    names = csvHeader(file_name, skip_lines) if header else None
+    if header:
+        missing = [name for name in columns if name not in names]
+        if missing:
+            raise ValueError("%s has no column %s" % (file_name, ', '.join(missing)))
+        fields = len(names)
+        positions = [names.index(name) for name in columns]
+    else:
+        positions = list(columns)
+        fields = None
+    compressed = file_name.endswith('.gz')
+    offset = 0
+    if not compressed:
+        data = mapFile(file_name)
+        offset = skipLines(data, skip_lines + header)
+        times = [position for position, dtype in zip(positions, dtypes) if np.dtype(dtype).kind == 'M']
+        if time_from is not None and times and offset < len(data):
+            if fields is None:
+                fields = countFields(data[offset:nextLine(data, offset + 1)])
+            offset = seekTime(data, offset, fields, times[0], np.datetime64(time_from, 'us'))
+    skip_header = compressed
+    for block in lineBlocks(file_name, block_bytes, offset):
+        if skip_header:
+            block = block[skipLines(block, skip_lines + header):]
+            skip_header = False
+        if fields is None:
+            line = block[:nextLine(block, 1)]
+            fields = countFields(line)
+        block, first, last = splitFields(block, fields)
+        if not len(first):
+            continue
+        yield [parseColumn(block, first[:,position], last[:,position], dtype) for position, dtype in zip(positions, dtypes)]
+
+def readCSV(file_name, columns, dtypes, header = True, block_bytes = BLOCK_BYTES, time_from = None, skip_lines = 0):
+    #csvChunks of the whole file collected into one array per column
+    buffer = ColumnBuffer([np.dtype(dtype) if np.dtype(dtype).kind != 'S' else object for dtype in dtypes])
+    for chunk in csvChunks(file_name, columns, dtypes, header, block_bytes, time_from, skip_lines):
+        buffer.extend(chunk)
+    return buffer.arrays()
+
+def readTable(file_name, header_rows, names, columns, dtypes):
+    #columns (out of the column names of the table) of a table written by fileWriters in any of its formats,
+    #with header_rows header lines in front of the rows of csv files
+    if file_name.endswith(fileWriters.FORMATS['npz']):
+        header, stored = fileWriters.readColumns(file_name)
+        return [stored[name].astype(dtype) for name, dtype in zip(columns, dtypes)]
+    return readCSV(file_name, [names.index(name) for name in columns], dtypes, header = False, skip_lines = header_rows)
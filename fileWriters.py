@@ -0,0 +1,205 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Writes weather and angle tables straight from their column arrays, as
+SAM format csv (plain or gzip compressed) or as a binary columnar .npz file"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import csv
+import gzip
+import json
+from datetime import datetime
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import numpy as np
+
+#file_format -> extension the files get
+FORMATS = {'csv': '.csv', 'gzip': '.csv.gz', 'npz': '.npz'}
+
+
+def fileName(file_name, file_format = 'csv'):
+    #swaps the .csv (or any other format extension) of a file name for the extension of file_format
+    if file_format not in FORMATS:
+        raise ValueError("unknown file format %s, use one of %s" % (file_format, ', '.join(sorted(FORMATS))))
+    for extension in sorted(FORMATS.values(), key = len, reverse = True):
+        if file_name.endswith(extension):
+            file_name = file_name[:-len(extension)]
+            break
+    return file_name + FORMATS[file_format]
+
+def formatColumn(column, precision = None):
+    #list of the csv text of every value: floats as repr (what csv.writer writes), datetimes as
+    #'YYYY-MM-DD HH:MM:SS', precision gives floats that many decimals instead
+    column = np.asarray(column)
+    if column.dtype.kind == 'M':
+        return np.char.replace(np.datetime_as_string(column, unit = 's'), 'T', ' ').tolist()
+    if column.dtype.kind in 'iuf' and column.dtype.itemsize <= 8 and len(column):
+        #calendar columns and constants (pressure, albedo) hold a few values, format each of them once
+        #floats are told apart by their bits, comparing them as numbers would write -0.0 as 0.0
+        keys = column.view('i%s' % column.dtype.itemsize) if column.dtype.kind == 'f' else column
+        distinct, inverse = np.unique(keys, return_inverse = True)
+        if len(distinct) <= len(column)//4:
+            return np.array(formatValues(distinct.view(column.dtype).tolist(), precision), dtype = object)[inverse].tolist()
+    return formatValues(column.tolist(), precision)
+
+def formatValues(values, precision = None):
+    if precision is not None:
+        return [('%.*f' % (precision, value)) if isinstance(value, float) else repr(value) for value in values]
+    return list(map(repr, values))
+
+def headerText(header):
+    #header rows go through csv.writer so text fields are quoted like before
+    text = StringIO()
+    csv.writer(text, lineterminator = '\n', delimiter = ',').writerows(header)
+    return text.getvalue()
+
+def csvText(columns, precision = None):
+    #csv lines of equal length columns, every column formatted in one go
+    if not len(columns) or not len(columns[0]):
+        return ''
+    return '\n'.join(map(','.join, zip(*[formatColumn(column, precision) for column in columns]))) + '\n'
+
+
+class ColumnWriter(object):
+    #writes a table given as blocks of column arrays, as
+    #   'csv'  header rows then one line per row (same text csv.writer gives)
+    #   'gzip' the same text gzip compressed
+    #   'npz'  one array per column named by names (irradiance and other numeric columns as float64,
+    #          times as datetime64) plus the header rows as JSON in '_header', read back with np.load
+    #csv and gzip text goes out block by block, npz keeps the blocks until close
+
+    def __init__(self, file_name, header, names, file_format = 'csv', precision = None):
+        self.file_name = fileName(file_name, file_format)
+        self.header = header
+        self.names = names
+        self.file_format = file_format
+        self.precision = precision
+        self.rows = 0
+        self.blocks = []
+        if file_format == 'npz':
+            self.file = None
+        elif file_format == 'gzip':
+            self.file = gzip.open(self.file_name, 'wb')
+        else:
+            self.file = open(self.file_name, 'w')
+        if self.file is not None:
+            self._write(headerText(header))
+
+    def _write(self, text):
+        if self.file_format == 'gzip':
+            text = text.encode('utf-8')
+        self.file.write(text)
+
+    def write(self, columns):
+        self.rows += len(columns[0]) if len(columns) else 0
+        if self.file is None:
+            self.blocks.append([np.asarray(column) for column in columns])
+        else:
+            self._write(csvText(columns, self.precision))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            return
+        arrays = {'_header': np.array(json.dumps(self.header))}
+        for i in range(len(self.names)):
+            column = np.concatenate([block[i] for block in self.blocks]) if self.blocks else np.array([])
+            if column.dtype.kind == 'O':
+                column = column.astype(np.float64)
+            arrays[self.names[i]] = column
+        np.savez(self.file_name, **arrays)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+        return False
+
+
+def writeColumns(file_name, header, names, columns, file_format = 'csv', precision = None):
+    #writes a whole table in one go, returns the name of the file written
+    with ColumnWriter(file_name, header, names, file_format, precision) as writer:
+        writer.write(columns)
+    return writer.file_name
+
+def readColumns(file_name):
+    #header rows and {name: column} of a file written with file_format 'npz'
+    with np.load(file_name) as stored:
+        header = json.loads(str(stored['_header']))
+        return header, dict((name, stored[name]) for name in stored.files if name != '_header')
+
+def patchColumns(file_name, header, names, first_row, columns, file_format = 'csv', precision = None):
+    #writes columns over the rows first_row on of a table written before with the same header, names, format and
+    #precision, the header rows and every other row stay as they were. Returns how many rows changed (their text,
+    #or their values in npz files), a file where none did is not touched. Text of the same length is patched in
+    #place, otherwise the bytes after it are moved, gzip and npz files are written again without reformatting
+    file_name = fileName(file_name, file_format)
+    rows = len(columns[0]) if len(columns) else 0
+    if file_format == 'npz':
+        stored_header, stored = readColumns(file_name)
+        changed = np.zeros(rows, dtype = bool)
+        for name, column in zip(names, columns):
+            column = np.asarray(column)
+            if column.dtype.kind == 'O':
+                column = column.astype(np.float64)
+            old = stored[name][first_row:first_row + rows]
+            if len(old) < rows:
+                raise ValueError("%s has %s rows, cannot patch rows %s to %s" % (file_name, len(stored[name]), first_row, first_row + rows))
+            same = old == column
+            if column.dtype.kind == 'f':
+                same |= np.isnan(old) & np.isnan(column)
+            changed |= ~same
+            stored[name][first_row:first_row + rows] = column
+        if changed.any():
+            stored['_header'] = np.array(json.dumps(stored_header))
+            np.savez(file_name, **stored)
+        return int(changed.sum())
+
+    opener = gzip.open if file_format == 'gzip' else open
+    with opener(file_name, 'rb') as f:
+        data = f.read()
+    newlines = np.flatnonzero(np.frombuffer(data, dtype = np.uint8) == ord('\n'))
+    skip = len(header) + first_row
+    if len(newlines) < skip + rows:
+        raise ValueError("%s has %s rows, cannot patch rows %s to %s" % (file_name, len(newlines) - len(header), first_row, first_row + rows))
+    start = newlines[skip - 1] + 1 if skip else 0
+    end = newlines[skip + rows - 1] + 1 if rows else start
+    old = data[start:end]
+    new = csvText(columns, precision)
+    if not isinstance(new, bytes):
+        new = new.encode('utf-8')
+    #csv files are written in text mode, '\r\n' line ends on windows
+    if len(newlines) and newlines[0] > 0 and data[newlines[0] - 1:newlines[0]] == b'\r':
+        new = new.replace(b'\n', b'\r\n')
+    if new == old:
+        return 0
+    old_lines = old.split(b'\n')
+    new_lines = new.split(b'\n')
+    if old_lines[0].count(b',') != new_lines[0].count(b','):
+        raise ValueError("%s has other columns than the rows written over it" % file_name)
+    changed = sum(1 for old_line, new_line in zip(old_lines, new_lines) if old_line != new_line)
+    if file_format == 'gzip':
+        with gzip.open(file_name, 'wb') as f:
+            f.write(data[:start] + new + data[end:])
+    else:
+        with open(file_name, 'r+b') as f:
+            f.seek(start)
+            if len(new) == len(old):
+                f.write(new)
+            else:
+                f.write(new + data[end:])
+                f.truncate()
+    return changed
+
+def updateIntervals(times, date_start, interval = 60):
+    #[(year, mask of times)...] of the interval times of every year starting at or after date_start (a pull
+    #starting inside an interval only has part of its samples there), for the update modes
+    times = np.asarray(times).astype('datetime64[m]')
+    start = np.datetime64(datetime.strptime(date_start, '%m/%d/%y %I:%M'), 'm').astype(np.int64)
+    keep = times >= np.datetime64(-(-start//interval)*interval, 'm')
+    years = times.astype('datetime64[Y]').astype(int) + 1970
+    return [(year_value, keep & (years == year_value)) for year_value in np.unique(years[keep])]
@@ -0,0 +1,162 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Fills the hours a weather table has no data for: irradiance from a clear
+sky model on the site's sun geometry, temperature, humidity and wind by
+interpolation or climatology. Works on (sites x times) arrays in one pass"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import numpy as np
+
+IRRADIANCE = ['GHI', 'Diff']
+METEO = ['Tamb', 'RH', 'Wspd']
+#clear sky below this GHI (W/m2, sun near the horizon) says nothing about the clearness of the sky
+MIN_CLEAR_GHI = 50.
+#names of the fill methods in the counts
+METHODS = ['clearsky', 'scaled', 'interpolated', 'climatology', 'zero']
+
+
+def runLengths(mask):
+    #length of the run of True every True element of a (sites, n) mask belongs to, 0 elsewhere
+    mask = np.asarray(mask, dtype = bool)
+    sites, n = mask.shape
+    padded = np.zeros((sites, n + 2), dtype = np.int8)
+    padded[:,1:-1] = mask
+    change = np.diff(padded, axis = 1)
+    #nonzero walks row by row, so the k-th start and the k-th end belong to the same run
+    start_row, start = np.nonzero(change == 1)
+    end_row, end = np.nonzero(change == -1)
+    marks = np.zeros((sites, n + 1), dtype = np.int64)
+    marks[start_row, start] += end - start
+    marks[end_row, end] -= end - start
+    return np.cumsum(marks, axis = 1)[:,:n]
+
+def interpolate(values, valid, target = None):
+    #linear interpolation along every row from the valid values on both sides, the nearest valid
+    #value past the ends of a row, nan for rows without any valid value
+    #only the positions in the target mask (all of them by default) are filled in, the rest is nan
+    sites, n = values.shape
+    index = np.arange(n)
+    before = np.maximum.accumulate(np.where(valid, index, -1), axis = 1)
+    after = np.minimum.accumulate(np.where(valid, index, n)[:,::-1], axis = 1)[:,::-1]
+    rows, columns = np.nonzero(np.ones((sites, n), dtype = bool) if target is None else target)
+    before = before[rows, columns]
+    after = after[rows, columns]
+    left = np.clip(np.where(before >= 0, before, after), 0, n - 1)
+    right = np.clip(np.where(after < n, after, before), 0, n - 1)
+    span = right - left
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(span > 0, (columns - left)/span, 0.)
+        filled = values[rows, left] + weight*(values[rows, right] - values[rows, left])
+    result = np.full((sites, n), np.nan)
+    result[rows, columns] = np.where(valid.any(axis = 1)[rows], filled, np.nan)
+    return result
+
+def climatology(values, valid, times, target = None):
+    #mean of every site for the same hour of day in the same month, the same hour of day over
+    #all months where that month has no data, nan where neither has any
+    #only the positions in the target mask (all of them by default) are filled in, the rest is nan
+    sites, n = values.shape
+    times = np.asarray(times, dtype = 'datetime64[m]')
+    hour = ((times - times.astype('datetime64[D]')).astype(np.int64)//60)
+    month = times.astype('datetime64[M]').astype(np.int64) % 12
+    rows, columns = np.nonzero(np.ones((sites, n), dtype = bool) if target is None else target)
+    filled = np.full(len(rows), np.nan)
+    for slot, slots in [(hour, 24), (month*24 + hour, 12*24)]:
+        flat = np.arange(sites)[:,np.newaxis]*slots + slot[np.newaxis,:]
+        sums = np.bincount(flat[valid], weights = values[valid], minlength = sites*slots)
+        counts = np.bincount(flat[valid], minlength = sites*slots)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            profile = (sums/counts)[rows*slots + slot[columns]]
+        filled = np.where(np.isnan(profile), filled, profile)
+    result = np.full((sites, n), np.nan)
+    result[rows, columns] = filled
+    return result
+
+def clearSky(sun_elevation, site_elevation = 0.):
+    #clear sky GHI, DNI and DHI (W/m2) for sun elevations in degrees at a site site_elevation meters up
+    #Meinel beam model with the Laue altitude correction and Kasten-Young air mass, diffuse taken as
+    #a tenth of the beam on the horizontal
+    elevation = np.asarray(sun_elevation, dtype = np.float64)
+    up = elevation > 0
+    height = np.asarray(site_elevation, dtype = np.float64)/1000.
+    with np.errstate(invalid='ignore', over='ignore'):
+        air_mass = 1./(np.sin(np.radians(elevation)) + 0.50572*(6.07995 + elevation)**-1.6364)
+        DNI = 1353.*((1 - 0.14*height)*0.7**(air_mass**0.678) + 0.14*height)
+    DNI = np.where(up, DNI, 0.)
+    beam = DNI*np.sin(np.radians(np.where(up, elevation, 0.)))
+    return 1.1*beam, DNI, 0.1*beam
+
+def direction(east, north, target):
+    #wind direction in degrees (0 north, 90 east) of the components at the positions in target, nan elsewhere
+    result = np.full(east.shape, np.nan)
+    result[target] = np.mod(np.degrees(np.arctan2(east[target], north[target])), 360.)
+    return result
+
+def fillWeather(columns, times, sun_elevation, site_elevation = 0., max_gap = 3):
+    #fills the nan values of GHI, Diff, Tamb, RH, Wspd and Wdir (each (sites, n) or (n,) arrays in the dict columns)
+    #times are the n local times, sun_elevation the sun elevation (degrees) at each of them for every site
+    #runs of up to max_gap hours: irradiance is the clear sky value scaled by the clearness of the hours around
+    #the gap, the rest is interpolated. Longer runs: clear sky irradiance, climatology for the rest
+    #returns the filled columns and {column: {method: values filled}}
+    times = np.asarray(times, dtype = 'datetime64[m]')
+    single = np.ndim(columns['GHI']) == 1
+    table = dict((name, np.atleast_2d(np.array(values, dtype = np.float64))) for name, values in columns.items())
+    sites, n = table['GHI'].shape
+    interval = (times[1] - times[0]).astype(np.int64) if n > 1 else 60
+    max_steps = max_gap*60//interval
+    #the air mass is worked out once per time when all sites share one sun elevation row
+    site_elevation = np.reshape(np.asarray(site_elevation, dtype = np.float64), (-1, 1))
+    clear = dict((key, np.broadcast_to(value, (sites, n))) for key, value in \
+                 zip(['GHI', 'DNI', 'Diff'], clearSky(sun_elevation, site_elevation)))
+    counts = {}
+
+    for name in IRRADIANCE + METEO + ['Wdir']:
+        if name not in table:
+            continue
+        values = table[name]
+        missing = np.isnan(values)
+        short = missing & (runLengths(missing) <= max_steps)
+        long = missing & ~short
+        methods = {}
+        if name in IRRADIANCE:
+            #clearness index of the measured hours (sun high enough), interpolated across short gaps
+            sunny = clear['GHI'] > MIN_CLEAR_GHI
+            with np.errstate(divide='ignore', invalid='ignore'):
+                index = np.clip(interpolate(values/clear[name], ~missing & sunny, short & sunny), 0., 10.)
+            scaled = short & sunny & ~np.isnan(index)
+            methods['scaled'] = (scaled, clear[name]*index)
+            methods['clearsky'] = (missing & ~scaled, clear[name])
+        elif name == 'Wdir':
+            #wind direction goes around the circle, fill its east and north components
+            east, north = np.sin(np.radians(values)), np.cos(np.radians(values))
+            methods['interpolated'] = (short, direction(interpolate(east, ~missing, short), interpolate(north, ~missing, short), short))
+            methods['climatology'] = (long, direction(climatology(east, ~missing, times, long), \
+                                                      climatology(north, ~missing, times, long), long))
+        else:
+            methods['interpolated'] = (short, interpolate(values, ~missing, short))
+            methods['climatology'] = (long, climatology(values, ~missing, times, long))
+
+        result = values.copy()
+        counts[name] = dict((method, 0) for method in METHODS)
+        for method in METHODS:
+            if method not in methods:
+                continue
+            where, fill = methods[method]
+            where = where & ~np.isnan(fill)
+            result[where] = fill[where]
+            counts[name][method] = int(where.sum())
+        #nothing to go on at all (a site without any data for this column)
+        still = np.isnan(result) & missing
+        result[still] = 0.
+        counts[name]['zero'] = int(still.sum())
+        if name == 'RH':
+            result = np.clip(result, 0., 100.)
+        elif name == 'Wspd':
+            result = np.maximum(result, 0.)
+        table[name] = result
+
+    if single:
+        table = dict((name, values[0]) for name, values in table.items())
+    return table, counts
@@ -0,0 +1,153 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Interval statistics of minute data: the mean, sample count, minimum and
+maximum of every column per output interval, taken straight from numpy
+columns, with intervals holding too few samples marked as missing
+
+This is not a faster pandas resample as such, what it saves is building a
+DataFrame. On 2.7M minutes x 6 columns, aggregating from the columns beats
+building a frame and resampling it (0.33 s against 0.43 s for the four
+statistics at 60 minute intervals, 0.22 s against 0.29 s for the mean and
+count the converters keep). On a frame that already exists resample is as
+fast at 60 minutes and faster at 15 minutes, and its mean and count alone
+take 0.16 s. benchmark.py --aggregate-samples times both"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import numpy as np
+
+#steps between samples up to this long are counted in a table by sampleMinutes
+DAY_SECONDS = 86400
+
+
+def sampleMinutes(times):
+    #the most common step in minutes between consecutive distinct times (5 for 5 minute data), None under two times
+    #time ordered times are not sorted again, steps up to a day are counted with bincount and only the longer
+    #ones (gaps) go through np.unique
+    seconds = np.asarray(times, dtype = 'datetime64[s]').astype(np.int64)
+    if np.any(seconds[1:] < seconds[:-1]):
+        seconds = np.sort(seconds)
+    steps = np.diff(seconds)
+    steps = steps[steps > 0]
+    if not len(steps):
+        return None
+    short = np.bincount(steps[steps <= DAY_SECONDS])
+    values, counts = np.unique(steps[steps > DAY_SECONDS], return_counts = True)
+    #ties go to the shorter step
+    if len(counts) and (not len(short) or counts.max() > short.max()):
+        return values[np.argmax(counts)]/60
+    return np.argmax(short)/60
+
+def minimumSamples(times, interval = 60, min_coverage = 0., sample_minutes = None):
+    #samples an interval needs to count: min_coverage (0 to 1) of the interval/sample_minutes samples expected in it
+    #sample_minutes is taken from the times when not given, 0 without a min_coverage (every sample counts)
+    if not min_coverage:
+        return 0
+    if sample_minutes is None:
+        sample_minutes = sampleMinutes(times) or interval
+    #rounded up, a small tolerance keeps 0.75*12 at 9
+    return max(int(np.ceil(min_coverage*interval/sample_minutes - 1e-9)), 1)
+
+def aggregate(times, columns, interval = 60, min_coverage = 0., sample_minutes = None, counts = None, extremes = True):
+    #{'time': start of every interval from the one of the first sample to the one of the last (datetime64[m]),
+    # 'mean', 'count', 'min', 'max': (intervals, columns) arrays} of the samples at times in any order
+    #intervals are counted from midnight like resample('%sT' % interval), nan values are left out, an interval
+    #without samples has count 0 and nan for the rest, the mean is nan where the count is under minimumSamples
+    #counts (rows x columns, or one per row) is the number of samples behind every row when the rows are averages
+    #already (server aggregated pulls), the count and the coverage then go by those, the mean stays over the rows
+    #extremes False leaves out 'min' and 'max' (the two reductions cost as much as the mean and count)
+    #sums add up in time order like pandas does, so the means match resample(..., how='mean') bit for bit
+    times = np.asarray(times, dtype = 'datetime64[us]')
+    columns = [np.asarray(column, dtype = np.float64) for column in columns]
+    width = len(columns)
+    if not len(times):
+        empty = np.empty((0, width))
+        stats = {'time': np.array([], dtype = 'datetime64[m]'), 'mean': empty, 'count': empty.astype(np.int64)}
+        if extremes:
+            stats.update({'min': empty, 'max': empty})
+        return stats
+    if counts is not None:
+        counts = np.asarray(counts, dtype = np.float64).reshape(len(times), -1)
+
+    stamps = times.view(np.int64)
+    step = interval*60*10**6
+    order = None
+    ordered = not np.any(stamps[1:] < stamps[:-1])
+    day = (times[0] if ordered else times.min()).astype('datetime64[D]')
+    base = day.astype('datetime64[us]').astype(np.int64)
+    if not ordered:
+        index = (stamps - base)//step
+        first = index.min()
+        if first:
+            index -= first
+        size = index.max() + 1
+        order = np.argsort(index, kind = 'mergesort')
+        index = index[order]
+        run_rows = np.bincount(index, minlength = size)
+    else:
+        #time ordered data: the first sample of every interval is searched for instead of dividing every time
+        first = (stamps[0] - base)//step
+        size = (stamps[-1] - base)//step - first + 1
+        bounds = np.searchsorted(stamps, base + (first + np.arange(1, size))*step)
+        run_rows = np.diff(np.concatenate([[0], bounds, [len(stamps)]]))
+        index = np.repeat(np.arange(size), run_rows)
+    #the runs of equal intervals are contiguous now, every interval has a sample unless there are gaps
+    occupied = np.flatnonzero(run_rows)
+    starts = np.cumsum(run_rows)[occupied] - run_rows[occupied]
+    if len(occupied) == size:
+        occupied = slice(None)
+
+    #one contiguous pass per column. The nan values are copied into one buffer (reused by every column) as +inf
+    #for the minimum, -inf for the maximum and 0 for the sums: minimum/maximum.reduceat run twice as fast as
+    #fmin/fmax on data without nan, bincount adds in time order and the 0 leaves the sums bit for bit the same
+    #rows are the run lengths less the nan values
+    #the (intervals, columns) tables are in column order, so every column of them is filled in one contiguous run
+    shape = (size, width)
+    sums = np.empty(shape, order = 'F')
+    rows = np.empty(shape, dtype = np.int64, order = 'F')
+    count = rows if counts is None else np.empty(shape, dtype = np.int64, order = 'F')
+    if extremes:
+        low = np.full(shape, np.nan, order = 'F')
+        high = np.full(shape, np.nan, order = 'F')
+    filled = None
+    for i, column in enumerate(columns):
+        if order is not None:
+            column = column[order]
+        nan = np.flatnonzero(np.isnan(column))
+        if len(nan):
+            if filled is None:
+                filled = np.empty(len(column))
+            np.copyto(filled, column)
+            column = filled
+        if extremes:
+            column[nan] = np.inf
+            low[occupied,i] = np.minimum.reduceat(column, starts)
+            column[nan] = -np.inf
+            high[occupied,i] = np.maximum.reduceat(column, starts)
+        column[nan] = 0.
+        sums[:,i] = np.bincount(index, weights = column, minlength = size)
+        rows[:,i] = run_rows - np.bincount(index[nan], minlength = size)
+        if counts is not None:
+            samples = counts[:,i if counts.shape[1] > 1 else 0]
+            if order is not None:
+                samples = samples[order]
+            if len(nan):
+                samples = samples.copy()
+                samples[nan] = 0.
+            count[:,i] = np.round(np.bincount(index, weights = samples, minlength = size))
+    if extremes:
+        #intervals of nan values only
+        low[rows == 0] = np.nan
+        high[rows == 0] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums/rows
+    stats = {'mean': mean, 'count': count}
+    if extremes:
+        stats.update({'min': low, 'max': high})
+    minimum = minimumSamples(times, interval, min_coverage, sample_minutes)
+    if minimum:
+        stats['mean'][stats['count'] < minimum] = np.nan
+
+    stats['time'] = day.astype('datetime64[m]') + (first + np.arange(size))*np.timedelta64(interval, 'm')
+    return stats
@@ -0,0 +1,45 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Module stand-ins that import the real module the first time one of its
+attributes is used, so heavy (pandas) and optional (pymssql) dependencies
+cost nothing until a code path needs them"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import importlib
+
+
+class LazyModule(object):
+    #pd = LazyModule('pandas') behaves like 'import pandas as pd' once pd.anything is read
+    #needed_for names what the module is used for in the ImportError raised when it is not installed
+
+    def __init__(self, name, needed_for = None):
+        self.__dict__['_name'] = name
+        self.__dict__['_needed_for'] = needed_for
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                self.__dict__['_module'] = importlib.import_module(self._name)
+            except ImportError as error:
+                if self._needed_for is None:
+                    raise
+                raise ImportError("%s (needed for %s): %s" % (self._name, self._needed_for, error))
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '%s' (not imported yet)>" % self._name
+        return repr(self._module)
+
+
+def lazyImport(name, needed_for = None):
+    return LazyModule(name, needed_for)
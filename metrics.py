@@ -0,0 +1,160 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Per stage timing and counters (rows, bytes, cache hits) for WeatherToCSV,
+AngleToCSV and SunCalc. Disabled by default, then every call is a no-op"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import sys
+import json
+import time
+
+
+class Metrics(object):
+    #wall time, number of runs and named counters per stage, e.g.
+    #   with metrics.stage('fetch', rows = 10):
+    #       ...
+    #hook is called as hook(stage, seconds, counts) every time a stage finishes (counts only holds that run)
+
+    def __init__(self, hook = None):
+        self.hook = hook
+        self.stages = {}
+
+    def stage(self, name, **counts):
+        return _Stage(self, name, counts)
+
+    def add(self, name, seconds = 0., **counts):
+        #adds one run of a stage, counters are summed over runs
+        stage = self.stages.setdefault(name, {'seconds': 0., 'runs': 0})
+        stage['seconds'] += seconds
+        stage['runs'] += 1
+        for counter, amount in counts.items():
+            stage[counter] = stage.get(counter, 0) + amount
+        if self.hook is not None:
+            self.hook(name, seconds, counts)
+
+    def count(self, name, **counts):
+        #adds to the counters of a stage without counting a run or any time
+        stage = self.stages.setdefault(name, {'seconds': 0., 'runs': 0})
+        for counter, amount in counts.items():
+            stage[counter] = stage.get(counter, 0) + amount
+
+    def chunks(self, name, chunks):
+        #passes a generator of numpy column chunks through, timing every chunk it waits for
+        #and counting the rows and bytes of the chunks as one run of the stage
+        seconds = 0.
+        rows = 0
+        size = 0
+        iterator = iter(chunks)
+        while True:
+            start = time.time()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            seconds += time.time() - start
+            rows += len(chunk[0])
+            size += sum(column.nbytes for column in chunk)
+            yield chunk
+        self.add(name, seconds + time.time() - start, rows = rows, bytes = size)
+
+    def summary(self):
+        #copy of the stages with rows/s filled in where a stage counted rows
+        summary = {}
+        for name, stage in self.stages.items():
+            summary[name] = dict(stage)
+            if 'rows' in stage and stage['seconds'] > 0:
+                summary[name]['rows_per_s'] = stage['rows']/stage['seconds']
+        return summary
+
+    def report(self, stream = None):
+        stream = stream or sys.stdout
+        for name in sorted(self.stages):
+            stage = self.stages[name]
+            counters = ' '.join('%s=%s' % (counter, stage[counter]) for counter in sorted(stage) if counter not in ('seconds', 'runs'))
+            stream.write('%-16s %4d runs %9.3f s %s\n' % (name, stage['runs'], stage['seconds'], counters))
+
+
+class _Stage(object):
+    #context manager timing one run of a stage, more counters can be added with count before it exits
+
+    def __init__(self, metrics, name, counts):
+        self.metrics = metrics
+        self.name = name
+        self.counts = counts
+
+    def count(self, **counts):
+        for counter, amount in counts.items():
+            self.counts[counter] = self.counts.get(counter, 0) + amount
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.metrics.add(self.name, time.time() - self.start, **self.counts)
+        return False
+
+
+class NullMetrics(object):
+    #stands in when instrumentation is off, every method does nothing
+
+    hook = None
+    stages = {}
+
+    def stage(self, name, **counts):
+        return _NULL_STAGE
+
+    def add(self, name, seconds = 0., **counts):
+        pass
+
+    def count(self, name, **counts):
+        pass
+
+    def chunks(self, name, chunks):
+        return chunks
+
+    def summary(self):
+        return {}
+
+    def report(self, stream = None):
+        pass
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+
+class _NullStage(object):
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+NULL_METRICS = NullMetrics()
+
+
+def resolve(metrics):
+    #turns the metrics argument of the converters into a metrics object:
+    #None gives the shared no-op one, a callable becomes the hook of a new Metrics
+    if metrics is None:
+        return NULL_METRICS
+    if callable(metrics):
+        return Metrics(hook = metrics)
+    return metrics
+
+def logLine(stream = None):
+    #hook writing one JSON line per finished stage, e.g. Metrics(hook = logLine(sys.stderr))
+    def hook(name, seconds, counts):
+        record = dict(counts)
+        record['stage'] = name
+        record['seconds'] = round(seconds, 6)
+        (stream or sys.stderr).write(json.dumps(record, sort_keys = True) + '\n')
+    return hook
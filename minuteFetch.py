@@ -0,0 +1,64 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Streams rows out of a database cursor in chunks of typed numpy arrays
+so long pulls never hold millions of python objects at once"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import numpy as np
+
+#column types used for the pulled minute data, timestamps first
+TIME_DTYPE = 'datetime64[us]'
+VALUE_DTYPE = np.float64
+
+
+class ColumnBuffer(object):
+    #growable set of typed numpy columns, doubles its capacity when full
+    #so appending n rows costs amortized O(n) and no per row objects
+
+    def __init__(self, dtypes, capacity = 4096):
+        self.dtypes = dtypes
+        self.size = 0
+        self.columns = [np.empty(capacity, dtype = dtype) for dtype in dtypes]
+
+    def extend(self, chunk):
+        #chunk is a list of equal length arrays, one per column
+        rows = len(chunk[0])
+        if self.size + rows > len(self.columns[0]):
+            capacity = max(2*len(self.columns[0]), self.size + rows)
+            for i in range(len(self.columns)):
+                grown = np.empty(capacity, dtype = self.dtypes[i])
+                grown[:self.size] = self.columns[i][:self.size]
+                self.columns[i] = grown
+        for i in range(len(self.columns)):
+            self.columns[i][self.size:self.size + rows] = chunk[i]
+        self.size += rows
+
+    def arrays(self):
+        #trimmed copies of the filled part of every column
+        return [column[:self.size].copy() for column in self.columns]
+
+
+def fetchChunks(cursor, chunk_size, time_shift, dtypes):
+    #generator over an executed cursor, reads chunk_size rows at a time with fetchmany
+    #first column is a timestamp shifted by time_shift hours (vectorized), the others are cast to dtypes
+    #NULL values become nan in float columns
+    shift = np.timedelta64(int(round(time_shift*3600e6)), 'us')
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        chunk = [np.array(columns[0], dtype = TIME_DTYPE) + shift]
+        for i in range(1, len(columns)):
+            chunk.append(np.array(columns[i], dtype = dtypes[i-1]))
+        yield chunk
+
+
+def collectChunks(chunks, dtypes):
+    #drains a chunk generator into one array per column
+    buffer = ColumnBuffer([TIME_DTYPE] + list(dtypes))
+    for chunk in chunks:
+        buffer.extend(chunk)
+    return buffer.arrays()
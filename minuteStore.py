@@ -0,0 +1,130 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Local columnar copy of the raw minute data pulled from the server
+so repeat pulls only ask the server for the time ranges not stored yet"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import re
+import json
+from datetime import datetime, timedelta
+import numpy as np
+import minuteFetch
+
+#format the UTC bounds are sent to the server in (see convertToUTC)
+SQL_TIME_FORMAT = '%m/%d/%y %H:%M'
+RANGE_FORMAT = '%Y-%m-%d %H:%M'
+
+
+class MinuteStore(object):
+    #one directory per key (database, location and row for angles), one .npz file per UTC day
+    #holding a timestamp column plus one column per value, and a ranges.json listing the UTC
+    #spans already pulled from the server (data inside a span that is not on disk does not exist)
+
+    def __init__(self, directory, settle_hours = 24):
+        #rows newer than settle_hours may still be arriving at the server, an empty answer
+        #for a range that recent is not remembered as covered
+        self.directory = directory
+        self.settle_hours = settle_hours
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def keyPath(self, key):
+        name = '_'.join(re.sub(r'[^\w.-]', '-', str(part)) for part in key)
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def ranges(self, key):
+        path = os.path.join(self.keyPath(key), 'ranges.json')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return [(datetime.strptime(start, RANGE_FORMAT), datetime.strptime(end, RANGE_FORMAT)) for start, end in json.load(f)]
+
+    def missing(self, key, start, end):
+        #list of (start, end) UTC spans inside [start, end] that were never pulled
+        gaps = []
+        for covered_start, covered_end in self.ranges(key):
+            if covered_end < start or covered_start > end:
+                continue
+            if covered_start > start:
+                gaps.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            gaps.append((start, end))
+        return gaps
+
+    def cover(self, key, start, end):
+        #adds [start, end] to the pulled spans, merging overlapping ones
+        spans = sorted(self.ranges(key) + [(start, end)])
+        merged = [spans[0]]
+        for span_start, span_end in spans[1:]:
+            if span_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+            else:
+                merged.append((span_start, span_end))
+        with open(os.path.join(self.keyPath(key), 'ranges.json'), 'w') as f:
+            json.dump([[span_start.strftime(RANGE_FORMAT), span_end.strftime(RANGE_FORMAT)] for span_start, span_end in merged], f)
+
+    def write(self, key, columns):
+        #merges UTC columns [timestamp, values...] into the day files, rows already stored are replaced
+        if len(columns[0]) == 0:
+            return
+        path = self.keyPath(key)
+        days = columns[0].astype('datetime64[D]')
+        for day in np.unique(days):
+            in_day = days == day
+            day_columns = [column[in_day] for column in columns]
+            file_name = os.path.join(path, '%s.npz' % day)
+            if os.path.exists(file_name):
+                stored = self.readDay(file_name)
+                day_columns = [np.concatenate([new, old]) for new, old in zip(day_columns, stored)]
+            #np.unique keeps the first of equal timestamps, which is the freshly pulled row
+            timestamp, keep = np.unique(day_columns[0], return_index = True)
+            np.savez(file_name, *[column[keep] for column in day_columns])
+
+    def read(self, key, start, end):
+        #UTC columns for start <= timestamp <= end in time order, or None when nothing is stored
+        path = self.keyPath(key)
+        first = np.datetime64(start, 'D')
+        last = np.datetime64(end, 'D')
+        parts = []
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith('.npz') and first <= np.datetime64(file_name[:-4], 'D') <= last:
+                parts.append(self.readDay(os.path.join(path, file_name)))
+        if not parts:
+            return None
+        columns = [np.concatenate(column) for column in zip(*parts)]
+        keep = (columns[0] >= np.datetime64(start, 'us')) & (columns[0] <= np.datetime64(end, 'us'))
+        return [column[keep] for column in columns]
+
+    def readDay(self, file_name):
+        with np.load(file_name) as stored:
+            return [stored['arr_%s' % i] for i in range(len(stored.files))]
+
+    def pull(self, key, date_start_UTC, date_end_UTC, query, dtypes, chunk_size = 50000):
+        #returns UTC columns for the range, asking the server only for the spans not stored yet
+        #query(start, end) runs the minute query for two UTC strings in SQL_TIME_FORMAT and returns the cursor
+        start = datetime.strptime(date_start_UTC, SQL_TIME_FORMAT)
+        end = datetime.strptime(date_end_UTC, SQL_TIME_FORMAT)
+        settled = datetime.utcnow() - timedelta(hours = self.settle_hours)
+        for gap_start, gap_end in self.missing(key, start, end):
+            cursor = query(gap_start.strftime(SQL_TIME_FORMAT), gap_end.strftime(SQL_TIME_FORMAT))
+            columns = minuteFetch.collectChunks(minuteFetch.fetchChunks(cursor, chunk_size, 0, dtypes), dtypes)
+            self.write(key, columns)
+            #only remember the gap up to the newest row the server had, unless that part of the range is settled
+            covered_end = settled
+            if len(columns[0]):
+                newest = columns[0].max().astype('datetime64[m]').tolist()
+                covered_end = max(covered_end, newest)
+            covered_end = min(covered_end, gap_end)
+            if covered_end > gap_start:
+                self.cover(key, gap_start, covered_end)
+        columns = self.read(key, start, end)
+        if columns is None:
+            columns = [np.array([], dtype = minuteFetch.TIME_DTYPE)] + [np.array([], dtype = dtype) for dtype in dtypes]
+        return columns
@@ -0,0 +1,149 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Runs a fetch -> compute -> write job as a pipeline of threads joined by
+bounded queues, so the database, the cpu and the disk work at the same time"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import numpy as np
+import intervalStats
+
+_DONE = object()
+
+
+class Pipeline(object):
+    #source is any iterable (run in its own thread), every stage is a generator function taking an
+    #iterator of items and yielding items (each in its own thread), sink is called on every final item
+    #in the calling thread. Queues hold at most queue_size items, a slow step makes the ones before it wait
+
+    def __init__(self, queue_size = 4):
+        self.queue_size = queue_size
+        self.error = None
+
+    def run(self, source, stages, sink):
+        self.error = None
+        queues = [queue.Queue(self.queue_size) for i in range(len(stages) + 1)]
+        threads = [threading.Thread(target = self._feed, args = (source, queues[0]))]
+        for i in range(len(stages)):
+            threads.append(threading.Thread(target = self._feed, args = (stages[i](self._items(queues[i])), queues[i + 1])))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for item in self._items(queues[-1]):
+                sink(item)
+        except Exception as error:
+            self.error = self.error or error
+        #unblock anything still waiting on a full queue before joining
+        for step in queues:
+            self._drain(step)
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _feed(self, items, output):
+        try:
+            for item in items:
+                if self.error is not None:
+                    break
+                self._put(output, item)
+        except Exception as error:
+            self.error = self.error or error
+        self._put(output, _DONE)
+
+    def _put(self, output, item):
+        #put that gives up once another step failed, so no thread hangs on a queue nobody reads
+        while True:
+            try:
+                output.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                if self.error is not None:
+                    return
+
+    def _items(self, source):
+        while True:
+            try:
+                item = source.get(timeout = 0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    return
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _drain(self, step):
+        while True:
+            try:
+                step.get_nowait()
+            except queue.Empty:
+                return
+
+
+def hourlyBlocks(chunks, year_start, hours, width, fill_value, interval = 60, min_coverage = 0., sample_minutes = None):
+    #generator stage turning time ordered [timestamp, values...] chunks (width value columns) into interval minute
+    #means for one year (hourly by default, hours then counts intervals)
+    #yields (first interval index, means) as soon as intervals are complete, every interval of the year exactly once
+    #an interval is complete when a later sample arrives, the last one with data once the chunks run out
+    #matches resample('H', how='mean') then reindex(fill_value) on the year: empty hours between the first
+    #and last sample are nan, hours before the first and after the last sample get fill_value
+    #hours with fewer samples than min_coverage asks for are nan too (see intervalStats.minimumSamples, the
+    #sample step is taken from the first chunk when sample_minutes is not given)
+    year_start = np.datetime64(year_start, 'm')
+    minimum = None
+    emitted = 0
+    first = None
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = [np.concatenate([old, new]) for old, new in zip(carry, chunk)]
+        if len(chunk[0]) == 0:
+            continue
+        hour_index = (chunk[0].astype('datetime64[m]') - year_start).astype(np.int64)//interval
+        if first is None:
+            first = hour_index[0]
+            minimum = intervalStats.minimumSamples(chunk[0], interval, min_coverage, sample_minutes)
+        #the newest hour may still get samples from the next chunk
+        last = hour_index[-1]
+        done = hour_index < last
+        carry = [column[~done] for column in chunk]
+        block = _hourMeans(hour_index[done], [column[done] for column in chunk[1:]], emitted, min(last, hours), first, fill_value, minimum)
+        if block is not None:
+            yield emitted, block
+            emitted += len(block)
+    if carry is not None:
+        hour_index = (carry[0].astype('datetime64[m]') - year_start).astype(np.int64)//interval
+        last = hour_index[-1] + 1
+        block = _hourMeans(hour_index, carry[1:], emitted, min(last, hours), first, fill_value, minimum)
+        if block is not None:
+            yield emitted, block
+            emitted += len(block)
+    if emitted < hours:
+        yield emitted, np.full((hours - emitted, width), fill_value, dtype = np.float64)
+
+def _hourMeans(hour_index, columns, start, end, first, fill_value, minimum = 0):
+    #means over the hours start <= hour < end, nan for empty hours (and ones under minimum samples) from first on,
+    #fill_value before
+    if end <= start:
+        return None
+    size = end - start
+    inside = (hour_index >= start) & (hour_index < end)
+    position = hour_index[inside] - start
+    means = np.empty((size, len(columns)))
+    for i in range(len(columns)):
+        values = columns[i][inside]
+        valid = ~np.isnan(values)
+        sums = np.bincount(position[valid], weights = values[valid], minlength = size)
+        counts = np.bincount(position[valid], minlength = size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[:,i] = np.where(counts >= minimum, sums/counts, np.nan)
+    means[np.arange(start, end) < first] = fill_value
+    return means
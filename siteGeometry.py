@@ -0,0 +1,131 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Sun position of many sites over one local time grid at once: sites x
+times matrices of azimuth, elevation, roll and AOI, computed by broadcasting
+every site against the row of times (the sun coordinates of a date are
+computed once for all the sites on the same UTC offset), in a pool of worker
+processes writing into shared memory when the grid is large. The converters
+of every site read their rows of the matrices as views (useGeometry)"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import numpy as np
+from lazyImport import lazyImport
+from sunCalc import SunCalc, GEOMETRY_KEYS, UNIX_JD, sun_coordinates, sun_positions, year_times
+multiprocessing = lazyImport('multiprocessing')
+
+#the matrices of a pool worker, set up by startWorker
+_SHARED = {}
+
+
+def siteOffsets(suns):
+    #latitudes, longitudes (radians) and UTC offsets (timedelta64[us]) of a list of SunCalc
+    lat = np.array([sun.lat for sun in suns])
+    long = np.array([sun.long for sun in suns])
+    offset = np.array([int(round((sun.TimeZone + sun.DST)*3600e6)) for sun in suns]).astype('timedelta64[us]')
+    return lat, long, offset
+
+def blocks(offset, points, parts = 1, chunk_size = 2**18):
+    #(sites, first time, last time) blocks covering every site over points times: the sites of a UTC offset (whose
+    #dates are the same) in up to parts groups, times in chunks of chunk_size
+    tasks = []
+    for value in np.unique(offset):
+        sites = np.flatnonzero(offset == value)
+        for group in np.array_split(sites, min(parts, len(sites))):
+            tasks += [(group, start, min(start + chunk_size, points)) for start in range(0, points, chunk_size)]
+    return tasks
+
+def fillBlock(tables, times, lat, long, offset, block):
+    #computes one block of the matrices in place, the same arithmetic as SunCalc.array_calc on every row
+    #the sun coordinates of the dates are computed once, then every site is broadcast against them row by row
+    #(a column of sites against the row of dates runs slower, the strided loops lose the contiguous fast path)
+    sites, start, end = block
+    utc = (times[start:end] - offset[sites[0]]).astype(np.int64)/86400e6 + UNIX_JD
+    coordinates = sun_coordinates(utc)
+    for i in sites:
+        sun_pos = sun_positions(utc, lat[i], long[i], coordinates)
+        for name in GEOMETRY_KEYS:
+            tables[name][i,start:end] = sun_pos[name]
+
+def startWorker(buffers, shape, times, lat, long, offset):
+    #pool initializer, maps the shared buffers as the matrices the blocks are written to
+    _SHARED['tables'] = dict((name, np.frombuffer(buffers[name], dtype = np.float64).reshape(shape)) for name in GEOMETRY_KEYS)
+    _SHARED['site'] = (times, lat, long, offset)
+
+def workerBlock(block):
+    #module level so a multiprocessing pool can run it
+    fillBlock(_SHARED['tables'], *(_SHARED['site'] + (block,)))
+
+
+class SiteGeometry(object):
+    #sun position of every site (sunCalc_dicts) over one grid of local times, each site on its own clock like
+    #year_calc: tables[name] is a (sites, times) float64 matrix for every name of GEOMETRY_KEYS, row i is what
+    #SunCalc(locations[i]).array_calc(times) gives (numpy engine)
+    #workers > 1 splits grids of at least min_points positions over a pool of processes writing straight into
+    #shared memory (multiprocessing.RawArray), the matrices then stay on those buffers, nothing is copied back
+    #chunk_size bounds the positions computed at once
+
+    def __init__(self, locations, times, workers = None, min_points = 2**20, chunk_size = 2**18):
+        self.locations = list(locations)
+        self.names = [location['Name'] for location in self.locations]
+        self.suns = [SunCalc(location) for location in self.locations]
+        self.times = np.asarray(times, dtype = 'datetime64[us]')
+        shape = (len(self.suns), len(self.times))
+        site = (self.times,) + siteOffsets(self.suns)
+        pooled = workers and workers > 1 and shape[0]*shape[1] >= min_points
+        #a few blocks per worker keeps them all busy to the end
+        tasks = blocks(site[3], shape[1], 4*workers if pooled else 1, chunk_size)
+
+        if pooled and len(tasks) > 1:
+            buffers = dict((name, multiprocessing.RawArray('d', shape[0]*shape[1])) for name in GEOMETRY_KEYS)
+            self.tables = dict((name, np.frombuffer(buffers[name], dtype = np.float64).reshape(shape)) for name in GEOMETRY_KEYS)
+            pool = multiprocessing.Pool(workers, startWorker, (buffers, shape) + site)
+            pool.map(workerBlock, tasks)
+            pool.close()
+            pool.join()
+        else:
+            self.tables = dict((name, np.empty(shape)) for name in GEOMETRY_KEYS)
+            for block in tasks:
+                fillBlock(self.tables, *(site + (block,)))
+
+    def index(self, site):
+        #row of a site given by its position or its Name
+        if isinstance(site, (int, np.integer)):
+            if not -len(self.names) <= site < len(self.names):
+                raise IndexError("no site %s of %s" % (site, len(self.names)))
+            return site % len(self.names)
+        if self.names.count(site) != 1:
+            raise KeyError("%s sites named %s, pick the row by its position" % (self.names.count(site) or 'no', site))
+        return self.names.index(site)
+
+    def site(self, site, start = None, end = None):
+        #{name: row} of one site between positions start and end of the grid, views on the matrices
+        i = self.index(site)
+        return dict((name, self.tables[name][i,start:end]) for name in GEOMETRY_KEYS)
+
+    def attach(self, sun_calc, site = None, interval = 60):
+        #hands the rows of a site to a SunCalc as year_calc presets for every whole year of the grid on the interval
+        #minute year_calc grid, so its numpy engine years are sliced out of the matrices instead of computed
+        #site defaults to the Name of the sun_calc, which must be at the same place and clock, returns the years attached
+        i = self.index(sun_calc.name if site is None else site)
+        sun = self.suns[i]
+        if (sun.lat, sun.long, sun.TimeZone, sun.DST) != (sun_calc.lat, sun_calc.long, sun_calc.TimeZone, sun_calc.DST):
+            raise ValueError("site %s of the geometry is not where %s is" % (self.names[i], sun_calc.name))
+        attached = []
+        if not len(self.times):
+            return attached
+        first, last = [int(str(value.astype('datetime64[Y]'))) for value in self.times[[0, -1]]]
+        for year in range(first, last + 1):
+            grid = year_times(year, year, interval).astype('datetime64[us]')
+            start = np.searchsorted(self.times, grid[0])
+            end = start + len(grid)
+            if end <= len(self.times) and np.array_equal(self.times[start:end], grid):
+                sun_calc.presets[(year, interval)] = self.site(i, start, end)
+                attached.append(year)
+        return attached
+
+
+def yearGeometry(locations, first, last, interval = 60, workers = None):
+    #SiteGeometry of the sites over the year_calc grid of years first to last, ready to attach to their converters
+    return SiteGeometry(locations, year_times(first, last, interval), workers)
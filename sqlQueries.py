@@ -0,0 +1,63 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Builds the weather and angle queries for the solar database, either
+returning every minute row or averaged per local interval on the server.
+Supports the production SQL Server and a local SQLite copy of the tables"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+from datetime import datetime
+
+#format the UTC bounds come in (see convertToUTC)
+SQL_TIME_FORMAT = '%m/%d/%y %H:%M'
+
+WEATHER_COLUMNS = ['GlobalSolar_Avg', 'DiffuseSolar_Avg', 'AirTemp_C_Avg', 'RH_Avg', 'WindSpd_ms_WVc1', 'WindSpd_ms_WVc2']
+ANGLE_COLUMNS = ['Angle']
+
+
+def tableName(dialect, database):
+    #sqlite has no server.schema.table names, the local copy keeps just the table
+    if dialect == 'sqlite':
+        return database.split('.')[-1]
+    return database
+
+def timeLiteral(dialect, time_string):
+    #SQL Server takes our UTC strings as they are, sqlite compares ISO text
+    if dialect == 'sqlite':
+        return datetime.strptime(time_string, SQL_TIME_FORMAT).strftime('%Y-%m-%d %H:%M:%S')
+    return time_string
+
+def localHour(dialect, time_shift, interval = 60):
+    #expression for the start of the local interval of interval minutes (a divisor of an hour) each TimeStamp falls in,
+    #counted from midnight like the output intervals
+    minutes = int(round(time_shift*60))
+    if interval == 60:
+        if dialect == 'sqlite':
+            return "strftime('%%Y-%%m-%%d %%H:00:00', TimeStamp, '%+d minutes')" % minutes
+        return "DATEADD(hour, DATEDIFF(hour, 0, DATEADD(minute, %d, TimeStamp)), 0)" % minutes
+    if dialect == 'sqlite':
+        return "datetime(CAST(strftime('%%s', TimeStamp, '%+d minutes') AS INTEGER)/%d*%d, 'unixepoch')" % (minutes, interval*60, interval*60)
+    return "DATEADD(minute, DATEDIFF(minute, 0, DATEADD(minute, %d, TimeStamp))/%d*%d, 0)" % (minutes, interval, interval)
+
+def minuteQuery(dialect, database, columns, DB_location, date_start_UTC, date_end_UTC, row = None, aggregate = False, time_shift = 0, names = None, \
+                interval = 60):
+    #raw query: TimeStamp plus the columns for every row in the range, in time order
+    #aggregate query: one row per local interval of interval minutes (hourly by default) holding the interval start,
+    #AVG of every column then COUNT of every column
+    #names asks for several rows (Name) at once in a raw query, the Name column is then selected after the value columns
+    where = "Location ='%s' and TimeStamp >= '%s' and TimeStamp <= '%s'" % \
+            (DB_location, timeLiteral(dialect, date_start_UTC), timeLiteral(dialect, date_end_UTC))
+    if row is not None:
+        where += " and Name = '%s'" % row
+    if names is not None:
+        where += " and Name in (%s)" % ', '.join("'%s'" % name for name in names)
+        columns = list(columns) + ['Name']
+    if not aggregate:
+        return "select TimeStamp, %s from %s where %s order by timestamp asc" % \
+               (', '.join(columns), tableName(dialect, database), where)
+    hour = localHour(dialect, time_shift, interval)
+    averages = ', '.join('AVG(CAST(%s AS FLOAT))' % column for column in columns)
+    counts = ', '.join('COUNT(%s)' % column for column in columns)
+    return "select %s as HourStamp, %s, %s from %s where %s group by %s order by HourStamp asc" % \
+           (hour, averages, counts, tableName(dialect, database), where, hour)
@@ -4,29 +4,199 @@ Created on May 1, 2014
 @author: tamir.lance
 '''
 
+import os
 import time
 import math
 import ephem
-import datetime
+import hashlib
 import numpy as np
-import pandas as pd
+import metrics as stage_metrics
+import fileReaders
+import gapFill
+
+#ephem dates count days from 1899/12/31 12:00 UTC, julian dates from -4712/1/1 12:00 UTC
+EPHEM_JD = 2415020.
+UNIX_JD = 2440587.5
+J2000_JD = 2451545.
+#atmosphere ephem.Observer() refracts with by default (mBar, C)
+PRESSURE = 1010.
+TEMPERATURE = 15.
+RAD = math.pi/180.
+#bump whenever the geometry math changes so stale cache files are thrown away
+CACHE_VERSION = 1
+GEOMETRY_KEYS = ['time','azimuth','elevation','roll','AOI']
+#interval_calc adds the share of every interval the sun is up
+INTERVAL_KEYS = GEOMETRY_KEYS + ['sun_up']
+
+class GeometryCache(object):
+    #directory of sun position arrays stored as .npy files, one per (site, engine, year, interval)
+    #files are opened memory-mapped so a hit costs no computation and no copy, the least recently
+    #used files are deleted once the directory grows past max_bytes
+
+    def __init__(self, directory, max_bytes = 512*1024**2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        #anything written by another version of the geometry code is stale
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.npy') and not file_name.startswith('v%s_' % CACHE_VERSION):
+                self._remove(os.path.join(directory, file_name))
+
+    def key(self, sun_calc, engine, year, interval, samples = None):
+        #the sun position only depends on where the site is, how local time maps to UTC and the time grid
+        #interval averages (samples per interval, see SunCalc.interval_calc) also on the site elevation their weights use
+        site = (sun_calc.lat, sun_calc.long, sun_calc.TimeZone, sun_calc.DST)
+        if samples:
+            site += (sun_calc.elevation,)
+        key = 'v%s_%s_%s_%s_%smin' % (CACHE_VERSION, hashlib.md5(repr(site).encode('utf-8')).hexdigest()[:16], engine, year, interval)
+        if samples:
+            key += '_x%s' % samples
+        return key
+
+    def load(self, key):
+        path = os.path.join(self.directory, key + '.npy')
+        try:
+            table = np.load(path, mmap_mode = 'r')
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path, None) #mark as recently used
+        self.hits += 1
+        return dict(zip(INTERVAL_KEYS, table))
+
+    def store(self, key, sun_pos):
+        #writes the arrays and hands them back as the same float64 table a later load maps
+        #several processes may store the same key at once (workers of a multiprocessing pool), each writes its own temp file
+        path = os.path.join(self.directory, key + '.npy')
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        table = np.array([sun_pos[name] for name in INTERVAL_KEYS if name in sun_pos], dtype = np.float64)
+        with open(temp_path, 'wb') as f:
+            np.save(f, table)
+        #write then rename so a reader never maps a half written file
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            #windows does not rename over an existing file
+            self._remove(path)
+            os.rename(temp_path, path)
+        self.evict()
+        return dict(zip(INTERVAL_KEYS, table))
+
+    def evict(self):
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.npy'):
+                path = os.path.join(self.directory, file_name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for used, size, path in files)
+        for used, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+
+    def _remove(self, path):
+        #files still mapped by another process cannot be removed on windows, they get evicted next time
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+def year_times(first, last, interval = 60):
+    #local times every interval minutes from Jan 1 00:00 of year first to Dec 31 of year last, the year_calc grid
+    return np.arange('%s-01-01' % first, '%s-01-01' % (last + 1), np.timedelta64(interval, 'm'), dtype = 'datetime64[m]')
+
+def sun_coordinates(jd):
+    #right ascension, sine, cosine and tangent of the declination and sidereal time (radians) at an array of
+    #UTC julian dates, the part of solar_position that is the same for every site
+    T = (jd - J2000_JD)/36525.
+    L0 = 280.46646 + T*(36000.76983 + T*0.0003032)           #geometric mean longitude
+    M = (357.52911 + T*(35999.05029 - T*0.0001537))*RAD  #mean anomaly
+    C = np.sin(M)*(1.914602 - T*(0.004817 + T*0.000014)) + np.sin(2*M)*(0.019993 - T*0.000101) + np.sin(3*M)*0.000289
+    omega = (125.04 - 1934.136*T)*RAD
+    app_long = (L0 + C - 0.00569 - 0.00478*np.sin(omega))*RAD
+    obliquity = (23. + (26. + (21.448 - T*(46.815 + T*(0.00059 - T*0.001813)))/60.)/60. + 0.00256*np.cos(omega))*RAD
+
+    right_ascension = np.arctan2(np.cos(obliquity)*np.sin(app_long), np.cos(app_long))
+    declination = np.arcsin(np.sin(obliquity)*np.sin(app_long))
+    sidereal = (280.46061837 + 360.98564736629*(jd - J2000_JD) + T*T*(0.000387933 - T/38710000.))*RAD
+    return right_ascension, np.sin(declination), np.cos(declination), np.tan(declination), sidereal
+
+def solar_position(jd, lat, long, coordinates = None):
+    #topocentric apparent azimuth and elevation (degrees) of the sun for an array of UTC julian dates
+    #seen from latitude lat and longitude long (radians), which broadcast against jd like any numpy operands
+    #coordinates are the sun_coordinates of jd when already known (several sites on the same dates)
+    right_ascension, sin_dec, cos_dec, tan_dec, sidereal = sun_coordinates(jd) if coordinates is None else coordinates
+    hour_angle = sidereal + long - right_ascension
+
+    cos_hour = np.cos(hour_angle)
+    elevation = np.arcsin(np.sin(lat)*sin_dec + np.cos(lat)*cos_dec*cos_hour)
+    azimuth = np.arctan2(-np.sin(hour_angle), tan_dec*np.cos(lat) - np.sin(lat)*cos_hour)
+    elevation = elevation/RAD - 8.794/3600.*np.cos(elevation) #solar parallax
+    return np.mod(azimuth/RAD, 360.), elevation + refraction(elevation)
+
+def refraction(elevation):
+    #refraction (degrees) to add to a true elevation, found by inverting the Saemundsson style
+    #correction ephem uses by fixed point iteration (it converges in a few steps, the correction is smooth)
+    scale = PRESSURE/(273. + TEMPERATURE)
+    apparent = elevation
+    for i in range(4):
+        low = scale*(0.1594 + 0.0196*apparent + 2e-5*apparent*apparent)/(1. + 0.505*apparent + 0.0845*apparent*apparent)
+        high = scale*7.888888e-5/np.tan(np.maximum(apparent,15.)*RAD)/RAD
+        apparent = elevation + np.where(apparent<15., low, high)
+    return apparent - elevation
+
+def sun_positions(jd, lat, long, coordinates = None):
+    #the numpy engine of array_calc on UTC julian dates: {'time', 'azimuth', 'elevation', 'roll', 'AOI'}
+    #lat and long (radians) broadcast against jd, so a column of sites against a row of dates gives sites x dates arrays
+    with np.errstate(divide='ignore', invalid='ignore'):
+        azimuth, elevation = solar_position(jd, lat, long, coordinates)
+        sin_az = np.sin(azimuth*RAD)
+        roll = np.round(np.arctan(sin_az/np.tan(elevation*RAD))/RAD,2)
+        #dot product of the module normal [sin(roll),cos(roll),0] and the sun vector, as in point_calc
+        cos_AOI = np.sin(roll*RAD)*np.cos(elevation*RAD)*sin_az + np.cos(roll*RAD)*np.sin(elevation*RAD)
+        AOI = np.arccos(cos_AOI)/RAD
+    AOI = np.where((azimuth<90.) | (azimuth>270.), -AOI, AOI)
+
+    return {'time':jd - EPHEM_JD, 'azimuth':azimuth, 'elevation':elevation, 'roll':roll, 'AOI':AOI}
 
 class SunCalc(object):
 
-    def __init__(self, location = {'Name':'Mountain View','latitude':'37.395946','longitude':'-122.058075','TimeZone':-8, 'DST':True}):
+    def __init__(self, location = {'Name':'Mountain View','latitude':'37.395946','longitude':'-122.058075','TimeZone':-8, 'DST':True}, cache = None, metrics = None):
 
         self.RAD = math.pi/180.
         self.system = ephem.Observer()
         self.system.lat = location['latitude']
-        self.system.long = location['longitude']   
+        self.system.long = location['longitude']
         self.TimeZone = location['TimeZone']
         self.name = location['Name']
-        
+        #observer position in radians, read by array_calc so it never touches self.system
+        self.lat = float(self.system.lat)
+        self.long = float(self.system.long)
+        #site elevation (m) for the clear sky weights of interval_calc
+        self.elevation = float(location.get('Elevation', 0.))
+
         if location['DST']:
             self.DST = time.daylight
         else:
             self.DST = 0
 
+        #optional on disk store for year_calc, either a GeometryCache or the directory to keep one in
+        if isinstance(cache, str):
+            cache = GeometryCache(cache)
+        self.cache = cache
+        #tracker angle years already computed by tracker_year
+        self.tracker_memo = {}
+        #(year, interval) -> year_calc tables handed in ready made, rows of a siteGeometry.SiteGeometry matrix
+        self.presets = {}
+        #optional metrics.Metrics (or hook) timing the geometry stages, off by default
+        self.metrics = stage_metrics.resolve(metrics)
+
     def point_calc(self,dt1 = ephem.Date('2014-1-1 00:00:00')):       
         datelocal = ephem.Date(dt1)
         self.system.date = ephem.Date(datelocal-self.TimeZone*ephem.hour-self.DST*ephem.hour)  #Convert to UTC time
@@ -51,25 +221,240 @@ class SunCalc(object):
             sun_pos['time'][i], sun_pos['azimuth'][i], sun_pos['elevation'][i], sun_pos['roll'][i], sun_pos['AOI'][i] = self.point_calc(dt1 = datelocal)
         
         return sun_pos
-    
-    def DNI_weighted(self, DNI, sun_pos, interval):
-        pass
+
+    def array_calc(self, times, engine = 'numpy'):
+        #vectorized point_calc over a whole array of local times (numpy datetime64 or anything np.asarray can cast)
+        #returns the same dictionary as vector_calc, computed in one pass with no ephem objects and no shared state
+        #sun position follows the NOAA/Meeus low precision solar coordinates plus parallax and the same
+        #refraction ephem applies (1010 mBar, 15 C). The sun direction stays within 0.01 deg of point_calc, so
+        #while the sun is up: elevation and AOI 0.01 deg, azimuth 0.01 deg/cos(elevation) and roll one rounding
+        #step (0.01 deg) plus 0.01 deg/sqrt(1 - (cos(elevation)*cos(azimuth))**2). The roll is the angle of the sun
+        #in the east-up plane, which turns fast for a low sun near due south or north: over a year the roll is
+        #within 0.02 deg up to latitude 45, 0.05 deg at 60 and 0.3 deg near the polar circles in winter.
+        #Within 0.02 deg of the horizon the two can disagree on the sign of the elevation (the roll is then +-90)
+        #and more than 3 deg below it the two refraction models part ways by up to 0.25 deg
+        #engine = 'ephem' runs point_calc on every time instead, for results identical to the per point code
+        times = np.asarray(times, dtype='datetime64[us]')
+        if engine == 'ephem':
+            sun_pos = dict((name, np.zeros(len(times))) for name in GEOMETRY_KEYS)
+            for i, dt in enumerate(times.tolist()):
+                sun_pos['time'][i], sun_pos['azimuth'][i], sun_pos['elevation'][i], sun_pos['roll'][i], sun_pos['AOI'][i] = self.point_calc(dt1 = ephem.Date(dt))
+            return sun_pos
+
+        offset = np.timedelta64(int(round((self.TimeZone + self.DST)*3600e6)), 'us')
+        utc = (times - offset).astype(np.int64)/86400e6 + UNIX_JD #convert to UTC julian date
+        return sun_positions(utc, self.lat, self.long)
+
+    def interval_calc(self, times, interval = 60, samples = 60, weights = None, chunk_size = 2**18):
+        #sun position over the intervals of interval minutes starting at the local times instead of at their start,
+        #for data averaged over those intervals. Every interval is sampled at the middle of samples equal steps
+        #(array_calc, numpy engine) and the samples are weighted by their clear sky DNI (gapFill.clearSky at the
+        #site elevation), or by weights, an (intervals, samples) array of the irradiance measured at them
+        #elevation is 90 minus the zenith whose cosine is the weighted mean cosine, so (GHI - DHI)/cos(zenith)
+        #is the mean DNI of the interval on that sky, azimuth, roll and AOI are weighted means and sun_up is the
+        #share of the samples with the sun above the horizon. Intervals without weight (night) get plain means
+        #chunk_size bounds the number of samples evaluated at once
+        times = np.asarray(times, dtype = 'datetime64[us]')
+        offsets = ((np.arange(samples) + 0.5)*interval*60e6/samples).astype(np.int64).astype('timedelta64[us]')
+        offset = np.timedelta64(int(round((self.TimeZone + self.DST)*3600e6)), 'us')
+        sun_pos = {'time': (times - offset).astype(np.int64)/86400e6 + UNIX_JD - EPHEM_JD}
+        for name in INTERVAL_KEYS[1:]:
+            sun_pos[name] = np.empty(len(times))
+        step = max(chunk_size//samples, 1)
+        for start in range(0, len(times), step):
+            end = min(start + step, len(times))
+            points = self.array_calc((times[start:end,np.newaxis] + offsets).ravel())
+            azimuth, elevation, roll, AOI = [points[name].reshape(end - start, samples) for name in ['azimuth','elevation','roll','AOI']]
+            if weights is None:
+                weight = gapFill.clearSky(elevation, self.elevation)[1]
+            else:
+                weight = np.nan_to_num(np.clip(np.asarray(weights[start:end], dtype = np.float64), 0., None))
+            total = weight.sum(axis = 1)
+            weight = np.where((total > 0)[:,np.newaxis], weight/np.where(total > 0, total, 1.)[:,np.newaxis], 1./samples)
+            mean = lambda values: (weight*values).sum(axis = 1)
+            sun_pos['elevation'][start:end] = np.degrees(np.arcsin(np.clip(mean(np.sin(np.radians(elevation))), -1., 1.)))
+            sun_pos['azimuth'][start:end] = np.mod(np.degrees(np.arctan2(mean(np.sin(np.radians(azimuth))), mean(np.cos(np.radians(azimuth))))), 360.)
+            sun_pos['roll'][start:end] = mean(roll)
+            sun_pos['AOI'][start:end] = mean(AOI)
+            sun_pos['sun_up'][start:end] = (elevation > 0).mean(axis = 1)
+        return sun_pos
+
+    def year_calc(self, year, interval = 60, engine = 'numpy', samples = None):
+        #sun position over a whole calendar year of local time, every interval minutes starting at Jan 1 00:00
+        #served from the geometry cache when one is set, so repeat runs for a site skip the computation
+        #samples gives interval averages of samples points each (interval_calc) instead of the positions at the starts
+        #years preset by siteGeometry.SiteGeometry.attach are returned as they are to numpy engine calls
+        if not samples and engine == 'numpy' and (year, interval) in self.presets:
+            self.metrics.count('sun geometry', preset_hits = 1)
+            return self.presets[(year, interval)]
+        times = year_times(year, year, interval)
+        if samples:
+            engine = 'numpy'
+            calc = lambda: self.interval_calc(times, interval, samples)
+        else:
+            calc = lambda: self.array_calc(times, engine = engine)
+        with self.metrics.stage('sun geometry', rows = len(times)*(samples or 1)) as stage:
+            if self.cache is None:
+                return calc()
+            key = self.cache.key(self, engine, year, interval, samples)
+            sun_pos = self.cache.load(key)
+            if sun_pos is None:
+                stage.count(cache_misses = 1)
+                sun_pos = self.cache.store(key, calc())
+            else:
+                stage.count(cache_hits = 1)
+            return sun_pos
+
+    def tracker_calc(self, sun_pos, GCR = 0.4, axis_tilt = 0., axis_azimuth = 0., max_angle = 70., backtrack = True, stow = 0.):
+        #rotation (degrees) of a single axis tracker for every point of a sun_pos dictionary
+        #true tracking generalizes the roll of point_calc to a tilted axis pointing at axis_azimuth (the default
+        #N-S horizontal axis gives exactly that roll, same sign), backtracking then turns the rows back just enough
+        #that they stop shading each other at ground coverage ratio GCR, the result is clipped to +-max_angle
+        #and the tracker sits at the stow angle while the sun is down
+        azimuth = np.asarray(sun_pos['azimuth'])*self.RAD
+        elevation = np.asarray(sun_pos['elevation'])*self.RAD
+        tilt = axis_tilt*self.RAD
+        axis = axis_azimuth*self.RAD
+        #sun vector (east, north, up) rotated into the tracker frame
+        x = np.cos(elevation)*np.sin(azimuth)
+        y = np.cos(elevation)*np.cos(azimuth)
+        z = np.sin(elevation)
+        x_tracker = x*np.cos(axis) - y*np.sin(axis)
+        z_tracker = (x*np.sin(axis) + y*np.cos(axis))*np.sin(tilt) + z*np.cos(tilt)
+        rotation = np.arctan2(x_tracker, z_tracker)
+
+        if backtrack:
+            #rows shade each other once cos(rotation) drops below GCR, back off by the excess angle
+            with np.errstate(invalid='ignore'):
+                shade = np.abs(np.cos(rotation))/GCR
+                correction = np.where(shade < 1., -np.sign(rotation)*np.arccos(np.minimum(shade, 1.)), 0.)
+            rotation = rotation + correction
+
+        rotation = np.clip(np.round(rotation/self.RAD,2), -max_angle, max_angle)
+        return np.where(z_tracker > 0., rotation, stow)
+
+    def tracker_year(self, year, interval = 60, **tracker):
+        #tracker_calc over a whole local-time year (same grid as year_calc), computed once per site, year and tracker
+        key = (year, interval, tuple(sorted(tracker.items())))
+        if key in self.tracker_memo:
+            self.metrics.count('tracker geometry', memo_hits = 1)
+        else:
+            sun_pos = self.year_calc(year, interval)
+            with self.metrics.stage('tracker geometry', rows = len(sun_pos['time']), memo_misses = 1):
+                self.tracker_memo[key] = self.tracker_calc(sun_pos, **tracker)
+        return self.tracker_memo[key]
+
+    def tracker_angles(self, times, interval = 60, **tracker):
+        #tracker_calc for any array of local times lying on the interval minute grid of their year,
+        #read out of the memoized years with one index operation per calendar year
+        times = np.asarray(times, dtype='datetime64[m]')
+        years = times.astype('datetime64[Y]')
+        angles = np.empty(len(times))
+        for year in np.unique(years):
+            in_year = years == year
+            steps = (times[in_year] - year.astype('datetime64[m]')).astype(np.int64)//interval
+            angles[in_year] = self.tracker_year(year.astype(int) + 1970, interval, **tracker)[steps]
+        return angles
+
+    def DNI_weighted(self, DNI, sun_pos, interval, roll = None, chunk_size = None):
+        #DNI weighted angle of incidence, cosine loss and roll of a N-S horizontal tracker over a DNI series
+        #DNI (W/m2) and every sun_pos array have one value per point, each point standing for interval minutes
+        #roll optionally gives the angles the tracker actually had, the AOI then comes from those and the
+        #tracking error against the ideal sun_pos roll is added to the statistics (see _DNI_stats)
+        #chunk_size walks the arrays in slices so the temporaries stay small (sun_pos may be memory-mapped)
+        rows = len(DNI)
+        step = chunk_size or max(rows, 1)
+        with self.metrics.stage('DNI weighted', rows = rows):
+            sums = {}
+            for start in range(0, rows, step):
+                end = start + step
+                self._DNI_sums(sums, DNI[start:end], dict((name, sun_pos[name][start:end]) for name in ['azimuth','elevation','roll']), \
+                               interval, None if roll is None else roll[start:end])
+            return self._DNI_stats(sums)
+
+    def DNI_stream(self, chunks, interval, engine = 'numpy'):
+        #streaming DNI_weighted for series too long to hold at once (years of 1 minute data)
+        #chunks yields (times, DNI) or (times, DNI, roll) arrays of local times, the sun position of every
+        #chunk is computed with array_calc and dropped again, so memory is bounded by the chunk size
+        sums = {}
+        for chunk in chunks:
+            times, DNI = chunk[0], chunk[1]
+            with self.metrics.stage('DNI weighted', rows = len(DNI)):
+                self._DNI_sums(sums, DNI, self.array_calc(times, engine = engine), interval, chunk[2] if len(chunk) > 2 else None)
+        return self._DNI_stats(sums)
+
+    def _DNI_sums(self, sums, DNI, sun_pos, interval, roll = None):
+        #adds the DNI weighted sums of one chunk to sums, only sun up points with DNI > 0 count
+        DNI = np.asarray(DNI, dtype = np.float64)
+        elevation = np.asarray(sun_pos['elevation'])
+        with np.errstate(invalid='ignore'):
+            up = (elevation > 0) & (DNI > 0)
+        weight = DNI[up]*interval/60. #Wh/m2
+        azimuth = np.asarray(sun_pos['azimuth'])[up]*self.RAD
+        elevation = elevation[up]*self.RAD
+        ideal = np.asarray(sun_pos['roll'])[up]
+        cos_ideal = self._cos_AOI(ideal, azimuth, elevation)
+
+        totals = {'points': len(DNI), 'sun_points': len(weight), 'energy': weight.sum(),
+                  'cos': (weight*np.clip(cos_ideal, 0., 1.)).sum(),
+                  'AOI': (weight*np.degrees(np.arccos(np.clip(cos_ideal, -1., 1.)))).sum(),
+                  'roll': (weight*ideal).sum(), 'roll2': (weight*ideal*ideal).sum(), 'roll_abs': (weight*np.abs(ideal)).sum()}
+        if roll is not None:
+            actual = np.asarray(roll, dtype = np.float64)[up]
+            cos_actual = self._cos_AOI(actual, azimuth, elevation)
+            error = actual - ideal
+            totals.update({'actual_cos': (weight*np.clip(cos_actual, 0., 1.)).sum(),
+                           'actual_AOI': (weight*np.degrees(np.arccos(np.clip(cos_actual, -1., 1.)))).sum(),
+                           'error': (weight*error).sum(), 'error2': (weight*error*error).sum(), 'error_abs': (weight*np.abs(error)).sum()})
+        for name, value in totals.items():
+            sums[name] = sums.get(name, 0) + value
+        return sums
+
+    def _DNI_stats(self, sums):
+        #statistics from DNI weighted sums: energy is the beam energy (Wh/m2) seen while the sun is up,
+        #AOI and roll_* are energy weighted means (degrees), roll_std the weighted spread of the roll,
+        #cosine_loss the fraction of that energy lost to the angle of incidence of an ideal tracker
+        #with the actual roll: actual_AOI, actual_cosine_loss, tracking_loss (beam an ideal tracker would have
+        #caught but the actual one lost), error_mean / error_rms / error_abs of actual minus ideal roll
+        energy = sums.get('energy', 0.)
+        stats = {'points': sums.get('points', 0), 'sun_points': sums.get('sun_points', 0), 'energy': energy}
+        if energy <= 0:
+            return stats
+        stats.update({'AOI': sums['AOI']/energy, 'cosine_loss': 1. - sums['cos']/energy,
+                      'roll_mean': sums['roll']/energy, 'roll_abs': sums['roll_abs']/energy,
+                      'roll_std': np.sqrt(max(sums['roll2']/energy - (sums['roll']/energy)**2, 0.))})
+        if 'actual_cos' in sums:
+            stats.update({'actual_AOI': sums['actual_AOI']/energy, 'actual_cosine_loss': 1. - sums['actual_cos']/energy,
+                          'tracking_loss': 1. - sums['actual_cos']/sums['cos'] if sums['cos'] > 0 else 0.,
+                          'error_mean': sums['error']/energy, 'error_rms': np.sqrt(sums['error2']/energy),
+                          'error_abs': sums['error_abs']/energy})
+        return stats
+
+    def _cos_AOI(self, roll, azimuth, elevation):
+        #cosine of the angle of incidence on a N-S horizontal tracker at roll (degrees), sun angles in radians
+        #dot product of the module normal [sin(roll),cos(roll),0] and the sun vector, as in point_calc
+        return np.sin(roll*self.RAD)*np.cos(elevation)*np.sin(azimuth) + np.cos(roll*self.RAD)*np.sin(elevation)
                 
 if __name__=='__main__':
     
     location = {'Name':'Phoenix','latitude':'33.96 deg','longitude':'-112.02','TimeZone':-7,'DST':False}
     fileread = '\\\\SWEFS01\\SWEdata\\System Modeling\\Phoenix 15min DNI.csv'
-    DNI_read = open(fileread,'rb')
-    lines = DNI_read.readlines()
-    DNI = {'times':[],'values':np.zeros(len(lines))}
-    for i in range(len(lines)):       
-        x = lines[i].split(',')
-        DNI['values'][i] = float(x[1])
-        x = datetime.datetime.strptime(x[0], '%Y-%m-%d %H:%M:%S')
-        DNI['times'].append(x)
-    DNI = pd.DataFrame(DNI['values'],index=DNI['times'],columns=list('A'))
-    DNI = DNI.resample('1min')
-    DNI = DNI.interpolate()
+    #timestamp,DNI lines without a header, parsed in bulk
+    times, values = fileReaders.readCSV(fileread, [0, 1], [fileReaders.TIME_DTYPE, np.float64], header = False)
+    minute = np.timedelta64(1, 'm')
+    end = times[-1] + minute
+
+    def chunks(size = 2**16):
+        #the series interpolated to every minute, size minutes at a time
+        for start in np.arange(times[0], end, size*minute):
+            minutes = np.arange(start, min(start + size*minute, end), minute)
+            yield minutes, np.interp(minutes.astype(np.float64), times.astype(np.float64), values)
+
+    #DNI weighted AOI, cosine loss and roll of the ideal tracker over the whole series, streamed so neither
+    #the minute series nor its sun position is ever held whole
+    SC = SunCalc(location = location)
+    for name, value in sorted(SC.DNI_stream(chunks(), 1).items()):
+        print name, value
     
     #===========================================================================
     # SC = SunCalc(dt1 = ephem.Date('2014-5-1 13:05:18'))
@@ -0,0 +1,108 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Server side aggregation (pullMinuteData(aggregate = True)) against the raw
+minute pull on a seeded local sqlite copy of the solar database
+
+usage: python -m unittest discover tests"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+from weatherToCSV import WeatherToCSV
+from AngleToCSV import AngleToCSV
+
+DATE_START = '01/01/15 01:00'
+DATE_END = '01/06/15 12:00'
+NAMES = ['GHI','Diff','Tamb','RH','Wspd','Wdir']
+
+
+class AggregatedPullTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #a week of 5 minute data with a gap of an hour and a half and missing GHI values, so the counts differ
+        cls.directory = tempfile.mkdtemp()
+        cls.db_file = os.path.join(cls.directory, 'solardb.sqlite')
+        benchmark.seedDatabase(cls.db_file, days = 7, sites = 1, rows = 1)
+        connection = sqlite3.connect(cls.db_file)
+        connection.execute("delete from Weather where TimeStamp >= '2015-01-02 17:10:00' and TimeStamp < '2015-01-02 18:40:00'")
+        connection.execute("update Weather set GlobalSolar_Avg = NULL where TimeStamp like '2015-01-03 2%:_5:00'")
+        connection.commit()
+        connection.close()
+        cls.cwd = os.getcwd()
+        os.chdir(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.directory)
+
+    def weather(self, aggregate, interval = 60):
+        converter = WeatherToCSV(benchmark.SITE, self.directory, interval = interval)
+        converter.localConnect(self.db_file)
+        converter.pullMinuteData(DATE_START, DATE_END, benchmark.WEATHER_DATABASE, benchmark.siteName(0), aggregate = aggregate)
+        return converter
+
+    def testAverages(self):
+        for interval in [60, 15]:
+            raw = self.weather(False, interval)
+            aggregated = self.weather(True, interval)
+            raw_means = raw.hourlyAverages()
+            aggregated_means = aggregated.hourlyAverages()
+            self.assertTrue(raw_means.index.equals(aggregated_means.index))
+            np.testing.assert_allclose(aggregated_means.values, raw_means.values, rtol = 1e-12)
+            #the counts behind the server averages are the samples the raw pull has in every interval
+            for i, name in enumerate(NAMES):
+                np.testing.assert_array_equal(aggregated.intervalStats['count'][:,i], raw.intervalStats['count'][:,i])
+
+    def testSampleCount(self):
+        raw = self.weather(False)
+        aggregated = self.weather(True)
+        #the raw pull keeps lists without a chunk_size, missing values come back as None
+        hours = np.asarray(raw.timestamp, dtype = 'datetime64[h]')
+        for name in NAMES:
+            values = np.asarray(getattr(raw, name), dtype = np.float64)
+            expected = dict(zip(*np.unique(hours[~np.isnan(values)], return_counts = True)))
+            counted = dict(zip(aggregated.timestamp.astype('datetime64[h]'), aggregated.sampleCount[name]))
+            self.assertEqual(dict((hour, count) for hour, count in counted.items() if count), expected)
+        #the gap (10:10 to 11:40 local) leaves 2 and 4 samples in its hours, the missing values only lower the GHI counts
+        counted = dict(zip(aggregated.timestamp.astype('datetime64[h]'), aggregated.sampleCount['Diff']))
+        self.assertEqual([counted[np.datetime64('2015-01-02T%s' % hour, 'h')] for hour in ['09', '10', '11']], [12, 2, 4])
+        self.assertTrue((aggregated.sampleCount['GHI'] <= aggregated.sampleCount['Diff']).all())
+        self.assertTrue((aggregated.sampleCount['GHI'] < aggregated.sampleCount['Diff']).any())
+
+    def testYearFile(self):
+        files = []
+        for aggregate in [False, True]:
+            os.mkdir(os.path.join(self.directory, str(aggregate)))
+            os.chdir(os.path.join(self.directory, str(aggregate)))
+            files.append([os.path.abspath(name) for name in self.weather(aggregate).constructYear()])
+        os.chdir(self.directory)
+        for raw_file, aggregated_file in zip(*files):
+            with open(raw_file) as raw, open(aggregated_file) as aggregated:
+                self.assertEqual(raw.read(), aggregated.read())
+
+    def testAngles(self):
+        means = []
+        for aggregate in [False, True]:
+            angler = AngleToCSV(benchmark.SITE, self.directory)
+            angler.localConnect(self.db_file)
+            angler.pullMinuteData(DATE_START, DATE_END, benchmark.ANGLE_DATABASE, benchmark.siteName(0), benchmark.rowName(0), \
+                                  aggregate = aggregate)
+            means.append(angler.hourlyAngles())
+        self.assertTrue(means[0].index.equals(means[1].index))
+        np.testing.assert_allclose(means[1].values, means[0].values, rtol = 1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
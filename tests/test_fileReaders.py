@@ -0,0 +1,132 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" fileReaders.readCSV against csv.reader with float() and strptime on
+files with quoted commas, empty and NULL fields, exponents and signs, '\\r\\n'
+line ends and blocks ending in the middle of a line
+
+usage: python -m unittest discover tests"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import csv
+import gzip
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fileReaders
+from minuteFetch import TIME_DTYPE
+
+NAMES = ['TimeStamp', 'Name', 'GHI', 'Tamb']
+DTYPES = [TIME_DTYPE, 'S', np.float64, np.float64]
+TIME_FORMATS = ['%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f']
+#block sizes ending blocks inside the first lines, inside later ones and holding the whole file
+BLOCK_BYTES = [1, 7, 50, 333, 2**20]
+
+
+def expected(file_name):
+    #the columns of a test file read with csv.reader, float() and strptime
+    with open(file_name, 'rb') as f:
+        rows = [row for row in csv.reader(f) if row][1:]
+    times, names, numbers = [], [], [[], []]
+    for row in rows:
+        for time_format in TIME_FORMATS:
+            try:
+                times.append(datetime.strptime(row[0].replace('T', ' '), time_format))
+                break
+            except ValueError:
+                pass
+        names.append(row[1])
+        for values, text in zip(numbers, row[2:]):
+            values.append(float('nan') if text in [''] + fileReaders.MISSING else float(text))
+    return [np.array(times, dtype = TIME_DTYPE), names] + [np.array(values) for values in numbers]
+
+def numberText(rng, i):
+    #a number written one of the ways the files have them
+    value = rng.normal()*10**rng.randint(-3, 5)
+    forms = ['%s' % value, '%.3f' % value, '%+.2f' % value, '%e' % value, '%.4E' % value, repr(value),
+             '%d' % round(value), '+%d' % abs(round(value)), '-0', '.5', '5.', '0012.50', '1e3', '-1.5e-3',
+             '3.14159265358979323', '', 'NULL', 'None', 'NaN', '"%.2f"' % value]
+    return forms[i % len(forms)]
+
+
+class ReadCSVTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def writeFile(self, name, lines, newline = '\n'):
+        #a file of the header and lines, and a gzip copy of it
+        file_name = os.path.join(self.directory, name)
+        text = newline.join([','.join(NAMES)] + lines) + newline
+        with open(file_name, 'wb') as f:
+            f.write(text)
+        with gzip.open(file_name + '.gz', 'wb') as f:
+            f.write(text)
+        return file_name
+
+    def assertReads(self, file_name):
+        #readCSV of the file and its gzip copy at every block size gives what csv.reader does
+        times, names, GHI, Tamb = expected(file_name)
+        for name in [file_name, file_name + '.gz']:
+            for block_bytes in BLOCK_BYTES:
+                columns = fileReaders.readCSV(name, NAMES, DTYPES, block_bytes = block_bytes)
+                np.testing.assert_array_equal(columns[0], times)
+                self.assertEqual(list(columns[1]), names)
+                np.testing.assert_array_equal(columns[2], GHI)
+                np.testing.assert_array_equal(columns[3], Tamb)
+                #the signs of zeros too
+                np.testing.assert_array_equal(np.signbit(columns[2]), np.signbit(GHI))
+
+    def lines(self, count, names, seed = 0):
+        rng = np.random.RandomState(seed)
+        times = np.datetime64('2015-01-01T00:00') + np.arange(count)*np.timedelta64(5, 'm')
+        stamps = [str(time).replace('T', ' ') for time in times]
+        #every format of timestamp the reader takes
+        stamps = [[stamp, stamp + ':00', stamp + ':00.250000', stamp.replace(' ', 'T') + ':30'][i % 4] for i, stamp in enumerate(stamps)]
+        return ['%s,%s,%s,%s' % (stamp, names[i % len(names)], numberText(rng, i), numberText(rng, 3*i + 1))
+                for i, stamp in enumerate(stamps)]
+
+    def testNumbers(self):
+        self.assertReads(self.writeFile('numbers.csv', self.lines(200, ['Row 1', 'Row 2'])))
+
+    def testCarriageReturns(self):
+        self.assertReads(self.writeFile('crlf.csv', self.lines(200, ['Row 1', '', 'Row 3']), '\r\n'))
+
+    def testQuotedCommas(self):
+        #quoted names with commas and doubled quotes, only in some of the blocks
+        names = ['Row 1'] * 20 + ['"Row, 2"', '"Row ""3"""', '"Row 4"']
+        self.assertReads(self.writeFile('quoted.csv', self.lines(200, names)))
+        self.assertReads(self.writeFile('quoted_crlf.csv', self.lines(200, names), '\r\n'))
+
+    def testBlankLines(self):
+        lines = self.lines(60, ['Row 1'])
+        lines[10:10] = ['']
+        self.assertReads(self.writeFile('blank.csv', lines))
+
+    def testWrongFieldCount(self):
+        lines = self.lines(20, ['Row 1'])
+        lines[5] += ',1'
+        file_name = self.writeFile('wrong.csv', lines)
+        for block_bytes in BLOCK_BYTES:
+            self.assertRaises(ValueError, fileReaders.readCSV, file_name, NAMES, DTYPES, block_bytes = block_bytes)
+
+    def testNotANumber(self):
+        lines = self.lines(20, ['Row 1'])
+        lines[7] = lines[7].rsplit(',', 1)[0] + ',12x'
+        self.assertRaises(ValueError, fileReaders.readCSV, self.writeFile('text.csv', lines), NAMES, DTYPES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" intervalStats.aggregate against DataFrame.resample on 5 minute data with
+gaps and missing values, at 60 and 15 minute intervals
+
+usage: python -m unittest discover tests"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import intervalStats
+
+INTERVALS = [60, 15]
+
+
+class AggregateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #three days of 5 minute data from 00:05 with a gap from 02:10 to 04:40 on the second day (whole hours
+        #without samples), 10% missing values and an hour of the first column missing altogether
+        rng = np.random.RandomState(0)
+        times = np.datetime64('2015-03-01T00:05', 'us') + np.arange(3*288)*np.timedelta64(5, 'm')
+        gap = (times >= np.datetime64('2015-03-02T02:10')) & (times < np.datetime64('2015-03-02T04:40'))
+        cls.times = times[~gap]
+        cls.columns = [rng.normal(size = len(cls.times))*100 for i in range(3)]
+        for column in cls.columns:
+            column[rng.rand(len(column)) < 0.1] = np.nan
+        hour = cls.times.astype('datetime64[h]') == np.datetime64('2015-03-01T07', 'h')
+        cls.columns[0][hour] = np.nan
+        cls.frame = pd.DataFrame(np.array(cls.columns).T, index = pd.DatetimeIndex(cls.times.astype('datetime64[ns]')))
+
+    def resampled(self, interval):
+        return self.frame.resample('%sT' % interval)
+
+    def assertResampled(self, stats, interval, extremes = True):
+        resampler = self.resampled(interval)
+        means = resampler.mean()
+        np.testing.assert_array_equal(stats['time'], means.index.values.astype('datetime64[m]'))
+        #the sums add up in the same order, so the means are the same floats
+        np.testing.assert_array_equal(stats['mean'], means.values)
+        np.testing.assert_array_equal(stats['count'], resampler.count().values)
+        if extremes:
+            np.testing.assert_array_equal(stats['min'], resampler.min().values)
+            np.testing.assert_array_equal(stats['max'], resampler.max().values)
+        else:
+            self.assertFalse('min' in stats or 'max' in stats)
+
+    def testResample(self):
+        for interval in INTERVALS:
+            self.assertResampled(intervalStats.aggregate(self.times, self.columns, interval), interval)
+            self.assertResampled(intervalStats.aggregate(self.times, self.columns, interval, extremes = False), interval, False)
+
+    def testGaps(self):
+        #intervals without samples, or with missing values only, have count 0 and nan statistics
+        for interval in INTERVALS:
+            stats = intervalStats.aggregate(self.times, self.columns, interval)
+            empty = stats['count'] == 0
+            self.assertTrue(empty[:,0].sum() > empty[:,1].sum() > 0)
+            for name in ['mean', 'min', 'max']:
+                self.assertTrue(np.isnan(stats[name][empty]).all())
+
+    def testUnordered(self):
+        order = np.random.RandomState(1).permutation(len(self.times))
+        for interval in INTERVALS:
+            stats = intervalStats.aggregate(self.times[order], [column[order] for column in self.columns], interval)
+            ordered = intervalStats.aggregate(self.times, self.columns, interval)
+            for name in ['time', 'count', 'min', 'max']:
+                np.testing.assert_array_equal(stats[name], ordered[name])
+            np.testing.assert_allclose(stats['mean'], ordered['mean'], rtol = 1e-12)
+
+    def testCoverage(self):
+        for interval in INTERVALS:
+            resampler = self.resampled(interval)
+            minimum = intervalStats.minimumSamples(self.times, interval, 0.75)
+            self.assertEqual(minimum, int(np.ceil(0.75*interval/5)))
+            expected = resampler.mean().where(resampler.count() >= minimum).values
+            for extremes in [True, False]:
+                stats = intervalStats.aggregate(self.times, self.columns, interval, 0.75, extremes = extremes)
+                np.testing.assert_array_equal(stats['mean'], expected)
+                np.testing.assert_array_equal(stats['count'], resampler.count().values)
+
+    def testSampleMinutes(self):
+        self.assertEqual(intervalStats.sampleMinutes(self.times), 5)
+        self.assertEqual(intervalStats.sampleMinutes(self.times[::-1]), 5)
+        self.assertEqual(intervalStats.sampleMinutes(self.times[:1]), None)
+        #a step of 5 minutes against one of days, ties go to the shorter step
+        self.assertEqual(intervalStats.sampleMinutes(self.times[[0, 1, -1]]), 5)
+
+    def testEmpty(self):
+        for extremes in [True, False]:
+            stats = intervalStats.aggregate(self.times[:0], [column[:0] for column in self.columns], extremes = extremes)
+            self.assertEqual(stats['mean'].shape, (0, 3))
+            self.assertEqual(stats['count'].shape, (0, 3))
+            self.assertEqual('min' in stats, extremes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" SunCalc.array_calc (numpy engine) against point_calc over a whole year at
+several latitudes, within the tolerances in the array_calc docstring
+
+usage: python -m unittest discover tests"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+from sunCalc import SunCalc, year_times, RAD
+
+#(latitude, longitude, TimeZone, DST hours): the tropics, mid and high latitudes on both sides and the polar circle,
+#where the noon sun of the winter stays just over the horizon
+SITES = [('0.5', '-78.5', -5, 0), ('32.1025', '-110.8142', -7, 0), ('45', '7.7', 1, 0), ('60', '10.7', 1, 1), \
+         ('-35', '149.1', 10, 0), ('66.5', '25.7', 2, 1)]
+#how far the sun direction of the two is apart at most (deg), and the rounding step of the roll
+DIRECTION = 0.01
+ROLL_STEP = 0.01
+
+
+class ArrayCalcTest(unittest.TestCase):
+
+    def assertClose(self, name, difference, tolerance, latitude):
+        worst = np.argmax(difference - tolerance)
+        self.assertTrue(difference[worst] <= tolerance[worst] + 1e-9, \
+                        "%s off by %.4f deg (tolerance %.4f) at latitude %s" % (name, difference[worst], tolerance[worst], latitude))
+
+    def testYear(self):
+        times = year_times(2015, 2015)
+        for latitude, longitude, time_zone, dst in SITES:
+            sun = SunCalc(dict(benchmark.SITE, latitude = latitude, longitude = longitude, TimeZone = time_zone))
+            #SunCalc takes the DST hour of a DST site from the clock of the machine, set here so it is the same anywhere
+            sun.DST = dst
+            point = sun.array_calc(times, engine = 'ephem')
+            array = sun.array_calc(times)
+            np.testing.assert_allclose(array['time'], point['time'], rtol = 0, atol = 1e-9)
+            #the sun is up in both or in neither, but within 0.02 deg of the horizon
+            self.assertTrue(np.all(((array['elevation'] > 0) == (point['elevation'] > 0)) | (np.abs(point['elevation']) < 0.02)))
+            #where both have the sun up, off the horizon where they may not agree on the sign of the elevation
+            up = np.minimum(array['elevation'], point['elevation']) > 0.02
+            elevation, azimuth = point['elevation'][up]*RAD, point['azimuth'][up]*RAD
+            ones = np.ones(up.sum())
+            self.assertClose('elevation', np.abs(array['elevation'] - point['elevation'])[up], DIRECTION*ones, latitude)
+            self.assertClose('AOI', np.abs(array['AOI'] - point['AOI'])[up], DIRECTION*ones, latitude)
+            turn = np.abs(array['azimuth'] - point['azimuth'])[up]
+            self.assertClose('azimuth', np.minimum(turn, 360 - turn), DIRECTION/np.cos(elevation), latitude)
+            self.assertClose('roll', np.abs(array['roll'] - point['roll'])[up], \
+                             ROLL_STEP + DIRECTION/np.sqrt(1 - (np.cos(elevation)*np.cos(azimuth))**2), latitude)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Update mode (constructYear(update = True), constructRowsYear(update =
+True)) against a whole build: yearly files built from a pull, patched with a
+later pull of changed data, must come out the same as files built fresh from
+the changed data
+
+usage: python -m unittest discover tests"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+import os
+import sys
+import gzip
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+import fileWriters
+from weatherToCSV import WeatherToCSV
+from AngleToCSV import AngleToCSV
+
+DATE_START = '01/01/15 01:00'
+#the first build ends inside the 12:00 interval of Jan 4, the update pull carries on to Jan 6
+OLD_END = '01/04/15 12:00'
+NEW_END = '01/06/15 12:00'
+#the update pull starts inside the 10:00 interval (10:30 at 15 minutes), which it only has part of and so
+#leaves as it was, the data changes from 12:00 (local) of Jan 3 on
+UPDATE_START = '01/03/15 10:40'
+CHANGED_UTC = '2015-01-03 19:00:00'
+ROWS = [benchmark.rowName(0), benchmark.rowName(1)]
+#(interval, file_format, precision)
+CASES = [(60, 'csv', None), (15, 'csv', None), (60, 'gzip', 3), (60, 'npz', None)]
+
+
+def contents(file_name, file_format):
+    #what a file holds, the text of csv and gzip files, the header and columns of npz files
+    if file_format == 'npz':
+        header, stored = fileWriters.readColumns(file_name)
+        return header, sorted((name, column.tolist()) for name, column in stored.items())
+    opener = gzip.open if file_format == 'gzip' else open
+    with opener(file_name, 'rb') as f:
+        return f.read()
+
+
+class UpdateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #the database as the first build saw it, and a copy where the data from CHANGED_UTC on was corrected
+        cls.directory = tempfile.mkdtemp()
+        cls.db_file = os.path.join(cls.directory, 'solardb.sqlite')
+        cls.changed_file = os.path.join(cls.directory, 'changed.sqlite')
+        benchmark.seedDatabase(cls.db_file, days = 7, sites = 1, rows = len(ROWS))
+        shutil.copy(cls.db_file, cls.changed_file)
+        connection = sqlite3.connect(cls.changed_file)
+        connection.execute("update Weather set GlobalSolar_Avg = 0.9*GlobalSolar_Avg + 1, AirTemp_C_Avg = AirTemp_C_Avg + 2.5 "
+                           "where TimeStamp >= ?", (CHANGED_UTC,))
+        connection.execute("update Weather set RH_Avg = NULL where TimeStamp >= ? and TimeStamp like '%:_5:00'", (CHANGED_UTC,))
+        connection.execute("update SunBase4t set Angle = Angle + 0.5 where TimeStamp >= ?", (CHANGED_UTC,))
+        connection.commit()
+        connection.close()
+        cls.cwd = os.getcwd()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.directory)
+
+    def build(self, name, directory, db_file, date_start, date_end, update, case):
+        #files of the converter name ('weather', 'angles' or 'rows') pulled from db_file and built in directory,
+        #and the converter
+        interval, file_format, precision = case
+        os.chdir(directory)
+        if name == 'weather':
+            converter = WeatherToCSV(benchmark.SITE, self.directory, engine = 'numpy', interval = interval, \
+                                     file_format = file_format, precision = precision)
+            converter.localConnect(db_file)
+            converter.pullMinuteData(date_start, date_end, benchmark.WEATHER_DATABASE, benchmark.siteName(0))
+            files = converter.constructYear(update = update)
+        else:
+            converter = AngleToCSV(benchmark.SITE, self.directory, interval = interval, file_format = file_format, \
+                                   precision = precision)
+            converter.localConnect(db_file)
+            if name == 'angles':
+                converter.pullMinuteData(date_start, date_end, benchmark.ANGLE_DATABASE, benchmark.siteName(0), ROWS[0])
+                files = converter.constructYear(update = update)
+            else:
+                converter.pullRows(date_start, date_end, benchmark.ANGLE_DATABASE, benchmark.siteName(0), ROWS)
+                files = converter.constructRowsYear(update = update)
+        converter.serverDisconnect()
+        return [os.path.abspath(file_name) for file_name in files], converter
+
+    def assertUpdated(self, name):
+        for case in CASES:
+            update, fresh = [os.path.join(self.directory, '%s %s %s %s' % ((name,) + case), step) for step in ['update', 'fresh']]
+            os.makedirs(update)
+            os.makedirs(fresh)
+            built, converter = self.build(name, update, self.db_file, DATE_START, OLD_END, False, case)
+            before = [contents(file_name, case[1]) for file_name in built]
+            updated, converter = self.build(name, update, self.changed_file, UPDATE_START, NEW_END, True, case)
+            #the files were patched, not built again
+            self.assertEqual(updated, built)
+            self.assertEqual(sorted(converter.updatedRows), sorted(os.path.basename(file_name) for file_name in updated))
+            self.assertTrue(sum(converter.updatedRows.values()) > 0)
+            self.assertNotEqual([contents(file_name, case[1]) for file_name in updated], before)
+            rebuilt, converter = self.build(name, fresh, self.changed_file, DATE_START, NEW_END, False, case)
+            self.assertEqual([os.path.basename(file_name) for file_name in updated], [os.path.basename(file_name) for file_name in rebuilt])
+            for updated_file, fresh_file in zip(updated, rebuilt):
+                self.assertEqual(contents(updated_file, case[1]), contents(fresh_file, case[1]), '%s %s' % (updated_file, case))
+
+    def testWeather(self):
+        self.assertUpdated('weather')
+
+    def testAngles(self):
+        self.assertUpdated('angles')
+
+    def testRows(self):
+        self.assertUpdated('rows')
+
+
+if __name__ == '__main__':
+    unittest.main()
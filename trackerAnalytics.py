@@ -0,0 +1,196 @@
+from __future__ import division
+
+#!/usr/bin/env python
+""" Compares measured tracker angles of many rows against the true tracking
+and backtracking angles of SunCalc.tracker_calc: tracking error per row and
+hour, stuck trackers and availability, written as bulk summary tables"""
+__author__ = "Andrew Seitz"
+__status__ = "v1.0"
+
+from datetime import datetime
+import numpy as np
+from sunCalc import SunCalc as SC, year_times
+from AngleToCSV import TRACKER_KEYS
+from gapFill import runLengths
+import fileWriters
+import metrics as stage_metrics
+
+#columns of the hourly table (one line per row and daylight hour of the period) and of the row table
+HOURLY_NAMES = ['TimeStamp', 'Row', 'Samples', 'Expected', 'Good', 'MeanError', 'MeanAbsError', 'RMSError', 'MaxAbsError', \
+                'MeasuredRange', 'TheoreticalRange', 'Stuck', 'NotBacktracking']
+ROW_NAMES = ['Row', 'Samples', 'Expected', 'Good', 'Availability', 'MeanError', 'MeanAbsError', 'RMSError', 'MaxAbsError', \
+             'StuckHours', 'LongestStuck', 'NotBacktracking']
+
+
+class TrackerAnalytics(object):
+    #accumulates measured angles of rows (the Names of AngleToCSV.pullRows) chunk by chunk into per row and hour
+    #tables over the local dates date_start to date_end ('%m/%d/%y %I:%M' like the converters), e.g.
+    #   analytics = TrackerAnalytics(sunCalc_dict, rows, '01/01/15 07:00', '12/31/15 06:00')
+    #   analytics.addChunks(angler.pullRowChunks(date_start, date_end, database, DB_location, rows))
+    #   analytics.write('SolarZone tracking')
+    #only daylight samples count. Errors are measured minus the backtracking model of the sunCalc_dict tracker
+    #(see AngleToCSV.TRACKER_KEYS), a sample is good within tolerance degrees of it. A daylight hour is stuck when
+    #the row moved less than stuck_range degrees while the model moved more than moving_range, a row is flagged
+    #once min_stuck_hours stuck hours follow each other. Samples are matched to the model on an interval minute grid
+    #memory is about 100 bytes per row and hour of the period
+
+    def __init__(self, sunCalc_dict, rows, date_start, date_end, interval = 5, tolerance = 5., stuck_range = 0.5, \
+                 moving_range = 2., min_stuck_hours = 3, cache = None, metrics = None):
+        self.sunCalc_dict = sunCalc_dict
+        self.rows = list(rows)
+        self.interval = interval
+        self.tolerance = tolerance
+        self.stuck_range = stuck_range
+        self.moving_range = moving_range
+        self.min_stuck_hours = min_stuck_hours
+        self.metrics = stage_metrics.resolve(metrics)
+        self.sunCalc_location = SC(location = sunCalc_dict, cache = cache, metrics = self.metrics)
+        start = datetime.strptime(date_start, '%m/%d/%y %I:%M')
+        end = datetime.strptime(date_end, '%m/%d/%y %I:%M')
+        if end < start:
+            raise ValueError("please enter a date range that does not end before it starts: %s - %s" % (date_start, date_end))
+
+        #model angles on the grid of the whole hours the period touches, the tables get one column per hour
+        self.grid = np.arange(np.datetime64(start, 'h'), np.datetime64(end, 'h') + 1, np.timedelta64(interval, 'm'), \
+                              dtype = 'datetime64[m]')
+        self.grid_start = self.grid[0]
+        self.hours = len(self.grid)*interval//60
+        tracker = dict((argument, self.sunCalc_dict[key]) for key, argument in TRACKER_KEYS if key in self.sunCalc_dict)
+        tracker['backtrack'] = True
+        self.backtrack = self.sunCalc_location.tracker_angles(self.grid, interval, **tracker)
+        tracker['backtrack'] = False
+        self.true_tracking = self.sunCalc_location.tracker_angles(self.grid, interval, **tracker)
+        #the elevation of the memoized years, cut down to the grid
+        offset = (self.grid_start - year_times(start.year, start.year, interval)[0]).astype(np.int64)//interval
+        elevation = np.concatenate([self.sunCalc_location.year_calc(year, interval, engine = 'numpy')['elevation'] \
+                                    for year in range(start.year, end.year + 1)])[offset:offset + len(self.grid)]
+        in_period = (self.grid >= np.datetime64(start, 'm')) & (self.grid <= np.datetime64(end, 'm'))
+        self.daylight = (elevation > 0) & in_period
+        steps = 60//interval
+        self.expected = self.daylight.reshape(-1, steps).sum(axis = 1)
+        self.theoreticalRange = np.ptp(self.backtrack.reshape(-1, steps), axis = 1)
+
+        shape = (len(self.rows), self.hours)
+        self.samples = np.zeros(shape, dtype = np.int64)
+        self.good = np.zeros(shape, dtype = np.int64)
+        self.notBacktracking = np.zeros(shape, dtype = np.int64)
+        self.errorSum = np.zeros(shape)
+        self.absSum = np.zeros(shape)
+        self.squareSum = np.zeros(shape)
+        self.maxAbs = np.zeros(shape)
+        self.low = np.full(shape, np.inf)
+        self.high = np.full(shape, -np.inf)
+        self.modelLow = np.full(shape, np.inf)
+        self.modelHigh = np.full(shape, -np.inf)
+
+    def add(self, times, angles, row_index):
+        #adds a chunk of samples: local times, measured angles and the position of their row in self.rows
+        with self.metrics.stage('tracker analytics', rows = len(times)):
+            steps = np.round((np.asarray(times, dtype = 'datetime64[s]') - self.grid_start).astype(np.float64)/(60*self.interval))
+            steps = steps.astype(np.int64)
+            inside = (steps >= 0) & (steps < len(self.grid))
+            inside[inside] = self.daylight[steps[inside]]
+            angles = np.asarray(angles, dtype = np.float64)
+            keep = inside & ~np.isnan(angles)
+            steps = steps[keep]
+            angles = angles[keep]
+            if not len(steps):
+                return
+            flat = np.asarray(row_index)[keep]*self.hours + steps*self.interval//60
+
+            error = angles - self.backtrack[steps]
+            absolute = np.abs(error)
+            good = absolute <= self.tolerance
+            #closer to true tracking than to backtracking where the two differ
+            differ = np.abs(self.true_tracking[steps] - self.backtrack[steps]) > self.tolerance
+            not_backtracking = differ & (np.abs(angles - self.true_tracking[steps]) < absolute)
+
+            #sort the chunk by (row, hour) cell and reduce every run of equal cells at once, so a chunk
+            #costs its own size and not the size of the tables
+            order = np.argsort(flat, kind = 'mergesort')
+            cells, starts = np.unique(flat[order], return_index = True)
+            add = lambda values: np.add.reduceat(values[order], starts)
+            self.samples.flat[cells] += np.diff(np.append(starts, len(flat)))
+            self.good.flat[cells] += add(good.astype(np.int64))
+            self.notBacktracking.flat[cells] += add(not_backtracking.astype(np.int64))
+            self.errorSum.flat[cells] += add(error)
+            self.absSum.flat[cells] += add(absolute)
+            self.squareSum.flat[cells] += add(error*error)
+            self.maxAbs.flat[cells] = np.maximum(self.maxAbs.flat[cells], np.maximum.reduceat(absolute[order], starts))
+            self.low.flat[cells] = np.minimum(self.low.flat[cells], np.minimum.reduceat(angles[order], starts))
+            self.high.flat[cells] = np.maximum(self.high.flat[cells], np.maximum.reduceat(angles[order], starts))
+            model = self.backtrack[steps][order]
+            self.modelLow.flat[cells] = np.minimum(self.modelLow.flat[cells], np.minimum.reduceat(model, starts))
+            self.modelHigh.flat[cells] = np.maximum(self.modelHigh.flat[cells], np.maximum.reduceat(model, starts))
+
+    def addChunks(self, chunks):
+        #adds every [times, angles, row index] chunk of a generator such as AngleToCSV.pullRowChunks
+        for chunk in chunks:
+            self.add(*chunk[:3])
+
+    def stuck(self, first = 0, last = None):
+        #(rows, hours) mask of the stuck hours of the rows first to last (all by default), the model range is
+        #taken over the samples the row sent, so a partly reported hour is not compared with the whole hour
+        moved = self.high[first:last] - self.low[first:last]
+        model_moved = self.modelHigh[first:last] - self.modelLow[first:last]
+        return (self.samples[first:last] >= 2) & (moved < self.stuck_range) & (model_moved > self.moving_range)
+
+    def longestStuck(self):
+        #most stuck hours of every row in a run of stuck hours, the hours that cannot tell (nights, no samples, the
+        #model not moving) neither break a run nor count in it
+        stuck = self.stuck()
+        informative = (self.samples >= 2) & (self.modelHigh - self.modelLow > self.moving_range)
+        run = runLengths(stuck | ~informative)
+        #stuck hours per run: the cumulative count of stuck hours at the end of every run minus the one before it
+        counted = np.cumsum(stuck, axis = 1)
+        ends = (run > 0) & ~np.pad(run[:,1:] > 0, ((0, 0), (0, 1)), 'constant')
+        rows, columns = np.nonzero(ends)
+        before = columns - run[rows, columns]
+        per_run = counted[rows, columns] - np.where(before >= 0, counted[rows, np.maximum(before, 0)], 0)
+        longest = np.zeros(len(self.rows), dtype = np.int64)
+        np.maximum.at(longest, rows, per_run)
+        return longest
+
+    def hourlyTable(self, first = 0, last = None):
+        #columns of HOURLY_NAMES for the rows first to last (all by default) and every daylight hour of the period
+        hours = np.nonzero(self.expected)[0]
+        cut = (slice(first, last), hours)
+        rows = np.arange(len(self.rows))[first:last]
+        samples = self.samples[cut]
+        stuck = self.stuck(first, last)[:,hours]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            columns = [np.tile(self.grid_start.astype('datetime64[h]') + hours, len(rows)), np.repeat(rows, len(hours)),
+                       samples, np.tile(self.expected[hours], len(rows)), self.good[cut],
+                       self.errorSum[cut]/samples, self.absSum[cut]/samples, np.sqrt(self.squareSum[cut]/samples),
+                       np.where(samples > 0, self.maxAbs[cut], np.nan), np.where(samples > 0, self.high[cut] - self.low[cut], np.nan),
+                       np.where(samples > 0, self.modelHigh[cut] - self.modelLow[cut], np.nan), stuck.astype(np.int64),
+                       self.notBacktracking[cut]]
+        return [column.ravel() for column in columns]
+
+    def rowTable(self):
+        #columns of ROW_NAMES, one line per row over the whole period
+        stuck = self.stuck()
+        samples = self.samples.sum(axis = 1)
+        expected = np.repeat(self.expected.sum(), len(self.rows))
+        good = self.good.sum(axis = 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return [np.arange(len(self.rows)), samples, expected, good, good/expected,
+                    self.errorSum.sum(axis = 1)/samples, self.absSum.sum(axis = 1)/samples, np.sqrt(self.squareSum.sum(axis = 1)/samples),
+                    np.where(samples > 0, self.maxAbs.max(axis = 1), np.nan), stuck.sum(axis = 1), self.longestStuck(),
+                    self.notBacktracking.sum(axis = 1)]
+
+    def stuckRows(self):
+        #names of the rows stuck for at least min_stuck_hours hours in a row
+        return [self.rows[i] for i in np.nonzero(self.longestStuck() >= self.min_stuck_hours)[0]]
+
+    def write(self, file_name, file_format = 'csv', precision = None, block_rows = 50):
+        #writes '<file_name> hourly' and '<file_name> rows' tables, the first header line names the rows by index
+        #the hourly table goes out block_rows rows at a time, returns the names of the files written
+        header = [['Rows'] + self.rows]
+        with self.metrics.stage('write', files = 2):
+            with fileWriters.ColumnWriter('%s hourly.csv' % file_name, header + [HOURLY_NAMES], HOURLY_NAMES, file_format, precision) as writer:
+                for first in range(0, len(self.rows), block_rows):
+                    writer.write(self.hourlyTable(first, first + block_rows))
+            rows_file = fileWriters.writeColumns('%s rows.csv' % file_name, header + [ROW_NAMES], ROW_NAMES, self.rowTable(), \
+                                                 file_format, precision)
+        return [writer.file_name, rows_file]
@@ -7,24 +7,112 @@ __author__ = "Andrew Seitz"
 __status__ = "v1.0"
 
 
-from sunCalc import SunCalc as SC
-import pymssql
+from sunCalc import SunCalc as SC, year_times
+import minuteFetch
+import metrics as stage_metrics
+import os
+import pipeline
+import fileWriters
+import fileReaders
+import gapFill
+import intervalStats
+from minuteStore import MinuteStore
+from dataSources import CSVSource
+from lazyImport import lazyImport
+import sqlQueries
 from datetime import datetime, timedelta
-import pandas as pd
 import numpy as np
-import ephem
-import csv
+#loaded on first use: the SQL driver is only needed for serverConnect, pandas and the process pool
+#only once there is data, so short runs and machines without the driver start fast
+pymssql = lazyImport('pymssql', 'serverConnect')
+sqlite3 = lazyImport('sqlite3', 'localConnect')
+pd = lazyImport('pandas')
+multiprocessing = lazyImport('multiprocessing')
 
 class WeatherToCSV(object):
 
-    def __init__(self, sunCalc_dict, save_location):
+    def __init__(self, sunCalc_dict, save_location, cache = None, engine = 'ephem', store = None, metrics = None, interval = 60, \
+                 file_format = 'csv', precision = None, gap_fill = False, max_gap = 3, min_coverage = 0., sample_minutes = None, \
+                 sun_step = None):
+        #cache is an optional sunCalc.GeometryCache (or its directory) that keeps yearly sun positions on disk
+        #engine picks the SunCalc.array_calc sun position code, 'ephem' matches point_calc exactly, 'numpy' is much faster
+        #store is an optional minuteStore.MinuteStore (or its directory) keeping pulled minute data locally
+        #metrics is an optional metrics.Metrics (or a hook function) recording time, rows and bytes per stage
+        #interval is the output time step in minutes (60, 30, 15, 5 or 1), below an hour the SAM files get a Minute column
+        #file_format is 'csv', 'gzip' (compressed csv) or 'npz' (binary columns), see fileWriters.ColumnWriter
+        #precision writes floats with that many decimals instead of their full repr
+        #gap_fill fills the hours without data (see gapFill.fillWeather) instead of writing them as 0 (or nan),
+        #runs of up to max_gap hours are interpolated, longer ones get clear sky irradiance and climatology
+        #min_coverage (0 to 1) is the share of its samples an interval needs, intervals with fewer are treated as
+        #having no data, sample_minutes is the sample step behind it (taken from the data when not given)
+        #sun_step (minutes) averages the sun position over every interval, sampled every sun_step minutes and
+        #weighted by clear sky DNI (see SunCalc.interval_calc), instead of taking it at the start of the interval,
+        #so the DNI derived from interval averaged GHI and DHI uses the zenith of the whole interval
+        fileWriters.fileName('', file_format)
+        self.file_format = file_format
+        self.precision = precision
+        if 60 % interval:
+            raise ValueError("interval has to divide an hour, got %s minutes" % interval)
+        self.interval = interval
+        if sun_step is not None and (sun_step <= 0 or interval % sun_step):
+            raise ValueError("sun_step has to divide the interval, got %s minutes" % sun_step)
+        #sun position samples per interval, None for the position at the start
+        self.sun_samples = interval//sun_step if sun_step else None
+        self.gap_fill = gap_fill
+        self.max_gap = max_gap
+        self.gapCounts = None
+        self.min_coverage = min_coverage
+        self.sample_minutes = sample_minutes
+        self.sampleCount = None
+        self.intervalStats = None
         self.sunCalc_dict = sunCalc_dict
-        self.sunCalc_location = SC(location = sunCalc_dict)
+        self.metrics = stage_metrics.resolve(metrics)
+        self.sunCalc_location = SC(location = sunCalc_dict, cache = cache, metrics = self.metrics)
+        self.engine = engine
+        if isinstance(store, str):
+            store = MinuteStore(store)
+        self.store = store
+        self.dialect = 'mssql'
+        #local file source (see fileConnect), None when pulling from a database connection
+        self.source = None
         
     def serverConnect(self, user, password, server):
         #general function to connect to a server    
         self.connection = pymssql.connect(server, user, password)
         self.cursor = self.connection.cursor()
+        self.dialect = 'mssql'
+        self.source = None
+
+    def localConnect(self, db_file):
+        #connect to a local sqlite copy of the database instead (tables named like the last part of database,
+        #TimeStamp columns declared as TIMESTAMP and holding UTC 'YYYY-MM-DD HH:MM:SS' text)
+        #not tied to this thread, the fetch thread of pipelineYear reads the cursor while the caller waits
+        self.connection = sqlite3.connect(db_file, detect_types = sqlite3.PARSE_DECLTYPES, check_same_thread = False)
+        self.cursor = self.connection.cursor()
+        self.dialect = 'sqlite'
+        self.source = None
+
+    def fileConnect(self, path):
+        #read csv exports of the tables instead of a database (see dataSources.CSVSource), needs no driver
+        self.useConnection(CSVSource(path), 'file')
+
+    def useConnection(self, connection, dialect = 'mssql'):
+        #work on a connection opened elsewhere (e.g. the per worker connections of batchRunner), left open afterwards
+        #dialect 'file' takes a dataSources source instead of a connection
+        self.connection = connection
+        self.dialect = dialect
+        if dialect == 'file':
+            self.source = connection
+            self.cursor = None
+        else:
+            self.source = None
+            self.cursor = connection.cursor()
+
+    def useGeometry(self, geometry, site = None):
+        #use the sun position of a siteGeometry.SiteGeometry of many sites (row site, or the one named like
+        #sunCalc_dict) for the years it covers, numpy engine years are then sliced out of the matrix rows of
+        #the site instead of computed, returns those years
+        return geometry.attach(self.sunCalc_location, site, self.interval)
 
     def serverDisconnect(self):
         self.connection.close()
@@ -35,22 +123,50 @@ class WeatherToCSV(object):
         converted_date = converted_date + timedelta(hours = -sunCalc_object.TimeZone)
         return datetime.strftime(converted_date,'%m/%d/%y %H:%M')
 
-    def pullMinuteData(self,date_start,date_end,database,DB_location):
+    def pullMinuteData(self,date_start,date_end,database,DB_location,chunk_size = None,aggregate = False):
         #function that pulls weather data from a database on the loaded server
         #you specify a location (a column in the database) and a date range to pull from
         #data will then be converted to hourly data and set a class attribute in lists
-
-        #write the attributes
-        self.date_start = date_start
-        self.date_end = date_end
-        self.database = database
-        self.DB_location = DB_location
-        
-        date_start_UTC = self.convertToUTC(date_start,self.sunCalc_location)
-        date_end_UTC = self.convertToUTC(date_end,self.sunCalc_location)
-        sqlQuery = """select TimeStamp, GlobalSolar_Avg, DiffuseSolar_Avg, AirTemp_C_Avg, RH_Avg, WindSpd_ms_WVc1, WindSpd_ms_WVc2 from %s
-                    where Location ='%s' and TimeStamp >= '%s' and TimeStamp <= '%s' order by timestamp asc""" % (database, DB_location, date_start_UTC,date_end_UTC)
-        self.cursor.execute(sqlQuery)
+        #with a chunk_size the cursor is streamed with fetchmany into typed numpy arrays instead of lists
+        #with a local store only the time ranges not stored yet are pulled from the server (also into numpy arrays)
+        #with aggregate the server averages the rows per local output interval, self.sampleCount then holds the
+        #number of rows behind every average (per column), the local store is only used for raw minute pulls
+        #a file source (fileConnect) is always read in chunks, there is no server to aggregate and nothing to store
+
+        self.sampleCount = None
+        if self.source is not None:
+            columns = minuteFetch.collectChunks(self.pullMinuteChunks(date_start,date_end,database,DB_location,chunk_size or 50000), \
+                                                [minuteFetch.VALUE_DTYPE]*6)
+            self.timestamp, self.GHI, self.Diff, self.Tamb, self.RH, self.Wspd, self.Wdir = columns
+            return
+
+        if aggregate:
+            self.executeMinuteQuery(date_start,date_end,database,DB_location,execute = False)
+            self.queryMinuteData(self.date_start_UTC,self.date_end_UTC,aggregate = True)
+            dtypes = [minuteFetch.VALUE_DTYPE]*6 + [np.int64]*6
+            #interval stamps come back in local time already
+            columns = minuteFetch.collectChunks(self.metrics.chunks('fetch', minuteFetch.fetchChunks(self.cursor, chunk_size or 50000, 0, dtypes)), dtypes)
+            self.timestamp, self.GHI, self.Diff, self.Tamb, self.RH, self.Wspd, self.Wdir = columns[:7]
+            self.sampleCount = dict(zip(['GHI','Diff','Tamb','RH','Wspd','Wdir'], columns[7:]))
+            return
+
+        if self.store is not None:
+            self.executeMinuteQuery(date_start,date_end,database,DB_location,execute = False)
+            with self.metrics.stage('store') as stage:
+                columns = self.store.pull((database, DB_location), self.date_start_UTC, self.date_end_UTC, self.queryMinuteData, \
+                                          [minuteFetch.VALUE_DTYPE]*6, chunk_size or 50000)
+                stage.count(rows = len(columns[0]), bytes = sum(column.nbytes for column in columns))
+            columns[0] = columns[0] + np.timedelta64(int(round(self.sunCalc_location.TimeZone*60)), 'm') #convert back to local time
+            self.timestamp, self.GHI, self.Diff, self.Tamb, self.RH, self.Wspd, self.Wdir = columns
+            return
+
+        if chunk_size:
+            columns = minuteFetch.collectChunks(self.pullMinuteChunks(date_start,date_end,database,DB_location,chunk_size), \
+                                                [minuteFetch.VALUE_DTYPE]*6)
+            self.timestamp, self.GHI, self.Diff, self.Tamb, self.RH, self.Wspd, self.Wdir = columns
+            return
+
+        self.executeMinuteQuery(date_start,date_end,database,DB_location)
 
         #temp storage
         self.timestamp = []
@@ -61,14 +177,70 @@ class WeatherToCSV(object):
         self.Wspd = []
         self.Wdir = []
         #store from curson
-        for row in self.cursor:
-            self.timestamp.append(row[0] + timedelta(hours = self.sunCalc_location.TimeZone)) #convert back to local time
-            self.GHI.append(row[1])
-            self.Diff.append(row[2])
-            self.Tamb.append(row[3])
-            self.RH.append(row[4])
-            self.Wspd.append(row[5])
-            self.Wdir.append(row[6])
+        with self.metrics.stage('fetch') as stage:
+            for row in self.cursor:
+                self.timestamp.append(row[0] + timedelta(hours = self.sunCalc_location.TimeZone)) #convert back to local time
+                self.GHI.append(row[1])
+                self.Diff.append(row[2])
+                self.Tamb.append(row[3])
+                self.RH.append(row[4])
+                self.Wspd.append(row[5])
+                self.Wdir.append(row[6])
+            stage.count(rows = len(self.timestamp))
+
+    def pullMinuteChunks(self,date_start,date_end,database,DB_location,chunk_size = 50000):
+        #generator version of pullMinuteData, yields [timestamp, GHI, Diff, Tamb, RH, Wspd, Wdir] numpy arrays
+        #of at most chunk_size rows (timestamps already in local time) so memory stays bounded for any date range
+        self.executeMinuteQuery(date_start,date_end,database,DB_location,execute = self.source is None)
+        dtypes = [minuteFetch.VALUE_DTYPE]*6
+        if self.source is not None:
+            chunks = self.source.chunks(database, sqlQueries.WEATHER_COLUMNS, DB_location, self.date_start_UTC, self.date_end_UTC, \
+                                        dtypes, chunk_size, self.sunCalc_location.TimeZone)
+        else:
+            chunks = minuteFetch.fetchChunks(self.cursor, chunk_size, self.sunCalc_location.TimeZone, dtypes)
+        for chunk in self.metrics.chunks('fetch', chunks):
+            yield chunk
+
+    def executeMinuteQuery(self,date_start,date_end,database,DB_location,execute = True):
+        #write the attributes
+        self.date_start = date_start
+        self.date_end = date_end
+        self.database = database
+        self.DB_location = DB_location
+        
+        self.date_start_UTC = self.convertToUTC(date_start,self.sunCalc_location)
+        self.date_end_UTC = self.convertToUTC(date_end,self.sunCalc_location)
+        if execute:
+            self.queryMinuteData(self.date_start_UTC,self.date_end_UTC)
+
+    def queryMinuteData(self,date_start_UTC,date_end_UTC,aggregate = False):
+        #runs the minute query for the stored database/location between two UTC time strings
+        #aggregate asks for averages and counts per local output interval instead (see sqlQueries.minuteQuery)
+        sqlQuery = sqlQueries.minuteQuery(self.dialect, self.database, sqlQueries.WEATHER_COLUMNS, self.DB_location, \
+                                          date_start_UTC, date_end_UTC, aggregate = aggregate, time_shift = self.sunCalc_location.TimeZone, \
+                                          interval = self.interval)
+        with self.metrics.stage('query'):
+            self.cursor.execute(sqlQuery)
+        return self.cursor
+
+    def hourlyAverages(self):
+        #DataFrame of the means of the pulled minute data per output interval (hourly by default),
+        #one row per interval from the first to the last sample, intervals under min_coverage are nan
+        #self.intervalStats keeps the sample count of every interval (see intervalStats.aggregate)
+        with self.metrics.stage('aggregate', rows = len(self.timestamp)):
+            names = ['GHI','Diff','Tamb','RH','Wspd','Wdir']
+            counts = None
+            if self.sampleCount is not None:
+                #interval averages of the server, the coverage goes by the samples behind them
+                if self.min_coverage and self.sample_minutes is None:
+                    raise ValueError("min_coverage on aggregated pulls needs the sample_minutes of the raw data")
+                counts = np.column_stack([self.sampleCount[name] for name in names])
+            self.intervalStats = intervalStats.aggregate(self.timestamp, [self.GHI,self.Diff,self.Tamb,self.RH,self.Wspd,self.Wdir], \
+                                                         self.interval, self.min_coverage, self.sample_minutes, counts, \
+                                                         extremes = False)
+            hour_matrix = pd.DataFrame(self.intervalStats['mean'], index = pd.DatetimeIndex(self.intervalStats['time'].astype('datetime64[ns]')), \
+                                       columns = names)
+        return hour_matrix
 
     def constructBetweenDates(self):
         #essentially a test function
@@ -76,49 +248,14 @@ class WeatherToCSV(object):
         #will not work with SAM unless you give it a years worth of data
         #please use constructYear for data sets with less than a years worth of data
 
-        #algorthim for converting 5 minute date to hourly averages
-        #need numpy arrays in column format (need to transpose the list)
-        #making sure not to modify self.timestamp
-        timestamp = np.array(self.timestamp)
-        timestamp = np.transpose(timestamp)
-        #create a 2d array 6 columns by x rows
-        min_matrix = np.array([self.GHI,self.Diff,self.Tamb,self.RH,self.Wspd,self.Wdir])
-        min_matrix = np.transpose(min_matrix)
-        #create data fram and set my index to my time numpy array
-        min_matrix = pd.DataFrame(min_matrix,index = timestamp, columns= ['GHI','Diff','Tamb','RH','Wspd','Wdir'])
-        #average the 5 minute data by taking the mean over an hour (very flexible)
-        hour_matrix = min_matrix.resample('H', how='mean')
-
-        #pull data from pandas DataFrame Object
-        datetime_list = hour_matrix.index.to_pydatetime()
-        GHI_list = [float(item) for item in hour_matrix['GHI'].get_values()]
-        Diff_list = [float(item) for item in hour_matrix['Diff'].get_values()]
-        Tamb_list = [float(item) for item in hour_matrix['Tamb'].get_values()]
-        RH_list = [float(item) for item in hour_matrix['RH'].get_values()]
-        Wspd_list = [float(item) for item in hour_matrix['Wspd'].get_values()]
-        Wdir_list = [float(item) for item in hour_matrix['Wdir'].get_values()]
-
-        #storage for writing to csv file
-        self.weather = []
-        pressure = 1013.25 #in mBar (sea-level)
-        ###inputs for csv will be [Year, Month,Day,Hour,GHI,DNI,DHI,Tdry,Twet,RH,PRES,Wspd,Wdir,Albedo]
-        for i in range(len(datetime_list)):
-            info = self.sunCalc_location.point_calc(dt1 = ephem.Date(datetime_list[i]))
-            #from Wet-Bulb Temperature from Relative Humidity and Air Temperature by Roland Stull
-            #valid for 101.325 kPa (doesnt account for elevation)
-            wet_temp = Tamb_list[i]*np.arctan(0.151977*(RH_list[i]+8.313659)**(1/2)) + np.arctan(RH_list[i]+Tamb_list[i]) \
-                       - np.arctan(RH_list[i]-1.6767331) + .00391838*(RH_list[i]**(3/2))*np.arctan(.023101*RH_list[i]) - 4.686035
-            if info[2]<0 or info[3]<-70 or info[3]>70:
-                self.weather.append([datetime_list[i].year, datetime_list[i].month,datetime_list[i].day, \
-                                datetime_list[i].hour,0,0,0,Tamb_list[i],wet_temp,RH_list[i], pressure, \
-                                Wspd_list[i], Wdir_list[i],self.sunCalc_dict['Albedo']])
-            else:
-                Ze = 90-info[2]
-                DNI = (GHI_list[i]-Diff_list[i])/np.cos(np.radians(Ze))
-                self.weather.append([datetime_list[i].year, datetime_list[i].month, datetime_list[i].day, \
-                                datetime_list[i].hour, GHI_list[i], DNI, Diff_list[i], Tamb_list[i], wet_temp, \
-                                RH_list[i], pressure, Wspd_list[i], Wdir_list[i], self.sunCalc_dict['Albedo']])
-                
+        hour_matrix = self.hourlyAverages()
+
+        with self.metrics.stage('sun geometry', rows = len(hour_matrix)):
+            sun_pos = self.sunGeometry(hour_matrix.index.values)
+        if self.gap_fill:
+            hour_matrix = self.fillGaps(hour_matrix, sun_pos['elevation'])
+        self.buildWeather(hour_matrix, sun_pos)
+
         #open csv writer, write the headers
         save_date_start = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
         save_date_start = datetime.strftime(save_date_start,'%m%d%y%H')
@@ -126,107 +263,278 @@ class WeatherToCSV(object):
         save_date_end = datetime.strftime(save_date_end,'%m%d%y%H')
 
         file_name = r"%s(%s)_(%s - %s).csv" % (self.sunCalc_dict['Name'],self.DB_location,save_date_start,save_date_end)
+        file_name = fileWriters.fileName(file_name, self.file_format)
         print file_name
-        header1 = ['Source','Location ID', 'City','State','Country','Latitude','Longitude','Time Zone', 'Elevation']
-        header1data = [self.sunCalc_dict['Source'],self.sunCalc_dict['LocationID'],self.sunCalc_dict['Name'], \
-                       self.sunCalc_dict['State'], self.sunCalc_dict['Country'],self.sunCalc_dict['latitude'], \
-                       self.sunCalc_dict['longitude'], self.sunCalc_dict['TimeZone'], self.sunCalc_dict['Elevation']]
-        header2 = ['Year', 'Month','Day','Hour','GHI','DNI','DHI','Tdry','Twet','RH','Pres','Wspd','Wdir','Albedo']
-
-        with open(file_name,'w') as f:
-            csv_write = csv.writer(f,lineterminator = '\n',delimiter = ',')
-            csv_write.writerow(header1)
-            csv_write.writerow(header1data)
-            csv_write.writerow(header2)
-            for row in self.weather:
-                csv_write.writerow(row)
+        self.writeWeather(file_name)
 
 
-    def constructYear(self):
-        #smartly constructs a yearly weather file for NREL SAM simulations
-
-        #check to see if the data given exceeds a 1 year range (i.e. from 2013-2014)
-        #this is maintain compliance with SAM
+    def constructYear(self, workers = None, update = False):
+        #smartly constructs yearly weather files for NREL SAM simulations
+        #a date range over several calendar years (i.e. from 2013-2014) gives one file per year
+        #this is maintain compliance with SAM (8760 hours a year, 8784 in leap years, 105120 rows at 5 minutes)
+        #the whole range is averaged, reindexed and built in one pass, workers > 1 writes the files in parallel
+        #update only builds the intervals of the pulled data and patches them into the files there are (see updateYear),
+        #gap filled files are always built whole since a fill depends on the whole year
+        #returns the names of the files written
         upperBound = datetime.strptime(self.date_start, '%m/%d/%y %I:%M')
         lowerBound = datetime.strptime(self.date_end, '%m/%d/%y %I:%M')
 
-        if upperBound.year == lowerBound.year:
-
-            
-            #algorthim for converting 5 minute date to hourly averages
-            #need numpy arrays in column format (need to transpose the list)
-            #making sure not to modify self.timestamp
-            timestamp = np.array(self.timestamp)
-            timestamp = np.transpose(timestamp)
-            #create a 2d array 6 columns by x rows
-            min_matrix = np.array([self.GHI,self.Diff,self.Tamb,self.RH,self.Wspd,self.Wdir])
-            min_matrix = np.transpose(min_matrix)
-            #create data fram and set my index to my time numpy array
-            min_matrix = pd.DataFrame(min_matrix,index = timestamp, columns= ['GHI','Diff','Tamb','RH','Wspd','Wdir'])
-            #average the 5 minute data by taking the mean over an hour (very flexible)
-            hour_matrix = min_matrix.resample('H', how='mean')
-
-            #fill in empty data for the year from which you are collecting
-            #doesn't matter which you choose and lower and upper are equal in this case
-            year_value = upperBound.year
-            stringLower = '%s-01-01 00:00:00' % (year_value)
-            stringUpper = '%s-12-31 23:00:00' % (year_value)
-            idx = pd.date_range(stringLower,stringUpper, freq = 'H')
-            idx = pd.DatetimeIndex(idx)
-            year_matrix = hour_matrix.reindex(index=idx, fill_value=0)
-            
-            #pull data from pandas DataFrame Object
-            datetime_list = year_matrix.index.to_pydatetime()
-            GHI_list = [float(item) for item in year_matrix['GHI'].get_values()]
-            Diff_list = [float(item) for item in year_matrix['Diff'].get_values()]
-            Tamb_list = [float(item) for item in year_matrix['Tamb'].get_values()]
-            RH_list = [float(item) for item in year_matrix['RH'].get_values()]
-            Wspd_list = [float(item) for item in year_matrix['Wspd'].get_values()]
-            Wdir_list = [float(item) for item in year_matrix['Wdir'].get_values()]                                                                                                  
-
-            #storage for writing to csv file
-            self.weather = []
-            pressure = 1013.25 #in mBar (sea-level)
-            ###inputs for csv will be [Year, Month,Day,Hour,GHI,DNI,DHI,Tdry,Twet,RH,PRES,Wspd,Wdir,Albedo]
-            for i in range(len(datetime_list)):
-                info = self.sunCalc_location.point_calc(dt1 = ephem.Date(datetime_list[i]))
-                #from Wet-Bulb Temperature from Relative Humidity and Air Temperature by Roland Stull
-                #valid for 101.325 kPa (doesnt account for elevation)
-                wet_temp = Tamb_list[i]*np.arctan(0.151977*(RH_list[i]+8.313659)**(1/2)) + np.arctan(RH_list[i]+Tamb_list[i]) \
-                           - np.arctan(RH_list[i]-1.6767331) + .00391838*(RH_list[i]**(3/2))*np.arctan(.023101*RH_list[i]) - 4.686035
-                if info[2]<0 or info[3]<-70 or info[3]>70:
-                    self.weather.append([datetime_list[i].year, datetime_list[i].month,datetime_list[i].day, \
-                                    datetime_list[i].hour,0,0,0,Tamb_list[i],wet_temp,RH_list[i], pressure, \
-                                    Wspd_list[i], Wdir_list[i],self.sunCalc_dict['Albedo']])
-                else:
-                    Ze = 90-info[2]
-                    DNI = (GHI_list[i]-Diff_list[i])/np.cos(np.radians(Ze))
-                    self.weather.append([datetime_list[i].year, datetime_list[i].month, datetime_list[i].day, \
-                                    datetime_list[i].hour, GHI_list[i], DNI, Diff_list[i], Tamb_list[i], wet_temp, \
-                                    RH_list[i], pressure, Wspd_list[i], Wdir_list[i], self.sunCalc_dict['Albedo']])
-                    
-
-
-            file_name = r"%s(%s)_%s.csv" % (self.sunCalc_dict['Name'],self.DB_location,year_value)
-            print file_name
-            header1 = ['Source','Location ID', 'City','State','Country','Latitude','Longitude','Time Zone', 'Elevation']
-            header1data = [self.sunCalc_dict['Source'],self.sunCalc_dict['LocationID'],self.sunCalc_dict['Name'], \
-                           self.sunCalc_dict['State'], self.sunCalc_dict['Country'],self.sunCalc_dict['latitude'], \
-                           self.sunCalc_dict['longitude'], self.sunCalc_dict['TimeZone'], self.sunCalc_dict['Elevation']]
-            header2 = ['Year', 'Month','Day','Hour','GHI','DNI','DHI','Tdry','Twet','RH','Pres','Wspd','Wdir','Albedo']
-
-            with open(file_name,'w') as f:
-                csv_write = csv.writer(f,lineterminator = '\n',delimiter = ',')
-                csv_write.writerow(header1)
-                csv_write.writerow(header1data)
-                csv_write.writerow(header2)
-                for row in self.weather:
-                    csv_write.writerow(row)
+        if upperBound.year <= lowerBound.year:
+            if update and not self.gap_fill:
+                files = self.updateYear()
+                if files is not None:
+                    return files
+
+            hour_matrix = self.hourlyAverages()
+
+            #fill in empty data for every year from which you are collecting
+            #one contiguous index of output intervals from Jan 1 of the first year to Dec 31 of the last
+            years = range(upperBound.year, lowerBound.year + 1)
+            idx = pd.DatetimeIndex(year_times(years[0], years[-1], self.interval).astype('datetime64[ns]'))
+
+            #sun position for every interval of every year, each year loaded from the geometry cache
+            #when this site and year were built before
+            year_pos = [self.sunCalc_location.year_calc(year_value, self.interval, engine = self.engine, samples = self.sun_samples) \
+                        for year_value in years]
+            sun_pos = dict((name, np.concatenate([pos[name] for pos in year_pos])) for name in ['elevation','roll'])
+            if self.gap_fill:
+                year_matrix = self.fillGaps(hour_matrix.reindex(index=idx), sun_pos['elevation'])
+            else:
+                year_matrix = hour_matrix.reindex(index=idx, fill_value=0)
+            self.buildWeather(year_matrix, sun_pos)
+
+            #cut the table into its calendar years
+            header = self.weatherHeader()
+            tasks = []
+            start = 0
+            for year_value, pos in zip(years, year_pos):
+                end = start + len(pos['time'])
+                file_name = fileWriters.fileName(self.yearFileName(self.DB_location, year_value), self.file_format)
+                print file_name
+                tasks.append((file_name, header, header[2], [column[start:end] for column in self.weatherColumns], \
+                              self.file_format, self.precision))
+                start = end
+            with self.metrics.stage('write', rows = len(self.weatherColumns[0]), files = len(tasks)):
+                files = writeWeatherFiles(tasks, workers)
+            return files
         else:
-            print "please enter a date range with the same calendar year"
-            print "This is to insure compliance with NREL SAM weather files"
- 
-
+            raise ValueError("please enter a date range that does not end before it starts: %s - %s" % (self.date_start, self.date_end))
+
+    def updateYear(self):
+        #update mode of constructYear for daily refreshes: builds only the intervals from date_start (whole intervals)
+        #to the last pulled sample and writes them over the same rows of the existing yearly files, the header rows
+        #and all other rows stay as they are. self.updatedRows gets the number of rows that changed per file
+        #returns the names of the files, None when a file is not there yet (it needs a whole year built)
+        hour_matrix = self.hourlyAverages()
+        times = hour_matrix.index.values.astype('datetime64[m]')
+        in_years = fileWriters.updateIntervals(times, self.date_start, self.interval)
+        files = [fileWriters.fileName(self.yearFileName(self.DB_location, year_value), self.file_format) for year_value, in_year in in_years]
+        missing = [file_name for file_name in files if not os.path.exists(file_name)]
+        if missing:
+            print "%s not built yet, building whole years" % ', '.join(missing)
+            return None
+
+        header = self.weatherHeader()
+        self.updatedRows = {}
+        for file_name, (year_value, in_year) in zip(files, in_years):
+            sun_pos = self.sunPositions(times[in_year])
+            columns = self.buildWeather(hour_matrix[in_year], sun_pos)
+            first_row = (times[in_year][0] - np.datetime64('%s-01-01' % year_value, 'm')).astype(np.int64)//self.interval
+            with self.metrics.stage('write', rows = len(columns[0]), files = 1):
+                self.updatedRows[file_name] = fileWriters.patchColumns(file_name, header, header[2], first_row, columns, \
+                                                                       self.file_format, self.precision)
+            print "%s: %s rows changed" % (file_name, self.updatedRows[file_name])
+        return files
+
+    def updateStart(self, DB_location, year_value):
+        #date_start for pullMinuteData before constructYear(update = True): the start of the last interval with data
+        #(any of the measured columns not 0) in the year file of DB_location, Jan 1 when there is none yet
+        #the date strings have no AM/PM, an afternoon start comes out 12 hours early and pulls those hours again
+        file_name = fileWriters.fileName(self.yearFileName(DB_location, year_value), self.file_format)
+        times = year_times(year_value, year_value, self.interval)
+        start = times[0]
+        if os.path.exists(file_name):
+            header = self.weatherHeader()
+            names = ['GHI', 'DHI', 'Tdry', 'RH', 'Wspd', 'Wdir']
+            columns = fileReaders.readTable(file_name, len(header), header[2], names, [np.float64]*len(names))
+            with_data = np.flatnonzero(np.any([column != 0 for column in columns], axis = 0))
+            if len(with_data):
+                start = times[with_data[-1]]
+        return datetime.strftime(start.astype(datetime), '%m/%d/%y %I:%M')
+
+    def sunPositions(self, times):
+        #sun position at local times of one year on the interval grid, read out of the cached year when there
+        #is a geometry cache, computed for those times only when there is none
+        if self.sunCalc_location.cache is not None:
+            year_value = times[0].astype('datetime64[Y]').astype(int) + 1970
+            sun_pos = self.sunCalc_location.year_calc(year_value, self.interval, engine = self.engine, samples = self.sun_samples)
+            steps = (times - np.datetime64('%s-01-01' % year_value, 'm')).astype(np.int64)//self.interval
+            return dict((name, np.asarray(sun_pos[name])[steps]) for name in ['elevation','roll'])
+        with self.metrics.stage('sun geometry', rows = len(times)):
+            return self.sunGeometry(times)
+
+    def sunGeometry(self, times):
+        #sun position for the intervals starting at local times: at their start, or over the whole interval with a sun_step
+        if self.sun_samples:
+            return self.sunCalc_location.interval_calc(times, self.interval, self.sun_samples)
+        return self.sunCalc_location.array_calc(times, engine = self.engine)
+
+    def fillGaps(self, hour_matrix, elevation):
+        #hour_matrix with its nan hours filled, self.gapCounts gets the values filled per column and method
+        with self.metrics.stage('gap fill', rows = len(hour_matrix)) as stage:
+            columns = dict((name, hour_matrix[name].values) for name in hour_matrix.columns)
+            filled, self.gapCounts = gapFill.fillWeather(columns, hour_matrix.index.values, elevation, \
+                                                         float(self.sunCalc_dict['Elevation']), self.max_gap)
+            for name, counts in self.gapCounts.items():
+                stage.count(**dict(('%s_%s' % (name, method), amount) for method, amount in counts.items() if amount))
+        return pd.DataFrame(filled, index = hour_matrix.index, columns = hour_matrix.columns)
+
+    def buildWeather(self, hour_matrix, sun_pos):
+        #turns hourly (or interval) averages plus the sun position at each time into the SAM weather table
+        #every column is computed as a whole array, self.weatherColumns ends up holding the columns to write
+        ###inputs for csv will be [Year, Month,Day,Hour,GHI,DNI,DHI,Tdry,Twet,RH,PRES,Wspd,Wdir,Albedo]
+        with self.metrics.stage('build', rows = len(hour_matrix)):
+            return self._buildWeather(hour_matrix, sun_pos)
+
+    def _buildWeather(self, hour_matrix, sun_pos):
+        index = pd.DatetimeIndex(hour_matrix.index)
+        GHI = hour_matrix['GHI'].values.astype(np.float64)
+        Diff = hour_matrix['Diff'].values.astype(np.float64)
+        Tamb = hour_matrix['Tamb'].values.astype(np.float64)
+        RH = hour_matrix['RH'].values.astype(np.float64)
+        elevation = np.asarray(sun_pos['elevation'])
+        roll = np.asarray(sun_pos['roll'])
+
+        with np.errstate(invalid='ignore'):
+            #from Wet-Bulb Temperature from Relative Humidity and Air Temperature by Roland Stull
+            #valid for 101.325 kPa (doesnt account for elevation)
+            wet_temp = Tamb*np.arctan(0.151977*(RH+8.313659)**(1/2)) + np.arctan(RH+Tamb) \
+                       - np.arctan(RH-1.6767331) + .00391838*(RH**(3/2))*np.arctan(.023101*RH) - 4.686035
+            #no irradiance at night or past the +-70 degree roll limit of the tracker
+            dark = (elevation<0) | (roll<-70) | (roll>70)
+            Ze = 90-elevation
+            DNI = (GHI-Diff)/np.cos(np.radians(Ze))
+
+        #object columns so the dark hours are written as a plain 0 like the rest of our SAM files
+        irradiance = np.array([GHI, DNI, Diff]).astype(object)
+        irradiance[:,dark] = 0
+
+        rows = len(index)
+        pressure = 1013.25 #in mBar (sea-level)
+        columns = [index.year, index.month, index.day, index.hour, irradiance[0], irradiance[1], irradiance[2],
+                   Tamb, wet_temp, RH, np.repeat(pressure, rows), hour_matrix['Wspd'].values.astype(np.float64),
+                   hour_matrix['Wdir'].values.astype(np.float64), np.repeat(self.sunCalc_dict['Albedo'], rows)]
+        if self.interval < 60:
+            columns.insert(4, index.minute)
+        self.weatherColumns = [np.asarray(column) for column in columns]
+        return self.weatherColumns
+
+    @property
+    def weather(self):
+        #the weather table as a list of rows, built from self.weatherColumns on demand
+        return list(zip(*[column.tolist() for column in self.weatherColumns]))
+
+    def weatherHeader(self):
+        #the three SAM header rows
+        header1 = ['Source','Location ID', 'City','State','Country','Latitude','Longitude','Time Zone', 'Elevation']
+        header1data = [self.sunCalc_dict['Source'],self.sunCalc_dict['LocationID'],self.sunCalc_dict['Name'], \
+                       self.sunCalc_dict['State'], self.sunCalc_dict['Country'],self.sunCalc_dict['latitude'], \
+                       self.sunCalc_dict['longitude'], self.sunCalc_dict['TimeZone'], self.sunCalc_dict['Elevation']]
+        header2 = ['Year', 'Month','Day','Hour','GHI','DNI','DHI','Tdry','Twet','RH','Pres','Wspd','Wdir','Albedo']
+        if self.interval < 60:
+            header2.insert(4, 'Minute')
+        return [header1, header1data, header2]
+
+    def yearFileName(self, DB_location, year_value):
+        #yearly SAM file name, files below an hour are marked with their interval
+        if self.interval < 60:
+            return r"%s(%s)_%s_%smin.csv" % (self.sunCalc_dict['Name'],DB_location,year_value,self.interval)
+        return r"%s(%s)_%s.csv" % (self.sunCalc_dict['Name'],DB_location,year_value)
+
+    def writeWeather(self, file_name):
+        #writes the SAM header rows followed by the weather table
+        header = self.weatherHeader()
+        with self.metrics.stage('write', rows = len(self.weatherColumns[0]), files = 1):
+            writeWeatherFile((fileWriters.fileName(file_name, self.file_format), header, header[2], self.weatherColumns, \
+                              self.file_format, self.precision))
+
+    def pipelineYear(self,date_start,date_end,database,DB_location,chunk_size = 50000,queue_size = 4):
+        #opt-in pipelined pullMinuteData + constructYear, writes the same files (one per calendar year of the range)
+        #a fetch thread streams the cursor in chunks, a compute thread averages every interval as soon as it is complete
+        #and builds its SAM columns, the calling thread writes them, bounded queues keep the three in step
+        #the writer moves on to the file of the next year when the blocks cross into it
+        #gap filling needs the whole year (climatology, both sides of a gap) so it runs serially
+        #returns the names of the files written
+        upperBound = datetime.strptime(date_start, '%m/%d/%y %I:%M')
+        lowerBound = datetime.strptime(date_end, '%m/%d/%y %I:%M')
+
+        if upperBound.year > lowerBound.year:
+            raise ValueError("please enter a date range that does not end before it starts: %s - %s" % (date_start, date_end))
+        if self.gap_fill:
+            self.pullMinuteData(date_start,date_end,database,DB_location,chunk_size)
+            return self.constructYear()
+
+        #one contiguous index of output intervals from Jan 1 of the first year to Dec 31 of the last, as in constructYear
+        years = range(upperBound.year, lowerBound.year + 1)
+        idx = pd.DatetimeIndex(year_times(years[0], years[-1], self.interval).astype('datetime64[ns]'))
+        year_pos = [self.sunCalc_location.year_calc(year_value, self.interval, engine = self.engine, samples = self.sun_samples) \
+                    for year_value in years]
+        sun_pos = dict((name, np.concatenate([pos[name] for pos in year_pos])) for name in ['elevation','roll'])
+        #index of the first interval of every year, and the end of the last
+        bounds = np.cumsum([0] + [len(pos['time']) for pos in year_pos])
+
+        def buildColumns(blocks):
+            for start, means in blocks:
+                end = start + len(means)
+                hour_matrix = pd.DataFrame(means, index = idx[start:end], columns = ['GHI','Diff','Tamb','RH','Wspd','Wdir'])
+                yield start, self.buildWeather(hour_matrix, dict((name, sun_pos[name][start:end]) for name in ['elevation','roll']))
+
+        def hourly(chunks):
+            return pipeline.hourlyBlocks(chunks, idx[0], len(idx), 6, 0, self.interval, self.min_coverage, self.sample_minutes)
+
+        header = self.weatherHeader()
+        writers = []
+
+        def write(block):
+            #the part of the block in every year goes to the file of that year, opened when its first rows arrive
+            start, columns = block
+            end = start + len(columns[0])
+            for k in range(len(years)):
+                low, high = max(start, bounds[k]), min(end, bounds[k + 1])
+                if low >= high:
+                    continue
+                if len(writers) <= k:
+                    if writers:
+                        writers[-1].close()
+                    file_name = fileWriters.fileName(self.yearFileName(DB_location, years[k]), self.file_format)
+                    print file_name
+                    writers.append(fileWriters.ColumnWriter(file_name, header, header[2], self.file_format, self.precision))
+                writers[k].write([column[low - start:high - start] for column in columns])
+
+        try:
+            with self.metrics.stage('pipeline', files = len(years)):
+                pipeline.Pipeline(queue_size).run(self.pullMinuteChunks(date_start,date_end,database,DB_location,chunk_size), \
+                                                  [hourly, buildColumns], write)
+        finally:
+            if writers:
+                writers[-1].close()
+        return [writer.file_name for writer in writers]
+
+
+def writeWeatherFile(task):
+    #writes one (file_name, header rows, column names, weather columns, file_format, precision) SAM file,
+    #module level so a multiprocessing pool can run it
+    return fileWriters.writeColumns(*task)
+
+def writeWeatherFiles(tasks, workers = None):
+    #writes every task, in a pool of workers processes when workers > 1, returns the names of the files written
+    if workers and workers > 1:
+        pool = multiprocessing.Pool(workers)
+        files = pool.map(writeWeatherFile, tasks)
+        pool.close()
+        pool.join()
+        return files
+    return [writeWeatherFile(task) for task in tasks]
 
 
 def example():
@@ -261,7 +569,7 @@ def example():
     converter.serverConnect(user,password,server)
     converter.pullMinuteData(date_start,date_end,database,DB_location)
     converter.constructYear()
-    connverter.serverDisconnect()
+    converter.serverDisconnect()
 
 
 